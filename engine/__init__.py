@@ -0,0 +1,42 @@
+"""
+BM25 search engine of the small and large corpus.
+
+    collection      the corpus and the rule of its document ids (SmallCorpus, LargeCorpus)
+    search          Index (build, update and load the index) and Searcher (rank the documents)
+    bm25            BM25 scoring with MaxScore top-k
+    indexing        parallel and incremental indexing
+    index_format    the memory mapped binary index
+    compact_index   the in-memory index built while indexing
+    positions       positional index of the words, phrase queries
+    spimi           indexing within a memory budget, segments on disk merged into the index
+    tokenizer       tokenizer and stem cache
+    document_reader streaming reader of plain, TREC packed and gzip documents
+    batch_search    NumPy batch scoring of many queries
+    query_cache     LRU cache of query results
+    postings_cache  decoded postings cache within a memory budget (LRU or TinyLFU)
+    tiers           tiered postings, first tiers and tails of the words
+    evaluation      evaluation of run files against the qrels with paired significance tests
+    tuning          sweep of the BM25 k, b and idf evaluated against the qrels
+    profiling       per-stage wall and CPU time and counters of indexing and searching
+    server          HTTP query server of the server mode
+    shards          sharded index searched by scatter-gather
+    benchmark       benchmark of indexing, query latency and memory on synthetic collections
+    cli             the command line, python3 -m engine
+"""
+import importlib
+
+# the names exported by the package and their modules, the modules are imported when a name is
+# first used, so `python3 -m engine.tokenizer` and the like do not import the whole package first
+_EXPORTS = {
+    'Collection': 'collection', 'SmallCorpus': 'collection', 'LargeCorpus': 'collection', 'COLLECTIONS': 'collection',
+    'BM25': 'bm25',
+    'Tokenizer': 'tokenizer',
+    'Index': 'search', 'Searcher': 'search',
+}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
@@ -0,0 +1,131 @@
+"""
+Batch BM25 scoring with NumPy, used by the automatic mode of the search engine.
+
+The postings of the query words are turned into the rows of a sparse
+term-document matrix holding the BM25 weight of every posting (idf times the
+saturated, length normalized tf). A block of queries is then scored at once:
+the query-term matrix times this matrix is computed by one np.bincount over
+(query, doc_no), and the top-k of every query is selected with argpartition.
+
+The weights are computed with the same operations in the same order as
+BM25._term_score and added in the same word order as BM25.score, so the
+scores are exactly the same as scoring the queries one by one.
+"""
+import math
+import numpy as np
+from . import query_cache
+from . import profiling
+
+# the most (query, document) scores held in memory at once
+BLOCK_SIZE = 1 << 22
+
+
+class BatchBM25:
+    """
+        score many queries against the index of a BM25 object
+    """
+
+    def __init__(self, bm25):
+        self.bm25 = bm25
+        self.lengths = np.array(bm25.lengths, dtype=np.float64)
+        self.N = len(self.lengths)
+        self._rows = dict()
+
+    def _row(self, word):
+        """
+            the row of `word` in the term-document matrix
+            return: (doc_no array, weight array)
+        """
+        if word not in self._rows:
+            bm25 = self.bm25
+            postings = bm25.postings.get(word) or ()
+            doc_nos = np.array([doc_no for doc_no, _ in postings], dtype=np.int64)
+            impacts = bm25.impacts.get(word) if bm25.impacts is not None else None
+            if impacts is not None:
+                # precomputed in the index
+                self._rows[word] = doc_nos, np.array(impacts, dtype=np.float64)
+                return self._rows[word]
+            tf = np.array([tf for _, tf in postings], dtype=np.float64)
+            # the same as BM25._term_score, math.log2 is used as np.log2 may differ in the last bit
+            idf = math.log2((bm25.N - bm25.frequency.get(word, 0) + 0.5) / (bm25.frequency.get(word, 0) + 0.5))
+            weights = (tf * (bm25.k + 1)) \
+                / (tf + bm25.k * (1 - bm25.b + bm25.b * self.lengths[doc_nos] / bm25.avg_doc_len)) \
+                * idf
+            self._rows[word] = doc_nos, np.maximum(weights, 0)
+        return self._rows[word]
+
+    def _top(self, scores, k):
+        # the k highest positive scores, equal scores keep the document order
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            kth = np.partition(scores[candidates], len(candidates) - k)[len(candidates) - k]
+            candidates = candidates[scores[candidates] >= kth]
+        # candidates are in doc_no order, lexsort is stable
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        results = [(self.bm25.doc_ids[doc_no], score) for doc_no, score in zip(candidates.tolist(), scores[candidates].tolist())]
+        # less than k documents have a positive score, fill with score 0 in document order as BM25.search
+        doc_no = 0
+        while len(results) < k and doc_no < self.N:
+            if scores[doc_no] <= 0:
+                results.append((self.bm25.doc_ids[doc_no], 0))
+            doc_no += 1
+        return results
+
+    def search(self, queries, k=15):
+        """
+            parameters:
+                queries: list of query(str)
+                k: number of results of each query
+            return: list of [(doc_id, score)] of every query, the same as BM25.search
+        """
+        profiling.count('queries', len(queries))
+        with profiling.stage('query terms'):
+            words = [self.bm25.terms(query) for query in queries]
+        cache = self.bm25.cache
+        if cache is None:
+            with profiling.stage('batch score'):
+                return self._search(words, k)
+        keys = [query_cache.cache_key(query, k) for query in words]
+        results = [None] * len(words)
+        first = dict()  # the first query of each key
+        with profiling.stage('cache'):
+            for i, key in enumerate(keys):
+                if key not in first:
+                    first[key] = i
+                    results[i] = cache.get(key)
+        todo = [i for i in first.values() if results[i] is None]
+        profiling.count('cache hits', len(first) - len(todo))
+        with profiling.stage('batch score'):
+            scored = self._search([words[i] for i in todo], k)
+        for i, scores in zip(todo, scored):
+            results[i] = scores
+            cache.put(keys[i], scores)
+        # a query repeated in the batch is a cache hit
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = cache.get(key) or results[first[key]]
+        return results
+
+    def _search(self, words, k):
+        block = max(1, BLOCK_SIZE // max(1, self.N))
+        results = []
+        for start in range(0, len(words), block):
+            keys = []
+            weights = []
+            for i, query in enumerate(words[start:start + block]):
+                for word in query:
+                    with profiling.stage('read postings'):
+                        doc_nos, row = self._row(word)
+                    keys.append(doc_nos + i * self.N)
+                    weights.append(row)
+            size = min(block, len(words) - start)
+            profiling.count('postings read', sum(len(doc_nos) for doc_nos in keys))
+            if keys:
+                # bincount adds the weights one by one in order, the same order as BM25.score
+                scores = np.bincount(np.concatenate(keys), np.concatenate(weights), minlength=size * self.N)
+            else:
+                scores = np.zeros(size * self.N)
+            scores = scores.reshape(size, self.N)
+            for i in range(size):
+                results.append(self._top(scores[i], k))
+        return results
@@ -0,0 +1,366 @@
+"""
+Benchmark of the search engine on synthetic collections, run in the directory of a
+corpus (its files/porter.py stems the words and its stopwords are the most
+frequent words):
+
+    python3 -m engine.benchmark [--corpus small|large] [--sizes 1000,4000] [--lengths 1,2,4,8]
+                                [--queries 200] [--repeat 3] [-j <jobs>] [-o benchmark.json] [--compare old.json]
+
+For every size a collection is generated with the words of the documents and
+queries drawn from a Zipf distribution over a made-up vocabulary, named like the
+documents of the corpus (numbers or GX...), and the same seed always generates
+the same collection. In a fresh process per size it measures:
+    preprocess    indexing.preprocess_doc, documents and tokens per second
+    build         building the index file (Index.open when there is no index)
+    open / load   Index.open of the built index (checks the documents) and Index.load (mmap only)
+    score         BM25.score of the queries of each length, p50/p95/p99 ms
+    search        the top 15 of the same queries (MaxScore), p50/p95/p99 ms
+    cold start    a new interpreter running the interactive mode on the built index: the import
+                  time of the modules (-X importtime) and the time until the first results are printed
+    peak_rss_mb   the peak resident memory of the process
+
+Every size is measured --repeat times (in as many fresh processes), a metric is
+the median of the runs and its spread the difference of the highest and lowest.
+The results are written as JSON. With --compare the metrics are compared with an
+older result file, a metric is a regression if it is worse by more than the
+threshold (default 20%) and by more than the spreads of both results together
+(the runs do not overlap), and the latencies by at least MIN_MS. The exit status is 1 if any
+metric is a regression.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import getopt
+import shutil
+import platform
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+from . import indexing
+from . import compact_index
+from .collection import COLLECTIONS
+from .search import Index, Searcher
+from .tokenizer import Tokenizer, read_stopwords
+
+FORMAT = 2
+DEFAULTS = {'corpus': 'large', 'sizes': [1000, 4000], 'lengths': [1, 2, 4, 8], 'queries': 200,
+            'vocabulary': 50000, 'zipf': 1.05, 'doc_length': [50, 500], 'seed': 1, 'jobs': 1, 'repeat': 3}
+PERCENTILES = (50, 95, 99)
+# the change of a latency (the metrics in ms) smaller than this is not a regression, whatever the ratio
+MIN_MS = 0.05
+
+
+def make_vocabulary(size, stopwords, rng):
+    """
+        the stopwords, then made-up words of a few syllables with english suffixes for the stemmer
+    """
+    words = list(dict.fromkeys(sorted(stopwords)))[:100]
+    seen = set(words)
+    consonants, vowels = 'bcdfghjklmnprstvwz', 'aeiou'
+    suffixes = ['', '', '', 's', 'ing', 'ed', 'ly', 'ation', 'ness', 'er']
+    while len(words) < size:
+        word = ''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(1, 4)))
+        word += rng.choice(suffixes)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_weights(size, s):
+    """
+        the cumulative weights of rank 1..size, for random.choices
+    """
+    weights = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1 / rank ** s
+        weights.append(total)
+    return weights
+
+
+def document_name(kind, i):
+    if kind == 'small':
+        return str(i + 1)
+    return f'GX{i // 10000:03d}-{i // 100 % 100:02d}-{i:07d}'
+
+
+def generate(root, config, documents):
+    """
+        write a synthetic collection of `documents` documents to `root`
+        return: number of tokens of the documents, {query length: list of queries}
+    """
+    rng = random.Random(config['seed'])
+    os.makedirs(os.path.join(root, 'files'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'documents'), exist_ok=True)
+    stopwords = read_stopwords(config['stopwords'])
+    shutil.copy(config['stopwords'], os.path.join(root, 'files', 'stopwords.txt'))
+    vocabulary = make_vocabulary(config['vocabulary'], stopwords, rng)
+    weights = zipf_weights(len(vocabulary), config['zipf'])
+    tokens = 0
+    shortest, longest = config['doc_length']
+    for i in range(documents):
+        words = rng.choices(vocabulary, cum_weights=weights, k=rng.randint(shortest, longest))
+        tokens += len(words)
+        lines = []
+        for start in range(0, len(words), 12):
+            line = words[start:start + 12]
+            line[0] = line[0].capitalize()
+            lines.append(' '.join(line) + rng.choice('..,;!?'))
+        with open(os.path.join(root, 'documents', document_name(config['corpus'], i)), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    # the queries of every length, drawn from the same distribution
+    queries = {length: [' '.join(rng.choices(vocabulary, cum_weights=weights, k=length))
+                        for _ in range(config['queries'])] for length in config['lengths']}
+    return tokens, queries
+
+
+def percentiles(seconds):
+    """
+        return: {p50_ms, p95_ms, p99_ms, mean_ms} of the latencies (nearest rank)
+    """
+    ranked = sorted(seconds)
+    result = {f'p{p}_ms': ranked[max(0, math.ceil(p / 100 * len(ranked)) - 1)] * 1000 for p in PERCENTILES}
+    result['mean_ms'] = sum(ranked) / len(ranked) * 1000
+    return result
+
+
+def cold_start(root, corpus, query):
+    """
+        start the interactive mode on the collection in `root` in a new interpreter and search `query`,
+        as a user would with the index built and the stems cached
+        return: {cold_import_ms, cold_first_result_ms}, the import time of the modules and the time from
+                starting the interpreter until the results are printed (None if they are not)
+    """
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # files.porter is imported from the directory of the corpus, as by this process
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), package]))
+    command = [sys.executable, '-u', '-m', 'engine', '--corpus', corpus, '-m', 'interactive']
+    first_result = None
+    start = time.perf_counter()
+    with subprocess.Popen(command, cwd=root, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                          text=True) as process:
+        process.stdin.write(query + '\nQUIT\n')
+        process.stdin.flush()
+        for line in process.stdout:
+            # the line after the results, '(n of N documents scored in t ms)'
+            if line.startswith('('):
+                first_result = (time.perf_counter() - start) * 1000
+                break
+        process.communicate()
+    # the self time of every module imported, in microseconds
+    imports = subprocess.run(command[:1] + ['-X', 'importtime'] + command[1:], cwd=root, env=env,
+                             input=query + '\nQUIT\n', stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    microseconds = [line.split('|')[0].split(':')[-1] for line in imports.stderr.splitlines() if line.startswith('import time:')]
+    return {'cold_import_ms': sum(int(n) for n in microseconds if n.strip().isdigit()) / 1000,
+            'cold_first_result_ms': first_result}
+
+
+def run_size(config, documents):
+    """
+        generate a collection and measure it, run in its own process so the peak memory is its own
+        return: the result of this size
+    """
+    root = tempfile.mkdtemp(prefix='bm25-benchmark-')
+    metrics = dict()
+    try:
+        tokens, queries = generate(root, config, documents)
+        collection = COLLECTIONS[config['corpus']](root)
+        # the messages of indexing are not part of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            tokenizer = Tokenizer(read_stopwords(collection.stopwords), collection.stem_cache)
+            start = time.perf_counter()
+            inverted = indexing.preprocess_doc(collection, tokenizer, config['jobs'])
+            seconds = time.perf_counter() - start
+            metrics['preprocess_seconds'] = seconds
+            metrics['preprocess_docs_per_s'] = inverted.N / seconds
+            metrics['preprocess_tokens_per_s'] = tokens / seconds
+            del inverted
+            # the index is built with cold stems as well
+            if os.path.exists(collection.stem_cache):
+                os.remove(collection.stem_cache)
+            start = time.perf_counter()
+            Index(collection).open(config['jobs'])
+            metrics['build_seconds'] = time.perf_counter() - start
+            metrics['index_mb'] = os.path.getsize(collection.index) / (1 << 20)
+            start = time.perf_counter()
+            index = Index(collection).open()
+            metrics['open_ms'] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            Index(collection).load()
+            metrics['load_ms'] = (time.perf_counter() - start) * 1000
+        metrics.update(cold_start(root, config['corpus'], queries[config['lengths'][0]][0]))
+        searcher = Searcher(index, cache_size=0)
+        bm25 = searcher.bm25
+        for length, texts in queries.items():
+            # the stems of the query words are not part of the latency
+            for query in texts:
+                bm25.terms(query)
+            for name, search in (('score', bm25.score), ('search', lambda query: searcher.search(query, 15))):
+                seconds = []
+                for query in texts:
+                    start = time.perf_counter()
+                    search(query)
+                    seconds.append(time.perf_counter() - start)
+                for key, value in percentiles(seconds).items():
+                    metrics[f'{name}{length}_{key}'] = value
+        metrics['peak_rss_mb'] = compact_index.peak_memory()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return {'documents': documents, 'tokens': tokens, 'metrics': metrics}
+
+
+def median_of(runs):
+    """
+        return: the result of a size measured by the `runs` of run_size, every metric is the median of the
+                runs and `spread` has the difference of the highest and lowest of every metric
+    """
+    metrics = dict()
+    spread = dict()
+    for name in runs[0]['metrics']:
+        values = sorted(run['metrics'][name] for run in runs if run['metrics'][name] is not None)
+        if len(values) < len(runs):
+            metrics[name] = None
+            continue
+        middle = len(values) // 2
+        metrics[name] = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+        spread[name] = values[-1] - values[0]
+    return {'documents': runs[0]['documents'], 'tokens': runs[0]['tokens'], 'metrics': metrics, 'spread': spread}
+
+
+def benchmark(config):
+    results = []
+    for documents in config['sizes']:
+        runs = []
+        for _ in range(config['repeat']):
+            # a fresh process for every run
+            with multiprocessing.Pool(1) as pool:
+                runs.append(pool.apply(run_size, (config, documents)))
+        result = median_of(runs)
+        results.append(result)
+        metrics = result['metrics']
+        print(f'{documents} documents ({result["tokens"]} tokens): '
+              f'{metrics["preprocess_docs_per_s"]:,.0f} docs/s, {metrics["preprocess_tokens_per_s"]:,.0f} tokens/s, '
+              f'build {metrics["build_seconds"]:.2f}s, load {metrics["load_ms"]:.2f} ms, '
+              f'first result {metrics["cold_first_result_ms"] or 0:.0f} ms ({metrics["cold_import_ms"]:.0f} ms imports), '
+              f'peak {metrics["peak_rss_mb"] or 0:.0f} MB')
+        for length in config['lengths']:
+            print(f'    {length} word queries: score p50/p95/p99 ' +
+                  '/'.join(f'{metrics[f"score{length}_p{p}_ms"]:.2f}' for p in PERCENTILES) +
+                  ' ms, search ' + '/'.join(f'{metrics[f"search{length}_p{p}_ms"]:.2f}' for p in PERCENTILES) + ' ms')
+    return {
+        'format': FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in config.items() if key != 'stopwords'},
+        'results': results,
+    }
+
+
+def compare(old, new, threshold=0.2):
+    """
+        print the change of every metric of the sizes in both results
+        return: list of the metrics worse than `threshold` and than the noise (see the module docstring)
+    """
+    if old.get('config') != new.get('config'):
+        print('warning: the results are not measured with the same configuration')
+    # the results of format 1 are a single run, their spread is unknown
+    old_results = {result['documents']: (result['metrics'], result.get('spread', dict())) for result in old['results']}
+    worse = []
+    for result in new['results']:
+        if result['documents'] not in old_results:
+            continue
+        before, old_spread = old_results[result['documents']]
+        spread = result.get('spread', dict())
+        for name, value in result['metrics'].items():
+            if before.get(name) is None or value is None or not before[name]:
+                continue
+            change = value / before[name] - 1
+            # the throughputs are better higher, the rest (time, latency, memory) lower
+            regression = -change if name.endswith('_per_s') else change
+            # the runs of the two results do not overlap when the medians differ by more than both spreads
+            noise = max(old_spread.get(name, 0) + spread.get(name, 0), MIN_MS if name.endswith('_ms') else 0)
+            flag = ''
+            if regression > threshold and abs(value - before[name]) > noise:
+                flag = '  REGRESSION'
+                worse.append(f'{result["documents"]} documents {name}')
+            print(f'{result["documents"]:>8} {name:<28}{before[name]:14.3f}{value:14.3f}{change:+9.1%}{flag}')
+    return worse
+
+
+USAGE = '''Usage: python3 -m engine.benchmark [options], in the directory of a corpus
+    --corpus <name>      small or large, how the documents are named (default large)
+    --sizes <n,...>      number of documents of the collections (default 1000,4000)
+    --lengths <n,...>    number of words of the queries (default 1,2,4,8)
+    --queries <n>        number of queries of each length (default 200)
+    --vocabulary <n>     number of distinct words (default 50000)
+    --seed <n>           the seed of the generated collections (default 1)
+    --repeat <n>         number of runs of every size, the metrics are their medians (default 3)
+    -j <jobs>            number of processes used for indexing (default 1)
+    -o <file>            the JSON file of the results (default benchmark.json)
+    --compare <file>     compare with the results of an older run
+    --threshold <ratio>  the change of a metric reported as a regression if it is also more than the
+                         spread of the runs (default 0.2)
+'''
+
+
+def main():
+    config = dict(DEFAULTS)
+    output = 'benchmark.json'
+    old = None
+    threshold = 0.2
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:o:", ["corpus=", "sizes=", "lengths=", "queries=", "vocabulary=",
+                                                           "seed=", "repeat=", "compare=", "threshold="])
+        for opt, arg in opts:
+            if opt == '-h':
+                print(USAGE)
+                sys.exit()
+            elif opt == '--corpus':
+                if arg not in COLLECTIONS:
+                    raise ValueError(arg)
+                config['corpus'] = arg
+            elif opt in ('--sizes', '--lengths'):
+                config[opt[2:]] = [int(n) for n in arg.split(',')]
+            elif opt in ('--queries', '--vocabulary', '--seed', '--repeat'):
+                config[opt[2:]] = int(arg)
+            elif opt == '-j':
+                config['jobs'] = int(arg)
+            elif opt == '-o':
+                output = arg
+            elif opt == '--compare':
+                old = arg
+            elif opt == '--threshold':
+                threshold = float(arg)
+        if config['repeat'] < 1:
+            raise ValueError
+    except (getopt.GetoptError, ValueError):
+        print(USAGE)
+        sys.exit(2)
+    config['stopwords'] = COLLECTIONS[config['corpus']]().stopwords
+    if not os.path.exists(config['stopwords']):
+        print(f'{config["stopwords"]} is not found, run it in the directory of a corpus')
+        sys.exit(2)
+    results = benchmark(config)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'The results are written to {output}')
+    if old is not None:
+        with open(old, 'r') as f:
+            worse = compare(json.load(f), results, threshold)
+        if worse:
+            print(f'{len(worse)} metrics are worse by more than {threshold:.0%} and the noise: ' + ', '.join(worse))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    # files.porter is imported from the current directory, as the search programs do
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,535 @@
+"""
+BM25 ranking of the search engine.
+
+BM25.score() scores every document with a term-at-a-time loop, BM25.search()
+only finds the top k with document-at-a-time MaxScore pruning, and both give
+exactly the same scores. The index may be the in-memory
+compact_index.CompactIndex or the memory mapped index_format.BinaryIndex.
+
+With the positional index (see positions) a query may quote phrases, only the
+documents with every phrase are found (by positional intersection), scored with
+all the query words and ranked, the other documents do not match the query. With `proximity` the documents where the query words
+are close get the proximity score of Buttcher, Clarke and Lushman (SIGIR 2006)
+added to their BM25 score, MaxScore is not used as the upper bounds do not
+count it.
+
+With `conjunctive` only the documents with every query word (but the
+stopwords) are ranked: the postings are intersected from the rarest word by
+galloping search (positions.intersect) and only the documents left are scored
+and ranked, even if they are less than k.
+
+With the tiers of the postings (see tiers) the top k of search() is found from
+the first tiers and the documents completed from the tails, the same results as
+MaxScore, which is still used when the tails may change them. With `pruned` the
+top k is only found from the first tiers.
+"""
+import math
+import heapq
+import bisect
+import itertools
+from array import array
+from . import query_cache
+from . import profiling
+from . import positions as positional
+
+
+class BM25:
+    avg_doc_len = 0 # document's average length
+    N = 0 # the number of documents
+    postings = dict() # postings[word] store the [doc_no, tf] pairs of the documents contain `word`
+    frequency = dict() # frequency[word] store the `word` frequency in the corpus
+    doc_len = dict() # doc_len[doc_id] store the `doc_id` length
+    query = '' # the query we are processing
+    k = 1
+    b = 0.75
+    phrases = [] # the phrases of the query, list of (offset, word)
+    proximity = False # True to add the proximity score, it needs the positions
+    conjunctive = False # True to only rank the documents with every query word
+    pruned = False # True to only rank the documents in the first tiers of the postings, it needs the tiers
+
+    def __init__(self, avg_doc_len, N, postings, frequency, doc_len, k=1, b=0.75, max_score=None, impacts=None,
+                 tokenizer=None, positions=None, tiers=None) -> None:
+        self.avg_doc_len = avg_doc_len
+        self.N = N
+        self.postings = postings
+        self.frequency = frequency
+        self.doc_len = doc_len
+        self.k = k
+        self.b = b
+        # postings refer to a document by its position (doc_no) in `doc_len`
+        if isinstance(doc_len, dict):
+            self.doc_ids = list(doc_len.keys())
+            self.lengths = list(doc_len.values())
+        else:  # index_format.DocLengths read from the binary index
+            self.doc_ids = doc_len.doc_ids
+            self.lengths = doc_len.lengths
+        # max_score[word] is the upper bound of the `word` score in any document, it must be
+        # computed with the same k and b, the missing words are computed when first used
+        self.max_score = dict() if max_score is None else max_score
+        # impacts[word] is the score of `word` in each document of its postings, precomputed
+        # in the index with the same k and b, None if the scores are computed here
+        self.impacts = impacts
+        # tokenizer.Tokenizer of the queries, only needed to search
+        self.tokenizer = tokenizer
+        # positions.PositionalIndex of the phrases and the proximity score, None if the positions are
+        # not indexed, the quotes of the query are then ignored
+        self.positions = positions
+        # tiers.TierIndex split with the same k and b, None if the postings are not split into tiers
+        self.tiers = tiers
+        # query_cache.QueryCache of search() results, None if not cached
+        self.cache = None
+        self.cached = False
+        self.scored = 0
+
+    def _pre_process_query(self):
+        """
+            inner method to process the query(remove stopwords, stem...), the quoted phrases are
+            kept in self.phrases. The words are sorted, the scores of the words are added in this order
+            whatever the string hashes of the process (the workers and the shards get the same scores)
+        """
+        self.phrases = []
+        # a word with punctuation has no postings, no document would have every word
+        strip = self.conjunctive
+        if self.positions is None or '"' not in self.query:
+            self.query = sorted(self.tokenizer.query_terms(self.query, strip))
+            return
+        # the odd parts are quoted, their words are normalized as the words of the documents
+        parts = self.query.split('"')
+        phrases = [self.tokenizer.phrase_terms(part) for part in parts[1::2]]
+        self.query = self.tokenizer.query_terms(' '.join(parts[::2]), strip)
+        self.query.update(word for phrase in phrases for _, word in phrase)
+        # a phrase of one word is only a word
+        self.phrases = [phrase for phrase in phrases if len(phrase) > 1]
+        # a phrase is a word of the query without postings, so the cache keys tell the phrases apart
+        self.query.update(positional.phrase_key(phrase) for phrase in self.phrases)
+        self.query = sorted(self.query)
+
+    def terms(self, query):
+        """
+            public method to get the words of the query after processing
+        """
+        self.query = query
+        self._pre_process_query()
+        return self.query
+
+    def _idf(self, word):
+        return math.log2((self.N - self.frequency.get(word, 0) + 0.5) / (self.frequency.get(word, 0) + 0.5))
+
+    def _term_score(self, tf, doc_no, idf):
+        """
+            max(0, BM25())
+            I find that if I just use the calculate method from slide,
+            result may appear negative number. The reason is the word is
+            too common in the corpus. It is not reasonable if the score of 
+            a word that actually appear in the document (negative) is lower 
+            than a word that not actually appear (zero). So I forced the 
+            negative score to zero. After a lot of experiments, it is not 
+            effect the result too much. 
+        """
+        return max(0, self._tf_part(tf, doc_no) * idf)
+
+    def _tf_part(self, tf, doc_no):
+        # the saturated tf with length normalization, the score is this times idf
+        return (tf * (self.k + 1)) / (tf + self.k * (1 - self.b + self.b * self.lengths[doc_no] / self.avg_doc_len))
+
+    def _impacts(self, word):
+        return self.impacts.get(word) if self.impacts is not None else None
+
+    def _max_score(self, word):
+        if word not in self.max_score:
+            impacts = self._impacts(word)
+            if impacts is not None:
+                self.max_score[word] = max(impacts, default=0)
+            else:
+                idf = self._idf(word)
+                self.max_score[word] = max((self._term_score(tf, doc_no, idf) for doc_no, tf in self.postings.get(word, ())), default=0)
+        return self.max_score[word]
+
+    def max_scores(self):
+        """
+            compute the upper bound score of every word, stored with the index for search()
+        """
+        for word in self.postings:
+            self._max_score(word)
+        return self.max_score
+
+    def term_scores(self, word, postings):
+        """
+            return: the score of `word` in each document of its `postings`
+        """
+        idf = self._idf(word)
+        return [self._term_score(tf, doc_no, idf) for doc_no, tf in postings]
+
+    def impact_scores(self):
+        """
+            precompute the idf of every word and the saturated tf of every posting, the impact
+            score stored in the index is their product
+            return: idf(dict), tf_parts(dict, key: word, value: array in the postings order)
+        """
+        idf = dict()
+        tf_parts = dict()
+        for word, postings in self.postings.items():
+            idf[word] = self._idf(word)
+            tf_parts[word] = array('d', (self._tf_part(tf, doc_no) for doc_no, tf in postings))
+        return idf, tf_parts
+
+    def score(self, query):
+        """
+            public method to calculate the BM25 score
+            parameter: query(str)
+        """
+        self.query = query
+        profiling.count('queries')
+        with profiling.stage('query terms'):
+            self._pre_process_query()
+        scores = self._scores()
+        self.scored = len(scores)
+        profiling.count('documents scored', self.scored)
+        # the documents without a phrase of the query (or without a word if conjunctive) do not match it
+        return self._rank(scores, matched=bool(self.phrases or self.conjunctive))
+
+    def _scores(self):
+        """
+            return: {doc_no: score} of the documents in the postings of the query words (only the
+                    documents with every word if conjunctive and with every phrase of the query)
+        """
+        if self.phrases or self.conjunctive:
+            scores = self._candidate_scores()
+        else:
+            scores = self._term_at_a_time()
+        if self.proximity and self.positions is not None:
+            with profiling.stage('proximity'):
+                self._add_proximity(scores)
+        return scores
+
+    def _term_at_a_time(self):
+        # term-at-a-time: only the documents in the postings of a query term are visited,
+        # every other document keeps the score 0
+        scores = dict()
+        for word in self.query:
+            with profiling.stage('read postings'):
+                postings = self.postings.get(word, ())
+                impacts = self._impacts(word)
+            profiling.count('postings read', len(postings))
+            with profiling.stage('score'):
+                if impacts is not None:
+                    # precomputed in the index, just add them up
+                    for (doc_no, _), impact in zip(postings, impacts):
+                        scores[doc_no] = scores.get(doc_no, 0) + impact
+                    continue
+                idf = self._idf(word)
+                for doc_no, tf in postings:
+                    scores[doc_no] = scores.get(doc_no, 0) + self._term_score(tf, doc_no, idf)
+        return scores
+
+    def _candidate_scores(self):
+        # the documents with every word (if conjunctive) and every phrase are found first, then only
+        # they are scored, the words are added in the same order as _term_at_a_time()
+        with profiling.stage('read postings'):
+            postings = {word: self.postings.get(word) for word in self.query}
+        matched = None
+        if self.conjunctive:
+            with profiling.stage('intersect'):
+                matched = set(self._conjunction(postings))
+            profiling.count('conjunctive matches', len(matched))
+        if self.phrases:
+            with profiling.stage('phrases'):
+                for phrase in self.phrases:
+                    documents = set(positional.phrase_documents(self.positions, postings, phrase))
+                    matched = documents if matched is None else matched & documents
+            profiling.count('phrase matches', len(matched))
+        candidates = sorted(matched)
+        scores = dict()
+        for word in self.query:
+            word_postings = postings[word]
+            if not word_postings:
+                continue
+            impacts = self._impacts(word)
+            idf = self._idf(word)
+            profiling.count('postings read', len(word_postings))
+            with profiling.stage('score'):
+                cursor = 0
+                for doc_no in candidates:
+                    cursor = positional.gallop(word_postings, doc_no, cursor)
+                    if cursor == len(word_postings):
+                        break
+                    if word_postings[cursor][0] != doc_no:
+                        continue
+                    if impacts is not None:
+                        score = impacts[cursor]
+                    else:
+                        score = self._term_score(word_postings[cursor][1], doc_no, idf)
+                    scores[doc_no] = scores.get(doc_no, 0) + score
+        return scores
+
+    def _conjunction(self, postings):
+        """
+            return: the doc_no of the documents with every query word, in document order
+        """
+        keys = {positional.phrase_key(phrase) for phrase in self.phrases}
+        # the stopwords are kept in the query but they are not indexed
+        lists = [postings[word] for word in self.query if word not in self.tokenizer.stopwords and word not in keys]
+        if not lists or not all(lists):
+            return []
+        # the rarest word first, the other postings are galloped to its documents
+        lists.sort(key=len)
+        return [doc_no for doc_no, _ in positional.intersect(lists)]
+
+    def _add_proximity(self, scores):
+        """
+            add the proximity score to the documents with more than one query word: two consecutive
+            occurrences of different words at distance d add idf / d^2 of each word to the accumulator of
+            the other, and the accumulator of a word is saturated as the tf of BM25, times min(1, idf)
+        """
+        words = []
+        for word in self.query:
+            postings = self.postings.get(word)
+            if postings:
+                words.append((max(0, self._idf(word)), postings, self.positions.get(word, postings)))
+        if len(words) < 2:
+            return
+        # found[doc_no] is the (word, index in its postings) of the query words in the document
+        found = dict()
+        for w, (_, postings, _) in enumerate(words):
+            for j, (doc_no, _) in enumerate(postings):
+                if doc_no in scores:
+                    found.setdefault(doc_no, []).append((w, j))
+        profiling.count('proximity documents', sum(1 for where in found.values() if len(where) > 1))
+        # in document order, the positions of every word are read in the postings order
+        for doc_no in sorted(found):
+            where = found[doc_no]
+            if len(where) < 2:
+                continue
+            occurrences = sorted((position, w) for w, j in where for position in words[w][2][j])
+            accumulators = [0.0] * len(words)
+            for (previous, v), (position, w) in zip(occurrences, occurrences[1:]):
+                if v != w:
+                    distance = (position - previous) ** 2
+                    accumulators[w] += words[v][0] / distance
+                    accumulators[v] += words[w][0] / distance
+            norm = self.k * (1 - self.b + self.b * self.lengths[doc_no] / self.avg_doc_len)
+            scores[doc_no] += sum(min(1, words[w][0]) * accumulator * (self.k + 1) / (accumulator + norm)
+                                  for w, accumulator in enumerate(accumulators) if accumulator > 0)
+
+    def _rank(self, scores, k=None, matched=False):
+        """
+            return: list of (doc_id, score) of every document (or the `k` highest), the documents not in
+                    `scores` have the score 0, or they are not ranked if `matched` (only the documents
+                    matching the query are in `scores`)
+        """
+        with profiling.stage('sort'):
+            if matched:
+                ranked = sorted(scores, key=lambda x: (-scores[x], x))
+                return [(self.doc_ids[doc_no], scores[doc_no]) for doc_no in ranked[:k]]
+            # sort scores, equal scores keep the document order (same as sorting every document)
+            positive = (doc_no for doc_no in scores if scores[doc_no] > 0)
+            if k is None:
+                ranked = sorted(positive, key=lambda x: (-scores[x], x))
+            else:
+                ranked = heapq.nsmallest(k, positive, key=lambda x: (-scores[x], x))
+            results = [(self.doc_ids[doc_no], scores[doc_no]) for doc_no in ranked]
+            # the documents left all have score 0, append them in document order
+            matched = set(ranked)
+            zeros = ((self.doc_ids[doc_no], 0) for doc_no in range(len(self.doc_ids)) if doc_no not in matched)
+            results += zeros if k is None else itertools.islice(zeros, max(0, k - len(results)))
+        return results
+
+    def search(self, query, k=15):
+        """
+            public method to get the `k` highest BM25 score, same as score(query)[:k]
+            parameter: query(str), k(int)
+        """
+        self.query = query
+        profiling.count('queries')
+        with profiling.stage('query terms'):
+            self._pre_process_query()
+        self.cached = False
+        if self.cache is None:
+            return self._ranked(k)
+        # the same words in any order get the same results
+        key = query_cache.cache_key(self.query, k)
+        with profiling.stage('cache'):
+            results = self.cache.get(key)
+        if results is not None:
+            profiling.count('cache hits')
+            self.cached = True
+            self.scored = 0
+            return results
+        results = self._ranked(k)
+        self.cache.put(key, results)
+        return results
+
+    def _ranked(self, k):
+        with profiling.stage('top k'):
+            if self.phrases or self.conjunctive or self.proximity and self.positions is not None:
+                # only the documents with every word or the phrases are scored, or the proximity is added
+                # to every score
+                scores = self._scores()
+                self.scored = len(scores)
+                results = self._rank(scores, k, matched=bool(self.phrases or self.conjunctive))
+            else:
+                results = self._tiered(k) if self.tiers is not None else None
+                if results is None:
+                    results = self._search(k)
+        profiling.count('documents scored', self.scored)
+        return results
+
+    def _search(self, k):
+        # document-at-a-time with MaxScore pruning. The words are sorted by their upper bound,
+        # the words before `m` (non-essential) together cannot bring a document into the top-k,
+        # so only the documents in the postings of the words after `m` (essential) are candidates
+        postings = dict()
+        with profiling.stage('read postings'):
+            for word in self.query:
+                postings[word] = self.postings.get(word)
+        profiling.count('postings read', sum(len(postings[word]) for word in self.query if postings[word]))
+        words = [word for word in self.query if postings[word] and self._max_score(word) > 0]
+        words.sort(key=self._max_score)
+        lists = [postings[word] for word in words]
+        idfs = [self._idf(word) for word in words]
+        impacts = [self._impacts(word) for word in words]
+
+        def term_score(i, cursor):
+            # the score of words[i] in the document at lists[i][cursor]
+            if impacts[i] is not None:
+                return impacts[i][cursor]
+            return self._term_score(lists[i][cursor][1], lists[i][cursor][0], idfs[i])
+
+        bound = [0]  # bound[i] is the sum of the upper bound of the first i words
+        for word in words:
+            bound.append(bound[-1] + self.max_score[word])
+        # the score must be added in the same order as score() to get exactly the same result
+        position = {word: i for i, word in enumerate(self.query)}
+        order = sorted(range(len(words)), key=lambda i: position[words[i]])
+        cursors = [0] * len(words)
+        heap = []  # min heap of (score, -doc_no), the root is the worst document in the top-k
+        threshold = 0
+        m = 0
+        self.scored = 0
+        while m < len(words):
+            doc_no = min((lists[i][cursors[i]][0] for i in range(m, len(words)) if cursors[i] < len(lists[i])), default=None)
+            if doc_no is None:
+                break
+            scores = dict()
+            for i in range(m, len(words)):
+                if cursors[i] < len(lists[i]) and lists[i][cursors[i]][0] == doc_no:
+                    scores[i] = term_score(i, cursors[i])
+                    cursors[i] += 1
+            partial = sum(scores.values())
+            pruned = False
+            # look up the non-essential words from the highest upper bound, stop once the
+            # document cannot get into the top-k any more
+            for i in range(m - 1, -1, -1):
+                if _below(partial + bound[i + 1], threshold):
+                    pruned = True
+                    break
+                cursors[i] = bisect.bisect_left(lists[i], doc_no, lo=cursors[i], key=lambda x: x[0])
+                if cursors[i] < len(lists[i]) and lists[i][cursors[i]][0] == doc_no:
+                    scores[i] = term_score(i, cursors[i])
+                    partial += scores[i]
+            if pruned:
+                continue
+            self.scored += 1
+            score = 0
+            for i in order:
+                if i in scores:
+                    score = score + scores[i]
+            # threshold is 0 until the heap is full. A later document with the same score
+            # is ranked lower, so it must be strictly higher to get into the top-k
+            if score > threshold:
+                if len(heap) < k:
+                    heapq.heappush(heap, (score, -doc_no))
+                else:
+                    heapq.heapreplace(heap, (score, -doc_no))
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    while m < len(words) and _below(bound[m + 1], threshold):
+                        m += 1
+        return self._top(heap, k)
+
+    def _tiered(self, k):
+        """
+            the top k of _search() from the first tiers, completed from the tails (see tiers), or only from
+            the first tiers if pruned
+            return: the results, None if a document only in the tails may get into the top k
+        """
+        # in the order of the query, the score is added in the same order as _search(), the words that only
+        # score 0 are left out as they add nothing
+        with profiling.stage('read postings'):
+            terms = {word: self.tiers.get(word) for word in self.query
+                     if word in self.frequency and self._max_score(word) > 0}
+        words = list(terms)
+        idfs = [self._idf(word) for word in words]
+        tails = [terms[word].tail_max for word in words]
+        profiling.count('postings read', sum(len(terms[word].first) for word in words))
+        # found[doc_no] is {i: the score of words[i]} of the words with the document in their first tier
+        found = dict()
+        with profiling.stage('score'):
+            for i, word in enumerate(words):
+                for doc_no, tf in terms[word].first:
+                    found.setdefault(doc_no, dict())[i] = self._term_score(tf, doc_no, idfs[i])
+        if self.pruned:
+            self.scored = len(found)
+            return self._rank({doc_no: sum(scores.values()) for doc_no, scores in found.items()}, k)
+        # the highest score of a document, its score in the tails of the words it misses is at most tail_max
+        bounds = {doc_no: sum(scores.values()) + sum(tails[i] for i in range(len(words)) if i not in scores)
+                  for doc_no, scores in found.items()}
+        # a document in no first tier scores at most the sum of the tails, the k-th score is at most the
+        # k-th highest bound, the tails would be looked up in vain
+        outside = sum(tails)
+        if outside > 0 and (len(bounds) < k or not _below(outside, heapq.nlargest(k, bounds.values())[-1])):
+            profiling.count('tiers fallbacks')
+            return None
+        heap = []  # min heap of (score, -doc_no) as _search()
+        threshold = 0
+        self.scored = 0
+        with profiling.stage('complete from tails'):
+            for doc_no in sorted(bounds, key=lambda x: (-bounds[x], x)):
+                if len(heap) == k and _below(bounds[doc_no], threshold):
+                    break
+                scores = found[doc_no]
+                for i in range(len(words)):
+                    if i not in scores and tails[i] > 0:
+                        tf = terms[words[i]].lookup(doc_no)
+                        if tf is not None:
+                            scores[i] = self._term_score(tf, doc_no, idfs[i])
+                self.scored += 1
+                score = 0
+                for i in range(len(words)):
+                    if i in scores:
+                        score = score + scores[i]
+                if score > 0 and (len(heap) < k or (score, -doc_no) > heap[0]):
+                    if len(heap) < k:
+                        heapq.heappush(heap, (score, -doc_no))
+                    else:
+                        heapq.heapreplace(heap, (score, -doc_no))
+                    if len(heap) == k:
+                        threshold = heap[0][0]
+        if outside > 0 and (len(heap) < k or not _below(outside, threshold)):
+            profiling.count('tiers fallbacks')
+            return None
+        return self._top(heap, k)
+
+    def _top(self, heap, k):
+        """
+            return: the results of the heap of (score, -doc_no) of the top k, filled with score 0 in document
+                    order if less than k documents have a positive score
+        """
+        heap.sort(key=lambda x: (-x[0], -x[1]))
+        results = [(self.doc_ids[-neg_doc_no], score) for score, neg_doc_no in heap]
+        # less than k documents have a positive score, fill with score 0 in document order
+        matched = set(-neg_doc_no for _, neg_doc_no in heap)
+        doc_no = 0
+        while len(results) < k and doc_no < len(self.doc_ids):
+            if doc_no not in matched:
+                results.append((self.doc_ids[doc_no], 0))
+            doc_no += 1
+        return results
+
+
+def _below(upper_bound, threshold):
+    """
+        True if a document whose score is at most `upper_bound` cannot beat `threshold`,
+        the bound is relaxed a little as it is not added in the same order as the real score
+    """
+    return upper_bound * (1 + 1e-9) <= threshold
@@ -0,0 +1,338 @@
+"""
+Command line of the search engine, run in the directory of a collection:
+
+    python3 -m engine --corpus {small|large} -m {interactive|automatic|server} [options]
+
+search_{small|large}_corpus.py run it with their collection.
+"""
+import sys
+import getopt
+import time
+from . import profiling
+from .collection import COLLECTIONS
+from .postings_cache import POLICIES
+from .search import Index, Searcher
+
+USAGE = '''Usage: {prog} -m <mode>
+    -m <mode> interactive, automatic or server (answer the queries over HTTP, see engine/server.py)
+    -j <jobs> number of processes used for indexing and scoring the queries of automatic mode (default 1)
+    -c        compare the batch scoring of automatic mode with scoring the queries one by one
+    -M <MB>   memory budget of the postings while indexing, they are flushed to disk and merged (SPIMI)
+    -p <bits> precompute the impact scores in the index with 64 (exact), 16 or 8 bits, 0 to remove them
+    --positions <on|off> index the positions of the words (see engine/positions.py) for "quoted phrase"
+             queries and --proximity, or remove them
+    --proximity rank the documents where the query words are close higher, the positions are indexed
+             if they are not
+    --conjunctive only rank the documents containing every query word (AND)
+    --tiers <fraction> split the postings of every word into the highest <fraction> of the scores and the
+             rest (see engine/tiers.py), the top 15 is found from the first ones, 0 to remove the tiers
+    --pruned only rank the documents in the first tiers (static pruning), the postings are split if they
+             are not
+    -r <size> number of query results kept in the cache (default 1000), 0 to disable the cache
+    --postings-cache <MB> keep the decoded postings of the words read most recently within <MB> MB
+             (see engine/postings_cache.py), every process searching the index has its own
+    --cache-policy <lru|tinylfu> evict the least recently used words (default), or only admit a word
+             read more often than the ones it evicts
+    -R        save the query cache to query_cache.json and load it next time
+    -w <workers> number of processes scoring the queries in server mode (default 1), 0 to score in the server
+    --host <host>, --port <port> the address of the server (default 127.0.0.1:8080)
+    --shards <count> split the index into <count> shards searched by local processes (see engine/shards.py),
+             or --shards <host>:<port>,... to search the shards served by python3 -m engine.shards
+    --corpus <name> small or large, the collection in the current directory
+    --profile the wall and CPU time of every stage of indexing and searching and their counters,
+             printed at the end and saved to profile.json (see engine/profiling.py)
+    --cprofile <file> also run under cProfile and dump its stats to <file>
+'''
+
+
+def usage(collection):
+    prog = f'search_{collection.name}_corpus.py' if collection is not None else 'python3 -m engine --corpus <name>'
+    return USAGE.format(prog=prog)
+
+
+def read_argv(collection=None):
+    """
+        read argument from shell to determined interactive, automatic or server mode
+        parameter: collection(Collection), the default collection of --corpus
+        return: collection(Collection), mode(str), jobs(int), compare(bool), impact_bits(int or None),
+                cache_size(int), save_cache(bool), server_options(dict of the workers, host and port),
+                shards(int, list of (host, port) or None), memory(int bytes or None), positions(bool or
+                None), tiers(float, True or None), ranking(dict of proximity, conjunctive and pruned, see
+                search.Searcher), postings_cache(dict
+                of the budget in bytes and the policy or None, see search.Index), profile(dict of enabled
+                and the cProfile file or None)
+    """
+    mode = 'interactive'
+    jobs = 1
+    compare = False
+    impact_bits = None
+    cache_size = 1000
+    save_cache = False
+    server_options = {'workers': 1, 'host': '127.0.0.1', 'port': 8080}
+    shards = None
+    memory = None
+    positions = None
+    tiers = None
+    ranking = {'proximity': False, 'conjunctive': False, 'pruned': False}
+    postings_cache = None
+    policy = 'lru'
+    profile = {'enabled': False, 'cprofile': None}
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hm:j:cp:r:Rw:M:", ["corpus=", "host=", "port=", "shards=",
+                                                                     "positions=", "proximity", "conjunctive", "profile",
+                                                                     "cprofile=", "postings-cache=", "cache-policy=", "tiers=",
+                                                                     "pruned"])
+    except getopt.GetoptError:
+        print(usage(collection))
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage(collection))
+            sys.exit()
+        elif opt in ("-m"):
+            if arg not in ('interactive', 'automatic', 'server'):
+                print(usage(collection))
+                sys.exit(2)
+            mode = arg
+        elif opt == '-j':
+            if not arg.isdigit() or int(arg) < 1:
+                print(usage(collection))
+                sys.exit(2)
+            jobs = int(arg)
+        elif opt == '-c':
+            compare = True
+        elif opt == '-p':
+            if arg not in ('0', '8', '16', '64'):
+                print(usage(collection))
+                sys.exit(2)
+            impact_bits = int(arg)
+        elif opt == '-r':
+            if not arg.isdigit():
+                print(usage(collection))
+                sys.exit(2)
+            cache_size = int(arg)
+        elif opt == '-R':
+            save_cache = True
+        elif opt == '-M':
+            if not arg.isdigit() or int(arg) < 1:
+                print(usage(collection))
+                sys.exit(2)
+            memory = int(arg) << 20
+        elif opt == '-w':
+            if not arg.isdigit():
+                print(usage(collection))
+                sys.exit(2)
+            server_options['workers'] = int(arg)
+        elif opt == '--host':
+            server_options['host'] = arg
+        elif opt == '--port':
+            if not arg.isdigit() or not 0 < int(arg) < 65536:
+                print(usage(collection))
+                sys.exit(2)
+            server_options['port'] = int(arg)
+        elif opt == '--shards':
+            try:
+                shards = int(arg) if arg.isdigit() else [(host, int(port)) for host, port in
+                                                         (address.rsplit(':', 1) for address in arg.split(','))]
+            except ValueError:
+                shards = 0
+            if not shards:
+                print(usage(collection))
+                sys.exit(2)
+        elif opt == '--corpus':
+            if arg not in COLLECTIONS:
+                print(usage(collection))
+                sys.exit(2)
+            collection = COLLECTIONS[arg]()
+        elif opt == '--positions':
+            if arg not in ('on', 'off'):
+                print(usage(collection))
+                sys.exit(2)
+            positions = arg == 'on'
+        elif opt == '--proximity':
+            ranking['proximity'] = True
+        elif opt == '--conjunctive':
+            ranking['conjunctive'] = True
+        elif opt == '--tiers':
+            try:
+                tiers = float(arg)
+            except ValueError:
+                tiers = -1
+            if not 0 <= tiers < 1:
+                print(usage(collection))
+                sys.exit(2)
+        elif opt == '--pruned':
+            ranking['pruned'] = True
+        elif opt == '--postings-cache':
+            if not arg.isdigit() or int(arg) < 1:
+                print(usage(collection))
+                sys.exit(2)
+            postings_cache = {'budget': int(arg) << 20}
+        elif opt == '--cache-policy':
+            if arg not in POLICIES:
+                print(usage(collection))
+                sys.exit(2)
+            policy = arg
+        elif opt == '--profile':
+            profile['enabled'] = True
+        elif opt == '--cprofile':
+            profile = {'enabled': True, 'cprofile': arg}
+    # the server mode scores the queries with the index of the whole collection
+    if collection is None or mode == 'server' and shards is not None or ranking['proximity'] and positions is False:
+        print(usage(collection))
+        sys.exit(2)
+    if ranking['proximity'] and positions is None:
+        positions = True
+    # the shards score with the statistics of the whole collection, not the ones the tiers are split by
+    if (tiers is not None or ranking['pruned']) and shards is not None or ranking['pruned'] and tiers == 0:
+        print(usage(collection))
+        sys.exit(2)
+    if ranking['pruned'] and tiers is None:
+        tiers = True
+    if postings_cache is not None:
+        postings_cache['policy'] = policy
+    return (collection, mode, jobs, compare, impact_bits, cache_size, save_cache, server_options, shards, memory,
+            positions, tiers, ranking, postings_cache, profile)
+
+
+def main(collection=None):
+    # read the program arguments to decide the mode
+    *options, profile = read_argv(collection)
+    if not profile['enabled']:
+        run(*options)
+        return
+    with profiling.recording(cprofile=profile['cprofile']) as recorded:
+        run(*options)
+    print(recorded.format())
+    collection = options[0]
+    recorded.save(collection.profile)
+    print(f'The profile is saved to {collection.profile}'
+          + (f', the cProfile stats to {profile["cprofile"]}' if profile['cprofile'] else ''))
+
+
+def run(collection, mode, jobs, compare, impact_bits, cache_size, save_cache, server_options, shards, memory,
+        positions=None, tiers=None, ranking=None, postings_cache=None):
+    """
+        open the index (or the shards) and run the mode, see read_argv for the parameters
+    """
+    ranking = ranking or dict()
+    if shards is not None:
+        from . import shards as sharding
+        with profiling.stage('open index'):
+            if isinstance(shards, int):
+                searcher = sharding.open_shards(collection, shards, jobs, impact_bits, cache_size, memory=memory,
+                                                positions=positions, postings_cache=postings_cache, **ranking)
+            else:
+                try:
+                    key = sharding.shard_key()
+                except ValueError as e:
+                    print(e)
+                    sys.exit(2)
+                searcher = sharding.connect_shards(shards, cache_size, key, **ranking)
+        try:
+            # the shards already score in parallel, -j is only used for indexing them
+            search(collection, searcher, mode, 1, compare, save_cache)
+        finally:
+            searcher.close()
+        return
+    with profiling.stage('open index'):
+        index = Index(collection, postings_cache=postings_cache).open(jobs, impact_bits, memory, positions, tiers)
+    if mode == 'server':
+        # asyncio and the process pool are only imported by the server
+        from .server import Server
+        server = Server(index, server_options['workers'], cache_size, **ranking)
+        if server.cache is not None and save_cache:
+            server.cache.load(collection.query_cache)
+        server.run(server_options['host'], server_options['port'])
+        if postings_cache is not None and not server_options['workers']:
+            print(index.postings.report())
+        if server.cache is not None and save_cache:
+            server.cache.save(collection.query_cache)
+        return
+    search(collection, Searcher(index, cache_size, **ranking), mode, jobs, compare, save_cache)
+    # the workers of -j have their own caches
+    if postings_cache is not None and (mode == 'interactive' or jobs == 1):
+        print(index.postings.report())
+
+
+def read_queries(path):
+    """
+        return: the query ids and the queries of the queries file
+    """
+    with open(path, 'r') as f:
+        ids = []
+        queries = []
+        # every line is a query
+        for line in f:
+            id = line.strip().split()[0]
+            ids.append(id)
+            # some query has extra whitespaces
+            queries.append(line.replace(id, '').strip())
+    return ids, queries
+
+
+def search(collection, searcher, mode, jobs=1, compare=False, save_cache=False):
+    """
+        run the interactive or automatic mode with a search.Searcher or shards.ShardedSearcher
+    """
+    # the saved results would answer the batch compared with -c, they are not loaded then
+    if searcher.cache is not None and save_cache and not compare:
+        searcher.cache.load(collection.query_cache)
+
+    if mode == 'interactive':
+        # user input query in this mode
+        # while loop until user input QUIT
+        print("Input QUIT to exit the program")
+        while True:
+            query = input('Enter query: ')
+
+            if query.strip() == "QUIT":
+                break
+
+            # We only print the first 15 highest score answer
+            start = time.perf_counter()
+            with profiling.stage('search'):
+                first15 = searcher.search(query, 15)
+            elapsed = time.perf_counter() - start
+            for rank, score in enumerate(first15):
+                print(rank + 1, score[0], score[1])
+            if searcher.cached:
+                print(f'(from cache in {elapsed * 1e6:.0f} us)')
+            else:
+                print(f'({searcher.scored} of {searcher.N} documents scored in {elapsed * 1000:.2f} ms)')
+
+    else:
+        ids, queries = read_queries(collection.queries)
+        # score all the queries together with NumPy, or one by one if NumPy is not installed,
+        # NumPy is imported before timing, with -j the queries are split among the processes
+        batch = searcher.batch()
+        start = time.perf_counter()
+        with profiling.stage('search'):
+            results = searcher.search_many(queries, 15, jobs)
+        elapsed = time.perf_counter() - start
+        print(f'{len(queries)} queries scored in {elapsed:.3f}s' + (f' with {jobs} processes' if jobs > 1 else ''))
+        if compare and (batch is not None or jobs > 1):
+            # without the cache, otherwise the loop only read the results of the batch
+            cache, searcher.cache = searcher.cache, None
+            start = time.perf_counter()
+            with profiling.stage('compare one by one'):
+                same = results == [searcher.search(query, 15) for query in queries]
+            loop = time.perf_counter() - start
+            searcher.cache = cache
+            print(f'one by one: {loop:.3f}s, {"batch" if jobs == 1 else f"{jobs} processes"}: {elapsed:.3f}s '
+                  f'({loop / elapsed:.2f}x speedup), '
+                  f'results are {"the same" if same else "DIFFERENT"}')
+        with open(collection.results, 'w') as w:
+            for id, scores in zip(ids, results):
+                for rank, score in enumerate(scores):
+                    # if score is 0, we could skip it. We can assume that the output result are all judged to `relevant`
+                    if score[1] == 0.0:
+                        continue
+                    if rank + 1 > 15:
+                        break
+                    w.write(id + ' ' + str(score[0]) + ' ' + str(rank + 1) + ' ' + str(score[1]) + '\n')
+
+    if searcher.cache is not None:
+        print(searcher.cache.report())
+        if save_cache:
+            searcher.cache.save(collection.query_cache)
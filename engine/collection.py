@@ -0,0 +1,98 @@
+"""
+Collections (corpora) the search engine works on.
+
+A collection is a directory laid out as
+    documents/          the documents, one per file or packed (see document_reader)
+    files/stopwords.txt the stopwords list
+    files/queries.txt   the queries of the automatic mode
+    files/qrels.txt     the relevance judgments of the queries, read by engine.evaluation
+and the index, the caches and results.txt are written next to them. The
+collections only differ in how a document is named, document_id() turns a file
+name or a DOCNO into the document id, in the messages the CLI prints and in how
+their qrels are read.
+"""
+import os
+
+
+class Collection:
+    """
+        the files of a corpus and the rule of its document ids
+    """
+    name = None
+    # the messages printed by the CLI
+    invalid = 'is not valid, cannot used as document id'
+    loading = 'Loading BM25 index from file, please wait...'
+    converting = 'Converting cache.json to BM25 index, please wait...'
+    building = 'Not found BM25 index from file, please wait for indexing'
+    # True if the documents judged 0 in the qrels are non-relevant (and the others relevant with their
+    # grade, at least 1), False if every judged document is relevant, see engine.evaluation
+    judged_nonrelevant = True
+
+    def __init__(self, root='.'):
+        self.root = root
+        # the path store the corpus
+        self.documents = os.path.join(root, 'documents')
+        # the path store the stopwords list
+        self.stopwords = os.path.join(root, 'files', 'stopwords.txt')
+        # the path store the query
+        self.queries = os.path.join(root, 'files', 'queries.txt')
+        # the path store the relevance judgments
+        self.qrels = os.path.join(root, 'files', 'qrels.txt')
+        # the path store the binary index
+        self.index = os.path.join(root, 'index.bin')
+        # the path store the positions of the words if they are indexed
+        self.positions = os.path.join(root, 'positions.bin')
+        # the path store the tiers of the postings if they are split
+        self.tiers = os.path.join(root, 'tiers.bin')
+        # the JSON cache written by the older version, converted to the binary index
+        self.json_cache = os.path.join(root, 'cache.json')
+        # the path store the query cache if it is saved
+        self.query_cache = os.path.join(root, 'query_cache.json')
+        # the path store the stem cache of the tokenizer
+        self.stem_cache = os.path.join(root, 'stem_cache.json')
+        # the path store the results of the automatic mode
+        self.results = os.path.join(root, 'results.txt')
+        # the path store the report of --profile
+        self.profile = os.path.join(root, 'profile.json')
+
+    def document_id(self, name):
+        """
+            the document id of a file name or a DOCNO, None if it cannot be used as document id
+        """
+        raise NotImplementedError
+
+    def select(self, documents):
+        """
+            the files indexed among the files found by indexing.list_documents, all of them
+        """
+        return documents
+
+
+class SmallCorpus(Collection):
+    """
+        the doc name is numeric, the document id is the number
+    """
+    name = 'small'
+    invalid = 'is not numeric, cannot used as document id'
+    loading = 'Loading BM25 index from file, please wait.'
+    converting = 'Converting cache.json to the binary index, please wait.'
+    building = 'Not found cache index, please wait for indexing...'
+    # as evaluate_small_corpus.py always did, whatever the judgment
+    judged_nonrelevant = False
+
+    def document_id(self, name):
+        return int(name) if name.isnumeric() else None
+
+
+class LargeCorpus(Collection):
+    """
+        the doc name start from "GX", the document id is the name
+    """
+    name = 'large'
+
+    def document_id(self, name):
+        return name if name.startswith('GX') else None
+
+
+# the collections by name
+COLLECTIONS = {collection.name: collection for collection in (SmallCorpus, LargeCorpus)}
@@ -0,0 +1,202 @@
+"""
+Compact in-memory inverted index built by the search engine.
+
+The words are numbered by a lexicon (term id) and the documents by their
+position (doc_no) with a side table back to the document ids. The postings of
+all the words are kept in three flat arrays while indexing, (term id, doc_no,
+tf) of every posting, and sorted by term id into one doc_no array and one tf
+array when the index is finished, so a posting costs 8 bytes instead of a
+Python list of two ints. With positions, the positions of every posting are
+appended to one more flat array and a posting also keeps where they start.
+
+It provides the same avg_doc_len, N, postings, frequency, doc_len and files as
+index_format.BinaryIndex, so BM25 and index_format.write use it directly.
+"""
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from .index_format import DocLengths
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_memory():
+    """
+        return: the peak resident memory of the process in MB, None if it is unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on Linux
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class PostingList(Sequence):
+    """
+        the (doc_no, tf) pairs of one word, read from the arrays of the index
+    """
+
+    def __init__(self, doc_nos, tfs):
+        self.doc_nos = doc_nos
+        self.tfs = tfs
+
+    def __getitem__(self, i):
+        return self.doc_nos[i], self.tfs[i]
+
+    def __iter__(self):
+        return zip(self.doc_nos, self.tfs)
+
+    def __len__(self):
+        return len(self.doc_nos)
+
+
+class _Postings(Mapping):
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, word):
+        index = self._index
+        term = index.term_ids[word]
+        start, end = index.offsets[term], index.offsets[term + 1]
+        return PostingList(index.doc_nos[start:end], index.tfs[start:end])
+
+    def __iter__(self):
+        return iter(self._index.words)
+
+    def __len__(self):
+        return len(self._index.words)
+
+
+class _Frequency(Mapping):
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, word):
+        return self._index.df[self._index.term_ids[word]]
+
+    def __iter__(self):
+        return iter(self._index.words)
+
+    def __len__(self):
+        return len(self._index.words)
+
+
+class CompactIndex:
+    """
+        add the documents with add_document() and their postings with add(), then finish()
+    """
+
+    def __init__(self, positions=False):
+        self.term_ids = dict()  # term_ids[word] is the term id of `word`
+        self.words = []  # words[term id] is the word
+        self.df = array('I')  # df[term id] is the number of documents contain the word
+        self.doc_ids = []  # doc_ids[doc_no] is the document id
+        self.lengths = array('I')  # lengths[doc_no] is the document length
+        self.files = []  # files[doc_no] is (path, mtime in ns, size) of the document
+        # the postings in the order they are added
+        self._terms = array('I')
+        self._doc_nos = array('I')
+        self._tfs = array('I')
+        # the last doc_no added to each word, the postings added out of order are sorted by finish()
+        self._last = array('q')
+        self._unsorted = set()
+        self.offsets = self.doc_nos = self.tfs = None
+        # the positions of all the postings (see positions.py) and where the positions of each posting
+        # start, None if the positions are not indexed
+        self._positions = array('I') if positions else None
+        self._starts = array('Q') if positions else None
+
+    @property
+    def N(self):
+        return len(self.doc_ids)
+
+    @property
+    def avg_doc_len(self):
+        # 0 for an empty corpus, no document is scored
+        return sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+    def add_document(self, doc_id, length, file):
+        """
+            return: the doc_no of the document
+        """
+        self.doc_ids.append(doc_id)
+        self.lengths.append(length)
+        self.files.append(file)
+        return len(self.doc_ids) - 1
+
+    def add(self, word, doc_no, tf, positions=None):
+        term = self.term_ids.get(word)
+        if term is None:
+            term = self.term_ids[word] = len(self.words)
+            self.words.append(word)
+            self.df.append(0)
+            self._last.append(-1)
+        self.df[term] += 1
+        if doc_no < self._last[term]:
+            self._unsorted.add(term)
+        self._last[term] = doc_no
+        self._terms.append(term)
+        self._doc_nos.append(doc_no)
+        self._tfs.append(tf)
+        if self._positions is not None:
+            self._starts.append(len(self._positions))
+            self._positions.extend(positions)
+
+    def finish(self):
+        """
+            group the postings by term id (counting sort), the postings of a word are sorted by doc_no
+        """
+        self.offsets = array('Q', [0])
+        for df in self.df:
+            self.offsets.append(self.offsets[-1] + df)
+        self.doc_nos = array('I', bytes(4 * len(self._doc_nos)))
+        self.tfs = array('I', bytes(4 * len(self._tfs)))
+        fill = array('Q', self.offsets[:-1])
+        for term, doc_no, tf in zip(self._terms, self._doc_nos, self._tfs):
+            i = fill[term]
+            self.doc_nos[i] = doc_no
+            self.tfs[i] = tf
+            fill[term] = i + 1
+        if self._starts is not None:
+            starts = array('Q', bytes(8 * len(self._starts)))
+            fill = array('Q', self.offsets[:-1])
+            for term, start in zip(self._terms, self._starts):
+                starts[fill[term]] = start
+                fill[term] += 1
+            self._starts = starts
+        self._terms = self._doc_nos = self._tfs = self._last = None
+        for term in self._unsorted:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            if self._starts is None:
+                pairs = sorted(zip(self.doc_nos[start:end], self.tfs[start:end]))
+            else:
+                pairs = sorted(zip(self.doc_nos[start:end], self.tfs[start:end], self._starts[start:end]))
+                self._starts[start:end] = array('Q', (pair[2] for pair in pairs))
+            self.doc_nos[start:end] = array('I', (pair[0] for pair in pairs))
+            self.tfs[start:end] = array('I', (pair[1] for pair in pairs))
+        self._unsorted = set()
+        self.postings = _Postings(self)
+        self.frequency = _Frequency(self)
+        self.doc_len = DocLengths(self.doc_ids, self.lengths)
+
+    def items(self):
+        """
+            return: iterator of (word, postings) in the order of the utf-8 bytes of the words, the order
+                    index_format.write_terms writes them
+        """
+        for _, word in sorted((word.encode('utf-8'), word) for word in self.words):
+            yield word, self.postings[word]
+
+    def positions(self, word):
+        """
+            return: the positions of `word` in each document of its postings, in the postings order
+        """
+        term = self.term_ids[word]
+        start, end = self.offsets[term], self.offsets[term + 1]
+        positions = self._positions
+        return [positions[first:first + tf] for first, tf in zip(self._starts[start:end], self.tfs[start:end])]
@@ -0,0 +1,122 @@
+"""
+Streaming reader of the documents indexed by the search engine.
+
+A document is read in chunks of CHUNK_SIZE characters and its tokens are
+yielded one by one, so the memory used while indexing is bounded by the chunk
+size instead of the size of the document. The tokens are exactly the same as
+splitting the whole text at whitespace.
+
+A file holds either one document, or many documents packed in the TREC format:
+
+    <DOC>
+    <DOCNO> GX000-00-0000000 </DOCNO>
+    ... text of the document ...
+    </DOC>
+
+The DOCNO is the document id and the text up to </DOC> is the document. Both
+kinds of files may be compressed with gzip (name ending with .gz).
+"""
+import gzip
+
+# the characters read from a document at once
+CHUNK_SIZE = 1 << 16
+
+
+def open_document(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def tokens(pieces):
+    """
+        split the text given piece by piece at whitespace, a token may be cut between two pieces
+    """
+    carry = ''
+    for piece in pieces:
+        text = carry + piece
+        words = text.split()
+        carry = words.pop() if words and not text[-1].isspace() else ''
+        yield from words
+    if carry:
+        yield carry
+
+
+def read_tokens(f, chunk_size=CHUNK_SIZE):
+    """
+        yield the tokens of the file `f` holding one document
+    """
+    return tokens(iter(lambda: f.read(chunk_size), ''))
+
+
+class _Chunks:
+    # the text of a file read chunk by chunk, with the part not used yet in buf
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+
+    def _more(self):
+        chunk = self.f.read(self.chunk_size)
+        self.buf += chunk
+        return chunk != ''
+
+    def skip_to(self, tag):
+        # drop the text up to the end of `tag`, False if it is not found
+        while True:
+            i = self.buf.find(tag)
+            if i >= 0:
+                self.buf = self.buf[i + len(tag):]
+                return True
+            # the tag may be cut at the end of the chunk
+            self.buf = self.buf[max(0, len(self.buf) - len(tag) + 1):]
+            if not self._more():
+                return False
+
+    def read_to(self, tag):
+        # yield the text up to `tag` piece by piece and drop the tag, up to the end of file if not found
+        while True:
+            i = self.buf.find(tag)
+            if i >= 0:
+                piece, self.buf = self.buf[:i], self.buf[i + len(tag):]
+                yield piece
+                return
+            keep = max(0, len(self.buf) - len(tag) + 1)
+            piece, self.buf = self.buf[:keep], self.buf[keep:]
+            yield piece
+            if not self._more():
+                piece, self.buf = self.buf, ''
+                yield piece
+                return
+
+
+def read_trec(f, chunk_size=CHUNK_SIZE):
+    """
+        yield (DOCNO, tokens) of every <DOC> of the TREC file `f`, the tokens of a document
+        are read from the file, they must be used before reading the next document
+    """
+    chunks = _Chunks(f, chunk_size)
+    while chunks.skip_to('<DOC>'):
+        if not chunks.skip_to('<DOCNO>'):
+            return
+        docno = ''.join(chunks.read_to('</DOCNO>')).strip()
+        words = tokens(chunks.read_to('</DOC>'))
+        yield docno, words
+        # skip the tokens not used
+        for _ in words:
+            pass
+
+
+def read_documents(path, packed, chunk_size=CHUNK_SIZE):
+    """
+        parameters:
+            path: the file path
+            packed: True if the file is in the TREC format, False if it is one document
+        return: generator of (DOCNO or None if not packed, tokens) of the documents in the file
+    """
+    with open_document(path) as f:
+        if packed:
+            yield from read_trec(f, chunk_size)
+        else:
+            yield None, read_tokens(f, chunk_size)
@@ -0,0 +1,400 @@
+"""
+Evaluation of the results of the automatic mode against the qrels of a collection:
+
+    python3 -m engine.evaluation --corpus {small|large} [options] [run file ...]
+
+The qrels and every run file are read once, and all the metrics of a query are
+computed in one pass over its ranking: Precision, Recall, R-precision, P@10,
+MAP, bpref and nDCG@k (the gain of a document is its grade). The values are the
+same as the ones the older evaluate_{small|large}_corpus.py computed, a metric
+is the mean over the queries of the run.
+
+Many run files (the runs of a parameter sweep) are evaluated by -j processes,
+and every run is compared with the first one (the baseline) by paired tests
+over the queries of both: Student's t-test for every metric and a randomization
+test for one of them (--metric, MAP by default).
+
+A collection decides how its qrels are read (Collection.judged_nonrelevant): in
+the large corpus the documents judged 0 are non-relevant (any other grade, even
+a negative one, is relevant), and bpref only counts them, in the small corpus every judged document is relevant and bpref counts
+any other retrieved document as non-relevant.
+"""
+import os
+import sys
+import json
+import math
+import random
+import getopt
+from multiprocessing import Pool
+from .collection import COLLECTIONS
+
+# the metrics of every query, nDCG@k is added after them
+METRICS = ['Precision', 'Recall', 'R-precision', 'P@10', 'MAP', 'bpref']
+# the p-value a difference is marked significant below
+ALPHA = 0.05
+
+
+class Judgments:
+    """
+        the judgments of one query
+        relevant: dict (key: doc_id, value: gain)
+        nonrelevant: set of the doc_ids judged non-relevant, None if any document not relevant is
+    """
+
+    def __init__(self, nonrelevant=True):
+        self.relevant = dict()
+        self.nonrelevant = set() if nonrelevant else None
+
+
+def read_qrels(path, judged_nonrelevant=True):
+    """
+        lines of (query_id, iteration, doc_id, grade)
+        return: dict (key: query_id, value: Judgments)
+    """
+    qrels = dict()
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            query_id, _, doc_id, grade = fields
+            judgments = qrels.setdefault(query_id, Judgments(judged_nonrelevant))
+            if not judged_nonrelevant:
+                judgments.relevant[doc_id] = 1
+            elif grade == '0':
+                # only the grade 0 is non-relevant, as the older evaluate_large_corpus.py
+                judgments.nonrelevant.add(doc_id)
+            else:
+                # any other grade is relevant, the negative ones (or not a number) with the gain 1
+                judgments.relevant[doc_id] = max(1, int(grade)) if grade.isdigit() else 1
+    return qrels
+
+
+def read_run(path):
+    """
+        lines of (query_id, doc_id, rank, score) written by the automatic mode, in rank order
+        return: dict (key: query_id, value: list of doc_id), the queries in the order of the file
+    """
+    run = dict()
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            query_id, doc_id, _, score = fields
+            # a document of score 0 is not retrieved, the automatic mode does not write them
+            if float(score) == 0:
+                continue
+            run.setdefault(query_id, []).append(doc_id)
+    return run
+
+
+def evaluate_query(ranking, judgments, k=10):
+    """
+        parameters:
+            ranking: list of doc_id
+            judgments: Judgments of the query, None if the query is not judged
+            k: the depth of nDCG
+        return: dict (key: metric, value: float)
+    """
+    if judgments is None:
+        judgments = Judgments()
+    relevant, nonrelevant = judgments.relevant, judgments.nonrelevant
+    total = len(relevant)
+    retrieved_relevant = 0
+    retrieved_nonrelevant = 0
+    precision_at = {10: None, total: None}  # the relevant documents in the first 10 and first R
+    average_precision = 0
+    bpref = 0
+    dcg = 0
+    for rank, doc_id in enumerate(ranking, 1):
+        gain = relevant.get(doc_id)
+        if gain is None:
+            if nonrelevant is None or doc_id in nonrelevant:
+                retrieved_nonrelevant += 1
+        else:
+            retrieved_relevant += 1
+            average_precision += retrieved_relevant / rank
+            bpref += max(0, 1 - retrieved_nonrelevant / total)
+            if rank <= k:
+                dcg += gain / math.log2(rank + 1)
+        if rank in precision_at:
+            precision_at[rank] = retrieved_relevant
+    for n in precision_at:
+        if precision_at[n] is None:
+            # less than n documents are retrieved
+            precision_at[n] = retrieved_relevant
+    ideal = sum(gain / math.log2(rank + 2) for rank, gain in enumerate(sorted(relevant.values(), reverse=True)[:k]))
+    return {
+        'Precision': retrieved_relevant / len(ranking) if ranking else 0,
+        'Recall': retrieved_relevant / total if total else 0,
+        'R-precision': precision_at[total] / total if total else 0,
+        'P@10': precision_at[10] / 10,
+        'MAP': average_precision / total if total else 0,
+        'bpref': bpref / total if total else 0,
+        f'nDCG@{k}': dcg / ideal if ideal else 0,
+    }
+
+
+def evaluate_run(run, qrels, k=10):
+    """
+        return: dict (key: query_id, value: the evaluate_query() metrics), in the order of the run
+    """
+    return {query_id: evaluate_query(ranking, qrels.get(query_id), k) for query_id, ranking in run.items()}
+
+
+def means(per_query):
+    """
+        return: dict (key: metric, value: mean over the queries), added in the order of the queries
+    """
+    if not per_query:
+        return dict()
+    sums = dict()
+    for metrics in per_query.values():
+        for name, value in metrics.items():
+            sums[name] = sums.get(name, 0) + value
+    return {name: value / len(per_query) for name, value in sums.items()}
+
+
+def _betainc(a, b, x):
+    """
+        the regularized incomplete beta function I_x(a, b), by its continued fraction (Lentz)
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        # the continued fraction converges quickly on this side
+        return 1 - _betainc(b, a, 1 - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)) / a
+    tiny = 1e-300
+    f, c, d = 1.0, 1.0, 0.0
+    for i in range(1000):
+        m = i // 2
+        if i == 0:
+            numerator = 1.0
+        elif i % 2 == 0:
+            numerator = m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m))
+        else:
+            numerator = -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))
+        d = 1 + numerator * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + numerator / c
+        c = c if abs(c) > tiny else tiny
+        f *= c * d
+        if abs(1 - c * d) < 1e-14:
+            break
+    return front * (f - 1)
+
+
+def t_test(differences):
+    """
+        paired Student's t-test
+        parameter: differences, list of the difference of the paired values
+        return: the two-sided p-value
+    """
+    n = len(differences)
+    if n < 2:
+        return 1.0
+    mean = sum(differences) / n
+    variance = sum((d - mean) ** 2 for d in differences) / (n - 1)
+    if variance == 0:
+        return 1.0 if mean == 0 else 0.0
+    t = mean / math.sqrt(variance / n)
+    return _betainc((n - 1) / 2, 0.5, (n - 1) / (n - 1 + t * t))
+
+
+def randomization_test(differences, trials=10000, seed=1):
+    """
+        paired randomization test, a trial flips the sign of the differences of a random subset of
+        the queries
+        return: the two-sided p-value, the share of the trials whose sum is as far from 0 as observed
+    """
+    n = len(differences)
+    if n == 0:
+        return 1.0
+    total = sum(differences)
+    observed = abs(total) * (1 - 1e-9)
+    # the sum of every subset of 8 differences, a trial adds up one subset of every 8
+    tables = []
+    for start in range(0, n, 8):
+        chunk = differences[start:start + 8]
+        table = [0.0] * (1 << len(chunk))
+        for mask in range(1, len(table)):
+            low = mask & -mask
+            table[mask] = table[mask ^ low] + chunk[low.bit_length() - 1]
+        tables.append(table)
+    rng = random.Random(seed)
+    extreme = 0
+    for _ in range(trials):
+        bits = rng.getrandbits(n)
+        flipped = 0.0
+        for table in tables:
+            flipped += table[bits & 255]
+            bits >>= 8
+        if abs(total - 2 * flipped) >= observed:
+            extreme += 1
+    return extreme / trials
+
+
+def compare(baseline, per_query, metric='MAP', trials=10000):
+    """
+        compare a run with the baseline over the queries of both
+        parameters: baseline, per_query, the evaluate_run() of the two runs
+        return: dict (key: metric, value: {'t_test': p-value}), `metric` also has 'randomization'
+    """
+    queries = [query_id for query_id in per_query if query_id in baseline]
+    tests = dict()
+    for name in (per_query[queries[0]] if queries else ()):
+        differences = [per_query[query_id][name] - baseline[query_id][name] for query_id in queries]
+        tests[name] = {'t_test': t_test(differences)}
+        if name == metric:
+            tests[name]['randomization'] = randomization_test(differences, trials)
+    return tests
+
+
+# the qrels of a worker process
+_qrels = None
+
+
+def _init_worker(qrels):
+    global _qrels
+    _qrels = qrels
+
+
+def _evaluate_file(task):
+    path, k = task
+    return evaluate_run(read_run(path), _qrels, k)
+
+
+def _compare(task):
+    return compare(*task)
+
+
+def evaluate(qrels, paths, k=10, jobs=1, metric='MAP', trials=10000):
+    """
+        evaluate the run files and compare them with the first one
+        return: list of {'run', 'per_query', 'means', 'tests'} in the order of `paths`, the tests of
+                the first run are empty
+    """
+    pool = Pool(jobs, _init_worker, (qrels,)) if jobs > 1 and len(paths) > 1 else None
+    try:
+        if pool is None:
+            _init_worker(qrels)
+            apply = map
+        else:
+            # a few tasks per process, a run takes little time
+            apply = lambda function, tasks: pool.imap(function, tasks, max(1, len(tasks) // (jobs * 4)))
+        runs = list(apply(_evaluate_file, [(path, k) for path in paths]))
+        tests = list(apply(_compare, [(runs[0], per_query, metric, trials) for per_query in runs[1:]]))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return [{'run': path, 'per_query': per_query, 'means': means(per_query), 'tests': test}
+            for path, per_query, test in zip(paths, runs, [dict()] + tests)]
+
+
+def report(evaluations, metric='MAP', per_query=False):
+    """
+        return: the text of the evaluations, one run is printed as the older evaluate scripts did
+    """
+    lines = []
+    if len(evaluations) == 1:
+        evaluation = evaluations[0]
+        lines.append('Evaluation: {:>10}'.format(os.path.splitext(os.path.basename(evaluation['run']))[0] + ':'))
+        for name, value in evaluation['means'].items():
+            lines.append('{:<14}{:>10}'.format(name + ':', value))
+    else:
+        names = list(evaluations[0]['means'])
+        width = max(len(evaluation['run']) for evaluation in evaluations) + 2
+        lines.append(f'{"run":<{width}}' + ''.join(f'{name:>13}' for name in names))
+        for evaluation in evaluations:
+            tests = evaluation['tests']
+            # * marks a difference with the baseline (the first run) significant by the t-test
+            lines.append(f'{evaluation["run"]:<{width}}' + ''.join(
+                f'{evaluation["means"].get(name, 0):>12.4f}'
+                + ('*' if name in tests and tests[name]['t_test'] < ALPHA else ' ') for name in names))
+        lines.append(f'* p < {ALPHA} by the paired t-test against {evaluations[0]["run"]}')
+        lines.append(f'\n{metric} against {evaluations[0]["run"]}:')
+        lines.append(f'{"run":<{width}}{"difference":>12}{"t-test p":>12}{"random p":>12}')
+        baseline = evaluations[0]['means'].get(metric, 0)
+        for evaluation in evaluations[1:]:
+            test = evaluation['tests'].get(metric, {'t_test': 1.0, 'randomization': 1.0})
+            lines.append(f'{evaluation["run"]:<{width}}{evaluation["means"].get(metric, 0) - baseline:>+12.4f}'
+                         f'{test["t_test"]:>12.4f}{test["randomization"]:>12.4f}')
+    if per_query:
+        for evaluation in evaluations:
+            names = list(evaluation['means'])
+            lines.append(f'\n{evaluation["run"]}:')
+            lines.append(f'{"query":<10}' + ''.join(f'{name:>13}' for name in names))
+            for query_id, metrics in evaluation['per_query'].items():
+                lines.append(f'{query_id:<10}' + ''.join(f'{metrics[name]:>13.4f}' for name in names))
+    return '\n'.join(lines)
+
+
+USAGE = '''Usage: {prog} [options] [run file ...]
+    evaluate the run files (default results.txt) with files/qrels.txt, the runs are compared with the first one
+    -k <depth>        the depth of nDCG (default 10)
+    -j <jobs>         number of processes evaluating the runs (default 1)
+    -q                print the metrics of every query
+    -o <file>         also save the metrics of every run and query and the tests as JSON
+    --metric <name>   the metric of the randomization test (default MAP)
+    --trials <n>      number of trials of the randomization test (default 10000)
+    --qrels <file>    the relevance judgments (default files/qrels.txt)
+    --corpus <name>   small or large, the collection in the current directory
+'''
+
+
+def main(collection=None):
+    prog = f'evaluate_{collection.name}_corpus.py' if collection is not None else 'python3 -m engine.evaluation --corpus <name>'
+    k = 10
+    jobs = 1
+    per_query = False
+    output = None
+    metric = 'MAP'
+    trials = 10000
+    qrels = None
+    try:
+        opts, paths = getopt.gnu_getopt(sys.argv[1:], "hk:j:qo:", ["metric=", "trials=", "qrels=", "corpus="])
+        for opt, arg in opts:
+            if opt == '-h':
+                print(USAGE.format(prog=prog))
+                sys.exit()
+            elif opt == '-k':
+                k = int(arg)
+            elif opt == '-j':
+                jobs = int(arg)
+            elif opt == '-q':
+                per_query = True
+            elif opt == '-o':
+                output = arg
+            elif opt == '--metric':
+                metric = arg
+            elif opt == '--trials':
+                trials = int(arg)
+            elif opt == '--qrels':
+                qrels = arg
+            elif opt == '--corpus':
+                collection = COLLECTIONS[arg]()
+        if collection is None or k < 1 or jobs < 1 or trials < 1 or metric not in METRICS + [f'nDCG@{k}']:
+            raise ValueError
+    except (getopt.GetoptError, KeyError, ValueError):
+        print(USAGE.format(prog=prog))
+        sys.exit(2)
+    paths = paths or [collection.results]
+    for path in [qrels or collection.qrels] + paths:
+        if not os.path.exists(path):
+            print(f'{path} is not found')
+            sys.exit(2)
+    evaluations = evaluate(read_qrels(qrels or collection.qrels, collection.judged_nonrelevant), paths, k, jobs,
+                           metric, trials)
+    print(report(evaluations, metric, per_query))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'k': k, 'metric': metric, 'trials': trials, 'runs': evaluations}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+"""
+Binary BM25 index of the search engine, used instead of cache.json.
+
+The file is opened with mmap, so loading it only reads the header. A word is
+found by binary search in the term dictionary and its postings are decoded
+when they are used, nothing else of the index is read into memory.
+
+Layout (little endian):
+    header
+    doc id offsets     uint64[N + 1], offsets into the doc id strings
+    doc id strings     utf-8
+    doc lengths        uint32[N]
+    term dictionary    TERM[num_terms], sorted by the utf-8 bytes of the word
+    term strings       utf-8
+    postings           per word: df pairs of (doc_no gap, tf), varint encoded
+    file offsets       uint64[N + 1], offsets into the file paths
+    file paths         utf-8, the document path relative to the corpus
+    file stats         int64[N][2], (mtime in ns, size) of each document
+    idf                float64[num_terms]
+    impact offsets     uint64[num_terms], where the impacts of each word start
+    impacts            one value per posting, in the same order as the postings
+
+The file sections are empty if the index was converted from cache.json, the
+stats tell which documents changed since the index was built.
+
+The impact sections are empty unless the index is built with precomputed
+impact scores. With 64 bits the impacts are the BM25 score of the word in the
+document. With 16 or 8 bits they are the saturated tf part of the score
+quantized to `impact_scale` steps, and the score is q * impact_scale * idf.
+
+The JSON cache could be converted with
+    python3 -m engine.index_format cache.json index.bin
+"""
+import os
+import sys
+import mmap
+import math
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+
+MAGIC = b'BM25IDX3'
+FIELDS = ('magic', 'N', 'avg_doc_len', 'k', 'b', 'num_terms', 'has_files', 'impact_bits', 'impact_scale')
+# the offset of each section follow the fields
+SECTIONS = ('doc_offsets', 'doc_strings', 'lengths', 'entries', 'strings', 'data',
+            'file_offsets', 'file_paths', 'stats', 'idf', 'impact_offsets', 'impacts', 'end')
+HEADER = struct.Struct('<8sQdddQQQd' + 'Q' * len(SECTIONS))
+# the older versions are still readable, the fields they do not have are 0
+OLD_HEADERS = {
+    # the first version did not have the file sections
+    b'BM25IDX1': (struct.Struct('<8sQdddQ' + 'Q' * 7), FIELDS[:6] + SECTIONS[:6] + ('end',)),
+    # the second version did not have the impact sections
+    b'BM25IDX2': (struct.Struct('<8sQdddQQ' + 'Q' * 10), FIELDS[:7] + SECTIONS[:9] + ('end',)),
+}
+# word string offset, postings offset, word length, df, max_score
+TERM = struct.Struct('<QQIId')
+# array typecode of the impacts
+IMPACT_TYPES = {64: 'd', 16: 'H', 8: 'B'}
+
+
+def encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_postings(buf, pos, df):
+    """
+        decode `df` (doc_no gap, tf) pairs starting from buf[pos]
+        return: list of (doc_no, tf)
+    """
+    postings = []
+    doc_no = 0
+    for _ in range(df):
+        pair = []
+        for _ in range(2):
+            n = shift = 0
+            while True:
+                byte = buf[pos]
+                pos += 1
+                n |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            pair.append(n)
+        doc_no += pair[0]
+        postings.append((doc_no, pair[1]))
+    return postings
+
+
+def _native(data, typecode):
+    # the arrays are stored little endian, use the mmap directly if the machine is also little endian
+    if sys.byteorder == 'little':
+        return memoryview(data).cast(typecode)
+    values = array(typecode, data)
+    values.byteswap()
+    return values
+
+
+def invert(docs):
+    """
+        build the inverted index from the per-document word frequency (cache.json written before
+        the inverted index was introduced only store `docs`)
+    """
+    postings = dict()
+    for doc_no, doc in enumerate(docs.values()):
+        for word, tf in doc.items():
+            postings.setdefault(word, []).append([doc_no, tf])
+    return postings
+
+
+def _string_table(values):
+    offsets = array('Q', [0])
+    strings = bytearray()
+    for value in values:
+        strings += str(value).encode('utf-8')
+        offsets.append(len(strings))
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets.tobytes(), bytes(strings)
+
+
+def write(path, avg_doc_len, N, postings, frequency, doc_len, max_score=None, k=math.nan, b=math.nan, files=None,
+          impacts=None, impact_bits=64):
+    """
+        write the index to `path`
+        parameters:
+            postings: dict (key: word, value: list of [doc_no, tf] in doc_no order)
+            doc_len: dict (key: doc_id, value: length), doc_no is the position in it
+            max_score: dict (key: word, value: upper bound score) computed with `k` and `b`,
+                       None if not computed
+            files: list of (path, mtime in ns, size) in doc_no order, None if unknown
+            impacts: (idf, tf_parts) from BM25.impact_scores() computed with `k` and `b`,
+                     None if the impact scores are not stored
+            impact_bits: 64, 16 or 8, the precision of the stored impacts
+        return: number of bytes written
+    """
+    impact_scale = 0
+    if impacts is None:
+        impact_bits = 0
+    elif impact_bits != 64:
+        # the saturated tf are quantized in steps of impact_scale
+        impact_scale = max((max(parts, default=0) for parts in impacts[1].values()), default=0) / ((1 << impact_bits) - 1)
+    if max_score is None:
+        k = b = math.nan
+
+    def terms():
+        for _, word in sorted((word.encode('utf-8'), word) for word in postings):
+            yield (word, postings[word], frequency.get(word, len(postings[word])),
+                   max_score.get(word, 0) if max_score is not None else 0,
+                   (impacts[0][word], impacts[1][word]) if impacts is not None else None)
+
+    return write_terms(path, avg_doc_len, N, terms(), doc_len, k, b, files, impact_bits, impact_scale)
+
+
+def write_terms(path, avg_doc_len, N, terms, doc_len, k=math.nan, b=math.nan, files=None, impact_bits=0, impact_scale=0):
+    """
+        write the index to `path` one word at a time, the postings and impacts are written to temporary
+        files while the words are added, only the term dictionary is kept in memory
+        parameters:
+            terms: iterable of (word, postings, df, upper bound score, impact) sorted by the utf-8 bytes of
+                   the word, impact is (idf, tf_parts) from BM25.impact_scores() or None
+            k, b: the parameters of the upper bound and impact scores, nan if they are not computed
+            impact_bits: 64, 16 or 8 to store the impact scores, 0 if they are not stored
+            impact_scale: the step of the quantized impacts of 16 or 8 bits
+        return: number of bytes written
+    """
+    # only imported to write an index, not to search it
+    import shutil
+    import tempfile
+    doc_offsets, doc_strings = _string_table(doc_len)
+    lengths = array('I', doc_len.values())
+    file_offsets, file_paths = _string_table(file[0] for file in files or ())
+    stats = array('q')
+    for _, mtime, size in files or ():
+        stats.extend((mtime, size))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    num_terms = 0
+    idf = array('d')
+    impact_offsets = array('Q')
+    impact_count = 0
+    entries = bytearray()
+    term_strings = bytearray()
+    with tempfile.TemporaryFile(dir=directory) as data, tempfile.TemporaryFile(dir=directory) as impact_values:
+        data_size = 0
+        for word, postings, df, upper_bound, impact in terms:
+            encoded = word.encode('utf-8')
+            prev = 0
+            out = bytearray()
+            for doc_no, tf in postings:
+                encode_varint(doc_no - prev, out)
+                encode_varint(tf, out)
+                prev = doc_no
+            if impact_bits:
+                word_idf, parts = impact
+                idf.append(word_idf)
+                impact_offsets.append(impact_count)
+                if impact_bits == 64:
+                    # the same as BM25._term_score
+                    values = array('d', (max(0, part * word_idf) for part in parts))
+                else:
+                    values = array(IMPACT_TYPES[impact_bits], (round(part / impact_scale) if impact_scale else 0 for part in parts))
+                    # the upper bound of the quantized scores, computed in the same way as BinaryIndex does
+                    upper_bound = max(values) * impact_scale * word_idf if word_idf > 0 else 0
+                impact_count += len(values)
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                impact_values.write(values.tobytes())
+            entries += TERM.pack(len(term_strings), data_size, len(encoded), df, upper_bound)
+            term_strings += encoded
+            data.write(out)
+            data_size += len(out)
+            num_terms += 1
+
+        if sys.byteorder != 'little':
+            for values in (lengths, stats, idf, impact_offsets):
+                values.byteswap()
+        sections = [doc_offsets, doc_strings, lengths.tobytes(), bytes(entries), bytes(term_strings), data,
+                    file_offsets, file_paths, stats.tobytes(), idf.tobytes(), impact_offsets.tobytes(), impact_values]
+        offsets = []
+        pos = HEADER.size
+        for section in sections:
+            # keep the arrays 8 bytes aligned
+            pos += -pos % 8
+            offsets.append(pos)
+            pos += section.tell() if hasattr(section, 'tell') else len(section)
+        # the old index may still be memory mapped, write a new file and replace it
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, N, avg_doc_len, k, b, num_terms, files is not None, impact_bits, impact_scale,
+                                *offsets, pos))
+            for offset, section in zip(offsets, sections):
+                f.write(b'\0' * (offset - f.tell()))
+                if hasattr(section, 'tell'):
+                    section.seek(0)
+                    shutil.copyfileobj(section, f, 1 << 20)
+                else:
+                    f.write(section)
+            written = f.tell()
+    os.replace(path + '.tmp', path)
+    return written
+
+
+def count_changes(indexed, files):
+    """
+        count the documents added, changed or deleted
+        parameters:
+            indexed: BinaryIndex.files
+            files: list of (path, mtime in ns, size) of the documents in the corpus now
+    """
+    old = {file[0]: file for file in indexed}
+    new = {file[0]: file for file in files}
+    return sum(1 for path in old.keys() | new.keys() if old.get(path) != new.get(path))
+
+
+def convert(json_path, path):
+    """
+        convert the cache.json written by the older search_{small|large}_corpus.py to the binary index
+    """
+    import json
+    with open(json_path, 'r') as f:
+        cache = json.load(f)
+    postings = cache['postings'] if 'postings' in cache else invert(cache['docs'])
+    write(path, cache['avg_doc_len'], cache['N'], postings, cache['frequency'], cache['doc_len'],
+          cache.get('max_score'), cache.get('k', math.nan), cache.get('b', math.nan))
+
+
+class _Column(Mapping):
+    # read only dict-like view of one field of the term dictionary
+
+    def __init__(self, index, field):
+        self._index = index
+        self._field = field
+
+    def __getitem__(self, word):
+        entry = self._index.lookup(word)
+        if entry is None:
+            raise KeyError(word)
+        return self._field(entry)
+
+    def __iter__(self):
+        return iter(self._index.words())
+
+    def __len__(self):
+        return self._index.num_terms
+
+
+class _DocIds(Sequence):
+
+    def __init__(self, buf, offsets):
+        self._buf = buf
+        self._offsets = offsets
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._buf[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        # all of them are read when the corpus is checked for changes, without the checks of __getitem__
+        buf = self._buf
+        offsets = self._offsets
+        return (str(buf[start:end], 'utf-8') for start, end in zip(offsets, offsets[1:]))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class _Files(Sequence):
+
+    def __init__(self, paths, stats):
+        self._paths = paths
+        self._stats = stats
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._paths[i], self._stats[2 * i], self._stats[2 * i + 1]
+
+    def __iter__(self):
+        return zip(self._paths, self._stats[0::2], self._stats[1::2])
+
+    def __len__(self):
+        return len(self._paths)
+
+
+class DocLengths(Mapping):
+    """
+        doc_len of the binary (or compact) index, `doc_ids` and `lengths` are indexed by doc_no
+    """
+
+    def __init__(self, doc_ids, lengths):
+        self.doc_ids = doc_ids
+        self.lengths = lengths
+        self._doc_no = None
+
+    def __getitem__(self, doc_id):
+        # the doc ids read from the index are strings
+        if self._doc_no is None:
+            self._doc_no = {str(doc_id): doc_no for doc_no, doc_id in enumerate(self.doc_ids)}
+        return self.lengths[self._doc_no[str(doc_id)]]
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def values(self):
+        return self.lengths
+
+
+class BinaryIndex:
+    """
+        memory mapped binary index, provide the same avg_doc_len, N, postings, frequency, doc_len
+        and max_score as the in-memory index built by preprocess_doc
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._mm[:8]
+        if magic == MAGIC:
+            header, names = HEADER, FIELDS + SECTIONS
+        elif magic in OLD_HEADERS:
+            header, names = OLD_HEADERS[magic]
+        else:
+            raise ValueError(f'{path} is not a BM25 index')
+        h = dict.fromkeys(FIELDS + SECTIONS, 0)
+        h.update(zip(names, header.unpack_from(self._mm, 0)))
+        self.N, self.avg_doc_len, self.k, self.b, self.num_terms = h['N'], h['avg_doc_len'], h['k'], h['b'], h['num_terms']
+        self._entries, self._strings, self._data = h['entries'], h['strings'], h['data']
+        self._buf = memoryview(self._mm)
+        # files[doc_no] is (path, mtime in ns, size) of the document, None if the index does not know
+        self.files = None
+        if h['has_files']:
+            self.files = _Files(_DocIds(self._buf[h['file_paths']:h['stats']], _native(self._buf[h['file_offsets']:h['file_paths']], 'Q')),
+                                _native(self._buf[h['stats']:h['stats'] + 16 * self.N], 'q'))
+        self.doc_len = DocLengths(_DocIds(self._buf[h['doc_strings']:h['lengths']], _native(self._buf[h['doc_offsets']:h['doc_strings']], 'Q')),
+                                  _native(self._buf[h['lengths']:h['lengths'] + 4 * self.N], 'I'))
+        self._terms = dict()
+        self.postings = _Column(self, lambda entry: decode_postings(self._buf, self._data + entry[1], entry[3]))
+        self.frequency = _Column(self, lambda entry: entry[3])
+        self.max_score = _Column(self, lambda entry: entry[4])
+        # impact_bits is 0 if the index does not store the impact scores
+        self.impact_bits, self.impact_scale = h['impact_bits'], h['impact_scale']
+        self.impacts = None
+        if self.impact_bits:
+            self._idf = _native(self._buf[h['idf']:h['idf'] + 8 * self.num_terms], 'd')
+            self._impact_offsets = _native(self._buf[h['impact_offsets']:h['impact_offsets'] + 8 * self.num_terms], 'Q')
+            self._impact_values = _native(self._buf[h['impacts']:h['end']], IMPACT_TYPES[self.impact_bits])
+            self.impacts = _Column(self, self._impacts)
+
+    def has_max_score(self, k, b):
+        """
+            True if the stored upper bound scores (and impact scores) are computed with `k` and `b`
+        """
+        return self.k == k and self.b == b
+
+    def _impacts(self, entry):
+        # the score of the word in each document of its postings
+        start = self._impact_offsets[entry[5]]
+        values = self._impact_values[start:start + entry[3]]
+        if self.impact_bits == 64:
+            return values.tolist()
+        idf = self._idf[entry[5]]
+        if idf <= 0:
+            return [0.0] * entry[3]
+        return [q * self.impact_scale * idf for q in values]
+
+    def _word(self, i):
+        offset = self._entries + i * TERM.size
+        str_offset, _, length = struct.unpack_from('<QQI', self._mm, offset)
+        return self._mm[self._strings + str_offset:self._strings + str_offset + length]
+
+    def lookup(self, word):
+        """
+            binary search `word` in the term dictionary
+            return: (word offset, postings offset, word length, df, max_score, position) or None
+        """
+        if word in self._terms:
+            return self._terms[word]
+        encoded = word.encode('utf-8')
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.num_terms or self._word(lo) != encoded:
+            # the words not in the index are not kept, they may be any word of the queries
+            return None
+        entry = self._terms[word] = TERM.unpack_from(self._mm, self._entries + lo * TERM.size) + (lo,)
+        return entry
+
+    def words(self):
+        return [str(self._word(i), 'utf-8') for i in range(self.num_terms)]
+
+    def items(self):
+        """
+            decode the postings of every word in the term dictionary order
+            return: iterator of (word, list of (doc_no, tf))
+        """
+        for i in range(self.num_terms):
+            _, offset, _, df, _ = TERM.unpack_from(self._mm, self._entries + i * TERM.size)
+            yield str(self._word(i), 'utf-8'), decode_postings(self._buf, self._data + offset, df)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python3 -m engine.index_format <cache.json> <index.bin>')
+        sys.exit(2)
+    convert(sys.argv[1], sys.argv[2])
@@ -0,0 +1,277 @@
+"""
+Indexing of the search engine: the documents of a collection are tokenized
+(by several processes with -j), inverted into a compact_index.CompactIndex and
+written to the binary index with the BM25 upper bounds of every word. The
+documents not changed since the old index was built are copied from it. With a
+memory budget (-M) the postings are flushed to segments on disk and merged
+instead (spimi.SpimiIndex). With positions the positions of the words are also
+kept and written to the positional index (see positions).
+"""
+import os
+import math
+import time
+from array import array
+from . import index_format
+from . import document_reader
+from . import compact_index
+from . import profiling
+from . import query_cache
+from . import positions as positional
+from .bm25 import BM25
+from .tokenizer import Tokenizer
+
+# the most files processed in one shard while indexing
+MAX_SHARD = 256
+
+
+def index_files(shard):
+    """
+        tokenize, remove stopwords and stem the documents in one shard, a shard is processed
+        by a single process
+        parameter: shard(tuple of list of (file path, packed), the Tokenizer, None in a worker process,
+                   True to profile it and True to keep the positions of the words)
+        return: list of the documents of every file in the same order as the files, a document is
+                (DOCNO or None, doc length, words frequency) and the words positions if they are kept,
+                the CPU seconds spent, the stems added by this shard and the profiling.Profile report
+                (None if not profiled)
+    """
+    files, tokenizer, profile, positions = shard
+    if tokenizer is None:
+        # in a worker process, the tokenizer is sent once when the pool starts
+        tokenizer = Tokenizer.worker
+    if not profile:
+        return _index_files(files, tokenizer, positions) + (None,)
+    # recorded apart, the main process merges it into its own stages (also for a worker process)
+    with profiling.recording() as recorded:
+        result = _index_files(files, tokenizer, positions)
+    return result + (recorded.report(),)
+
+
+def _index_files(files, tokenizer, positions=False):
+    start = time.process_time()
+    profile = profiling.active
+    count = tokenizer.count_positions if positions else tokenizer.count
+    docs = []
+    for path, packed in files:
+        documents = []
+        for docno, words in document_reader.read_documents(path, packed):
+            if profile is None:
+                # the tokens are streamed from the file, a document is never read at once
+                documents.append((docno, *count(words)))
+                continue
+            # read before tokenizing to time them apart
+            with profile.stage('read documents'):
+                words = list(words)
+            with profile.stage('tokenize'):
+                documents.append((docno, *count(words)))
+        docs.append(documents)
+        if profile is not None:
+            profile.count('files')
+            profile.count('documents', len(documents))
+    return docs, time.process_time() - start, tokenizer.new_stems()
+
+
+def list_documents(collection, verbose=True):
+    """
+        walk the corpus recursively, a file is one document or many documents packed in the TREC
+        format (.trec), both may be compressed by gzip (.gz)
+        return: list of (doc_id or None if the file is packed, file path, (path relative to the corpus,
+                mtime in ns, size))
+    """
+    path = collection.documents
+    documents = []
+    for root, _, files in os.walk(path):
+        # the paths of a file are the ones of its directory and its name, os.path.join and os.path.relpath
+        # of every file were most of the time of listing
+        relative = os.path.relpath(root, path)
+        prefix = '' if relative == os.curdir else relative + os.sep
+        directory = os.path.join(root, '')
+        for file in files:
+            name = file[:-3] if file.endswith('.gz') else file
+            doc_id = collection.document_id(name)
+            if doc_id is not None or name.endswith('.trec') or file.endswith('.gz'):
+                file_path = directory + file
+                stat = os.stat(file_path)
+                documents.append((doc_id, file_path, (prefix + file, stat.st_mtime_ns, stat.st_size)))
+            elif verbose:
+                print(f'file name ${file} {collection.invalid}')
+    return collection.select(documents)
+
+
+def preprocess_doc(collection, tokenizer, jobs=1, index=None, memory=None, positions=False, old_positions=None):
+    """
+        build the index of the documents of `collection`, the documents not changed since `index`
+        (the old index_format.BinaryIndex) was built are copied from it instead of processing again,
+        with a `memory` budget in bytes the postings are flushed to segments on disk (see spimi).
+        With `positions` the positions of the words are kept too (not within a memory budget), the
+        documents are only copied from `index` with their positions in `old_positions`
+        (positions.PositionalIndex of the old index)
+        return: compact_index.CompactIndex, or spimi.SpimiIndex with a memory budget
+    """
+    # the new index, words and documents are numbered
+    if memory is None:
+        inverted = compact_index.CompactIndex(positions)
+    else:
+        from . import spimi
+        inverted = spimi.SpimiIndex(os.path.dirname(os.path.abspath(collection.index)), memory)
+    start = time.perf_counter()
+    with profiling.stage('list documents'):
+        documents = list_documents(collection)
+    reused = dict() # reused[i] is the doc_nos in the old index of documents[i] if the file is not changed
+    if index is not None and index.files is not None and (not positions or old_positions is not None):
+        indexed = dict()
+        for doc_no, file in enumerate(index.files):
+            indexed.setdefault(file, []).append(doc_no)
+        for i, (_, _, file) in enumerate(documents):
+            if file in indexed:
+                reused[i] = indexed[file]
+    paths = [(file_path, doc_id is None) for i, (doc_id, file_path, _) in enumerate(documents) if i not in reused]
+    if paths:
+        # start from the stems saved by the last run
+        tokenizer.load()
+    # split the files into contiguous shards (a few per process to balance the load), the shards
+    # are returned in order so the documents keep the same doc_no as serial. A shard has at most
+    # MAX_SHARD files, only the words frequency of the documents in a few shards are in memory
+    size = max(1, min(MAX_SHARD, math.ceil(len(paths) / (jobs * 4))))
+    profile = profiling.active
+    if jobs > 1 and paths:
+        shards = [(paths[i:i + size], None, profile is not None, positions) for i in range(0, len(paths), size)]
+        # only imported to index in parallel, searching an index does not need it
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs, Tokenizer.init_worker, (tokenizer,))
+        results = pool.imap(index_files, shards)
+    else:
+        pool = None
+        results = map(index_files, ((paths[i:i + size], tokenizer, profile is not None, positions)
+                                    for i in range(0, len(paths), size)))
+    # renumber[doc_no] is the new doc_no of a document in the old index, -1 if it is not reused
+    renumber = array('q', [-1]) * (index.N if reused else 0)
+    busy = 0
+    new = 0
+    processed = iter(())
+    for i, (doc_id, _, file) in enumerate(documents):
+        if i in reused:
+            for doc_no in reused[i]:
+                renumber[doc_no] = inverted.add_document(index.doc_len.doc_ids[doc_no], index.doc_len.lengths[doc_no], file)
+        else:
+            docs = next(processed, None)
+            if docs is None:
+                shard, seconds, stems, report = next(results)
+                busy += seconds
+                tokenizer.add_stems(stems)
+                if report is not None:
+                    profile.merge(report)
+                processed = iter(shard)
+                docs = next(processed)
+            new += len(docs)
+            # the documents packed in a file are named by their DOCNO
+            docs = [(doc_id if docno is None else collection.document_id(docno), *counts) for docno, *counts in docs]
+            for doc_id, cnt, doc, *where in docs:
+                if doc_id is None:
+                    continue
+                doc_no = inverted.add_document(doc_id, cnt, file)
+                if where:
+                    # the positions of every word of the document
+                    for word, tf in doc.items():
+                        inverted.add(word, doc_no, tf, where[0][word])
+                    continue
+                for word, tf in doc.items():
+                    inverted.add(word, doc_no, tf)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    tokenizer.save()
+    # the postings of the reused documents are copied from the old postings
+    if reused:
+        with profiling.stage('copy old postings'):
+            for i, (word, old_postings) in enumerate(index.items()):
+                if not positions:
+                    for doc_no, tf in old_postings:
+                        if renumber[doc_no] >= 0:
+                            inverted.add(word, renumber[doc_no], tf)
+                    continue
+                where = old_positions.at(i, old_postings)
+                for j, (doc_no, tf) in enumerate(old_postings):
+                    if renumber[doc_no] >= 0:
+                        inverted.add(word, renumber[doc_no], tf, where[j])
+    with profiling.stage('finish'):
+        inverted.finish()
+    wall = time.perf_counter() - start
+    # busy is the CPU time of processing the documents summed over the processes, divided by the wall
+    # time it is the average number of busy processes, not a speedup measured against a single process
+    if paths:
+        print(f'Indexed {new} documents with {jobs} process(es) in {wall:.2f}s, '
+              f'processing took {busy:.2f}s CPU time ({busy / wall:.2f}x CPU utilisation)')
+    if reused:
+        print(f'{sum(len(doc_nos) for doc_nos in reused.values())} unchanged documents are copied from the old index')
+    return inverted
+
+
+def build_index(collection, tokenizer, jobs=1, index=None, impact_bits=0, memory=None, positions=False,
+                old_positions=None):
+    """
+        build (or update from `index`) the index and write it to collection.index, the impact
+        scores are precomputed with `impact_bits` (64, 16 or 8) bits unless it is 0, with a `memory`
+        budget in bytes the postings are flushed to segments on disk and merged (see spimi). With
+        `positions` the positions of the words are written to collection.positions, see preprocess_doc
+        for `old_positions`
+    """
+    if positions and memory is not None:
+        print('The positions of the words are indexed in memory, the memory budget is not used')
+        memory = None
+    with profiling.stage('preprocess'):
+        inverted = preprocess_doc(collection, tokenizer, jobs, index, memory, positions, old_positions)
+    try:
+        # the scores are computed and written one word at a time, BM25 only sees the postings of the word
+        bm25 = BM25(inverted.avg_doc_len, inverted.N, dict(), inverted.frequency, inverted.doc_len)
+        impact_scale = 0
+        if impact_bits and impact_bits != 64:
+            # the saturated tf are quantized in steps of impact_scale, found by a first pass
+            with profiling.stage('impact scale'):
+                for word, postings in inverted.items():
+                    bm25.postings = {word: postings}
+                    impact_scale = max(impact_scale, max(bm25.impact_scores()[1][word], default=0))
+            impact_scale /= (1 << impact_bits) - 1
+        start = time.perf_counter()
+        with profiling.stage('write index'):
+            written = index_format.write_terms(collection.index, inverted.avg_doc_len, inverted.N,
+                                               _scored_terms(bm25, inverted.items(), impact_bits), inverted.doc_len,
+                                               BM25.k, BM25.b, inverted.files, impact_bits, impact_scale)
+        print(f'Wrote {written / (1 << 20):.1f} MB of BM25 index in {time.perf_counter() - start:.2f}s'
+              + (f', impact scores stored with {impact_bits} bits' if impact_bits else ''))
+        if positions:
+            start = time.perf_counter()
+            with profiling.stage('write positions'):
+                # the same words in the same order as the index, tied to the index just written
+                written = positional.write(collection.positions, (inverted.positions(word) for word, _ in inverted.items()),
+                                           query_cache.index_signature(collection.index))
+            print(f'Wrote {written / (1 << 20):.1f} MB of positions in {time.perf_counter() - start:.2f}s')
+        elif os.path.exists(collection.positions):
+            # the positions of the old index
+            os.remove(collection.positions)
+        if memory is not None:
+            print(f'{len(inverted.segments)} segments ({inverted.bytes_written / (1 << 20):.1f} MB) were flushed within '
+                  f'the {memory / (1 << 20):.0f} MB memory budget and merged in {inverted.merge_seconds:.2f}s')
+    finally:
+        if memory is not None:
+            inverted.close()
+    peak = compact_index.peak_memory()
+    if peak is not None:
+        print(f'Peak memory of indexing: {peak:.0f} MB')
+
+
+def _scored_terms(bm25, items, impact_bits=0):
+    """
+        add the upper bound score (and impact scores) to the postings of every word
+        return: iterator of the terms of index_format.write_terms
+    """
+    for word, postings in items:
+        bm25.postings = {word: postings}
+        upper_bound = bm25.max_scores()[word]
+        impact = None
+        if impact_bits:
+            idf, tf_parts = bm25.impact_scores()
+            impact = idf[word], tf_parts[word]
+        profiling.count('terms written')
+        profiling.count('postings written', len(postings))
+        yield word, postings, len(postings), upper_bound, impact
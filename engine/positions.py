@@ -0,0 +1,244 @@
+"""
+Positional index of the search engine, written next to the BM25 index when the
+positions are indexed (--positions on).
+
+The position of a word in a document is the number of the token among all the
+tokens of the document, stopwords included, so the stopwords of a phrase keep
+their place ("bank of america" is bank at p and america at p + 2). The file has
+the positions of every posting of the BM25 index, in the order of its term
+dictionary and of the postings, and records the signature of the index it
+belongs to (it is ignored once the index is rebuilt without it).
+
+Layout (little endian):
+    header
+    term offsets    uint64[num_terms + 1], where the positions of each word start
+    per word:
+        skips       uint32[ceil(df / SKIP)], the offset of every SKIP-th posting after the skips
+        positions   per posting: tf gaps (the first from 0), varint encoded
+
+The tf of a posting is its number of positions, so it is not stored again. A
+posting is reached from the skip before it, so only the positions of the
+documents a query looks at are decoded.
+
+Phrase queries intersect the postings of the phrase words from the rarest one,
+the others are galloped (exponential then binary search) to its documents, and
+only the positions of the documents with every word are compared.
+"""
+import os
+import sys
+import mmap
+import struct
+import bisect
+from array import array
+from operator import itemgetter
+from .index_format import encode_varint, _native
+
+MAGIC = b'BM25POS1'
+# magic, num_terms, the signature of the BM25 index (mtime in ns, size)
+HEADER = struct.Struct('<8sQqQ')
+# the postings between two skips
+SKIP = 64
+
+
+def encode(positions):
+    """
+        parameter: positions, the sorted positions of the word in each document of its postings
+        return: bytes of the skips and the positions of one word
+    """
+    skips = array('I')
+    out = bytearray()
+    for j, where in enumerate(positions):
+        if j % SKIP == 0:
+            skips.append(len(out))
+        prev = 0
+        for position in where:
+            encode_varint(position - prev, out)
+            prev = position
+    if sys.byteorder != 'little':
+        skips.byteswap()
+    return skips.tobytes() + out
+
+
+def write(path, terms, signature):
+    """
+        write the positional index of the BM25 index whose signature is `signature`
+        parameter: terms, iterable of the positions of every word (see encode) in the term dictionary order
+        return: number of bytes written
+    """
+    # only imported to write the positions, not to search them
+    import shutil
+    import tempfile
+    offsets = array('Q', [0])
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as data:
+        for positions in terms:
+            encoded = encode(positions)
+            data.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        num_terms = len(offsets) - 1
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, num_terms, *signature))
+            f.write(offsets.tobytes())
+            data.seek(0)
+            shutil.copyfileobj(data, f, 1 << 20)
+            written = f.tell()
+    os.replace(path + '.tmp', path)
+    return written
+
+
+class TermPositions:
+    """
+        the positions of one word in each document of its `postings`, positions[j] decodes the
+        positions of the j-th posting, they are the fastest to read in the postings order
+    """
+
+    def __init__(self, buf, start, postings):
+        self._buf = buf
+        self._postings = postings
+        blocks = (len(postings) + SKIP - 1) // SKIP
+        self._skips = _native(buf[start:start + 4 * blocks], 'I')
+        self._start = start + 4 * blocks
+        # the next posting and where its positions start
+        self._next = 0
+        self._pos = self._start
+
+    def __len__(self):
+        return len(self._postings)
+
+    def __getitem__(self, j):
+        if j < self._next or j // SKIP > self._next // SKIP:
+            self._next = j - j % SKIP
+            self._pos = self._start + self._skips[j // SKIP]
+        buf = self._buf
+        pos = self._pos
+        postings = self._postings
+        # skip the positions of the postings before j, one varint ends at each byte below 0x80
+        for i in range(self._next, j):
+            n = postings[i][1]
+            while n:
+                if buf[pos] < 0x80:
+                    n -= 1
+                pos += 1
+        positions = []
+        position = 0
+        for _ in range(postings[j][1]):
+            n = shift = 0
+            while True:
+                byte = buf[pos]
+                pos += 1
+                n |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            position += n
+            positions.append(position)
+        self._next = j + 1
+        self._pos = pos
+        return positions
+
+
+class PositionalIndex:
+    """
+        memory mapped positional index of the BM25 index `index` (index_format.BinaryIndex)
+    """
+
+    def __init__(self, path, index):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, mtime, size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a positional index')
+        # the signature of the BM25 index the positions belong to, see query_cache.index_signature
+        self.signature = [mtime, size]
+        self._buf = memoryview(self._mm)
+        self._offsets = _native(self._buf[HEADER.size:HEADER.size + 8 * (self.num_terms + 1)], 'Q')
+        self._data = HEADER.size + 8 * (self.num_terms + 1)
+        self._index = index
+
+    def at(self, i, postings):
+        """
+            return: TermPositions of the i-th word of the term dictionary, `postings` are its postings
+        """
+        return TermPositions(self._buf, self._data + self._offsets[i], postings)
+
+    def get(self, word, postings):
+        """
+            return: TermPositions of `word`, None if it is not in the index
+        """
+        entry = self._index.lookup(word)
+        if entry is None:
+            return None
+        return self.at(entry[5], postings)
+
+
+def gallop(postings, doc_no, lo=0):
+    """
+        return: the first index from `lo` of a posting of `postings` whose doc_no is at least `doc_no`
+    """
+    step = 1
+    hi = lo
+    while hi < len(postings) and postings[hi][0] < doc_no:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect.bisect_left(postings, doc_no, lo, min(hi, len(postings)), key=itemgetter(0))
+
+
+def intersect(lists):
+    """
+        the documents in every postings of `lists`, the documents of the first list are galloped to in
+        the others, so it is the fastest with the shortest list first
+        yield: (doc_no, the index of the document in each list)
+    """
+    cursors = [0] * len(lists)
+    for j, (doc_no, _) in enumerate(lists[0]):
+        cursors[0] = j
+        for i in range(1, len(lists)):
+            cursor = cursors[i] = gallop(lists[i], doc_no, cursors[i])
+            if cursor == len(lists[i]):
+                return
+            if lists[i][cursor][0] != doc_no:
+                break
+        else:
+            yield doc_no, list(cursors)
+
+
+def phrase_documents(index, postings, phrase):
+    """
+        parameters:
+            index: PositionalIndex
+            postings: the postings of the BM25 index
+            phrase: list of (offset, word) of the words of the phrase
+        return: sorted list of the doc_no of the documents with the phrase
+    """
+    words = []
+    for offset, word in phrase:
+        word_postings = postings.get(word)
+        if not word_postings:
+            return []
+        words.append((len(word_postings), offset, word, word_postings))
+    # the rarest word first
+    words.sort(key=itemgetter(0))
+    offsets = [offset for _, offset, _, _ in words]
+    terms = [index.get(word, word_postings) for _, _, word, word_postings in words]
+    matched = []
+    for doc_no, cursors in intersect([word_postings for _, _, _, word_postings in words]):
+        # where the phrase would start from each word
+        starts = None
+        for offset, term, j in zip(offsets, terms, cursors):
+            found = {position - offset for position in term[j]}
+            starts = found if starts is None else starts & found
+            if not starts:
+                break
+        if starts:
+            matched.append(doc_no)
+    return matched
+
+
+def phrase_key(phrase):
+    """
+        the phrase as a query word of the query cache keys, it cannot be a word of the index
+    """
+    words = dict(phrase)
+    return '"' + ' '.join(words.get(offset, '*') for offset in range(phrase[0][0], phrase[-1][0] + 1)) + '"'
@@ -0,0 +1,142 @@
+"""
+Cache of the decoded postings of the memory mapped index within a memory budget.
+
+Reading the postings of a word from index.bin decodes its varints every time,
+so a popular word is decoded again by every query that has it. The cache sits
+between BM25 and the index: it keeps the decoded postings of the words while
+their estimated size fits in the budget, and evicts the least recently used
+word first (lru). With tinylfu a word only replaces the words it would evict if
+it has been read more often than each of them (TinyLFU admission), so a burst
+of rare words does not flush the popular ones. The frequencies are estimated by
+a count-min sketch of small counters that are halved after every `sample`
+reads, so the words popular long ago are forgotten.
+
+The size of a decoded postings list is an estimate of its Python objects (the
+list, a tuple per posting and its doc_no), the memory of searching is about
+the budget plus the memory mapped pages the OS keeps, whatever the corpus size.
+"""
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from . import profiling
+
+POLICIES = ('lru', 'tinylfu')
+# the estimated bytes of one (doc_no, tf) posting, the small tf are shared by Python
+POSTING_BYTES = sys.getsizeof((1 << 20, 1)) + sys.getsizeof(1 << 20)
+# the rows of the count-min sketch and the largest count
+DEPTH = 4
+MAX_COUNT = 15
+
+
+def postings_bytes(postings):
+    """
+        return: the estimated bytes of the decoded `postings` (list of (doc_no, tf))
+    """
+    return sys.getsizeof(postings) + len(postings) * POSTING_BYTES
+
+
+class FrequencySketch:
+    """
+        count-min sketch of how often the words are read, the counters stop at MAX_COUNT and are
+        all halved after `sample` reads
+    """
+
+    def __init__(self, width=1 << 14, sample=None):
+        self.width = width
+        self.sample = sample or 10 * width
+        self.reads = 0
+        self._counts = [bytearray(width) for _ in range(DEPTH)]
+
+    def _slots(self, word):
+        return [hash((row, word)) % self.width for row in range(DEPTH)]
+
+    def add(self, word):
+        for counts, slot in zip(self._counts, self._slots(word)):
+            if counts[slot] < MAX_COUNT:
+                counts[slot] += 1
+        self.reads += 1
+        if self.reads >= self.sample:
+            self.reads //= 2
+            self._counts = [bytearray(count >> 1 for count in counts) for counts in self._counts]
+
+    def estimate(self, word):
+        return min(counts[slot] for counts, slot in zip(self._counts, self._slots(word)))
+
+
+class PostingsCache(Mapping):
+    """
+        read only dict-like view of `postings` (index_format.BinaryIndex.postings) that keeps the
+        decoded postings of the words within `budget` bytes, evicted by `policy` (lru or tinylfu)
+    """
+
+    def __init__(self, postings, budget, policy='lru'):
+        if policy not in POLICIES:
+            raise ValueError(f'unknown postings cache policy {policy}')
+        self._postings = postings
+        self.budget = budget
+        self.policy = policy
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # word: (postings, bytes), the least recently used first
+        self._entries = OrderedDict()
+        self._sketch = FrequencySketch() if policy == 'tinylfu' else None
+
+    def __getitem__(self, word):
+        if self._sketch is not None:
+            self._sketch.add(word)
+        entry = self._entries.get(word)
+        if entry is not None:
+            self.hits += 1
+            profiling.count('postings cache hits')
+            self._entries.move_to_end(word)
+            return entry[0]
+        # KeyError if the word is not in the index
+        postings = self._postings[word]
+        self.misses += 1
+        profiling.count('postings cache misses')
+        size = postings_bytes(postings)
+        if self._admit(word, size):
+            while self.bytes + size > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+            self._entries[word] = (postings, size)
+            self.bytes += size
+        return postings
+
+    def _admit(self, word, size):
+        """
+            True if the postings of `word` of `size` bytes are kept, the words it evicts first
+        """
+        if size > self.budget:
+            return False
+        if self._sketch is None or self.bytes + size <= self.budget:
+            return True
+        frequency = self._sketch.estimate(word)
+        needed = self.bytes + size - self.budget
+        for victim, (_, evicted) in self._entries.items():
+            if self._sketch.estimate(victim) >= frequency:
+                return False
+            needed -= evicted
+            if needed <= 0:
+                return True
+        return True
+
+    def __iter__(self):
+        return iter(self._postings)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def items(self):
+        # every word is read once, they are not cached
+        return self._postings.items()
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return (f'Postings cache ({self.policy}): {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), '
+                f'{self.bytes / (1 << 20):.1f} of {self.budget / (1 << 20):.1f} MB in {len(self._entries)} words, '
+                f'{self.evictions} evicted')
@@ -0,0 +1,166 @@
+"""
+Per-stage instrumentation of indexing and query execution.
+
+The stages (reading the documents, tokenizing, stemming, the JSON caches,
+reading the postings, scoring, sorting...) are timed in wall and CPU time and
+the counters (tokens, stem cache hits, documents scored, postings read...) are
+added up while a Profile is recording, nothing is recorded otherwise:
+
+    from engine import profiling
+    with profiling.recording() as profile:
+        searcher.search('query words', 15)
+    print(profile.format())  # or profile.report(), the same as a dict
+
+A stage started in another stage (of the same thread) is named by both, like
+'search/read postings', so the time of a stage includes the time of its
+sub-stages. The worker processes of indexing and of search_many() with -j
+record their own Profile, merged into the stage running in the main process,
+so their stages add up the time of all the processes. With `cprofile` the whole
+block also runs under cProfile and its stats are dumped to that file (read them
+with python3 -m pstats).
+
+The CLI records it with --profile (and --cprofile <file>), printed at the end
+and saved to profile.json. The server mode only records the server process, the
+queries scored by its worker processes are not recorded.
+"""
+import time
+import threading
+import contextlib
+
+# the Profile recording, None when nothing is recorded
+active = None
+
+
+class Profile:
+    """
+        the wall and CPU seconds and the number of calls of every stage, and the counters
+    """
+
+    def __init__(self):
+        self.stages = dict()  # stages[name] is [calls, wall seconds, CPU seconds]
+        self.counters = dict()
+        # the names of the stages running in each thread, the outermost first
+        self._local = threading.local()
+        self._start = time.perf_counter(), time.process_time()
+
+    @property
+    def _path(self):
+        if not hasattr(self._local, 'path'):
+            self._local.path = []
+        return self._local.path
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._path.append(name)
+        path = '/'.join(self._path)
+        # a stage is listed before its sub-stages, which finish first
+        self.stages.setdefault(path, [0, 0.0, 0.0])
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(path, time.perf_counter() - wall, time.process_time() - cpu)
+            self._path.pop()
+
+    def add(self, name, wall, cpu, calls=1):
+        """
+            add the time of a stage measured elsewhere
+        """
+        stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+        stage[0] += calls
+        stage[1] += wall
+        stage[2] += cpu
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, report):
+        """
+            add the report() of another Profile (of a worker process), its stages are sub-stages
+            of the stage running here
+        """
+        prefix = ''.join(name + '/' for name in self._path)
+        for name, stage in report['stages'].items():
+            self.add(prefix + name, stage['wall_s'], stage['cpu_s'], stage['calls'])
+        for name, n in report['counters'].items():
+            self.count(name, n)
+
+    def report(self):
+        """
+            return: {'wall_s', 'cpu_s', 'stages': {name: {'calls', 'wall_s', 'cpu_s'}}, 'counters'},
+                    the stages in the order they first ran
+        """
+        return {
+            'wall_s': time.perf_counter() - self._start[0],
+            'cpu_s': time.process_time() - self._start[1],
+            'stages': {name: {'calls': calls, 'wall_s': wall, 'cpu_s': cpu}
+                       for name, (calls, wall, cpu) in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def format(self):
+        """
+            return: the report as a table, the sub-stages indented under their stage
+        """
+        report = self.report()
+        order = {name: i for i, name in enumerate(report['stages'])}
+
+        def position(name):
+            # the sub-stages right after their stage, in the order they first ran
+            parts = name.split('/')
+            return [order.get('/'.join(parts[:i]), order[name]) for i in range(1, len(parts) + 1)]
+
+        lines = [f'{"stage":<40}{"calls":>10}{"wall s":>11}{"CPU s":>11}{"% wall":>8}']
+        for name in sorted(report['stages'], key=position):
+            stage = report['stages'][name]
+            depth = name.count('/')
+            share = stage['wall_s'] / report['wall_s'] if report['wall_s'] else 0
+            lines.append(f'{"  " * depth + name.rsplit("/", 1)[-1]:<40}{stage["calls"]:>10}'
+                         f'{stage["wall_s"]:>11.3f}{stage["cpu_s"]:>11.3f}{share:>8.1%}')
+        lines.append(f'{"total":<40}{"":>10}{report["wall_s"]:>11.3f}{report["cpu_s"]:>11.3f}')
+        for name, n in report['counters'].items():
+            lines.append(f'{name:<40}{n:>10}')
+        return '\n'.join(lines)
+
+    def save(self, path):
+        import json
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def stage(name):
+    """
+        time the block as a stage of the Profile recording, if any
+    """
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
+
+
+def count(name, n=1):
+    if active is not None:
+        active.count(name, n)
+
+
+@contextlib.contextmanager
+def recording(profile=None, cprofile=None):
+    """
+        record the stages run in the block into `profile` (a new Profile by default), with
+        `cprofile` (a file path) the block also runs under cProfile and its stats are dumped there
+        return: the Profile
+    """
+    global active
+    previous = active
+    active = Profile() if profile is None else profile
+    profiler = None
+    if cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield active
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+        active = previous
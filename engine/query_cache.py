@@ -0,0 +1,92 @@
+"""
+LRU cache of query results used by the search engine.
+
+The key is the set of query words after removing stopwords and stemming (and
+the number of results), so the same words typed in another order or another
+case hit the same entry. The cache belongs to one version of the index (its
+signature), the index does not change while it is searched and a saved cache
+is only loaded back for the same index.
+"""
+import os
+import json
+from collections import OrderedDict
+from . import profiling
+
+
+def cache_key(words, k):
+    return frozenset(words), k
+
+
+def index_signature(path):
+    """
+        identify the version of the index file, it changes whenever the index is rebuilt or updated
+    """
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def ranking_signature(signature, **modes):
+    """
+        the signature of the results of the index ranked with `modes` (the BM25 options that change the
+        results, like proximity=True), the cache of another ranking is not used
+    """
+    return signature + sorted(name for name, enabled in modes.items() if enabled)
+
+
+class QueryCache:
+    """
+        results of the most recently used `size` queries, the least recently used is evicted
+    """
+
+    def __init__(self, size=1000, signature=None):
+        self.size = size
+        self.signature = signature
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+            return: the cached results or None
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return list(self._entries[key])
+
+    def put(self, key, results):
+        if self.size <= 0:
+            return
+        self._entries[key] = list(results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self, path):
+        # the least recently used first, so loading it back keeps the order
+        entries = [[sorted(words), k, results] for (words, k), results in self._entries.items()]
+        with profiling.stage('save query cache'), open(path, 'w') as f:
+            json.dump({'signature': self.signature, 'entries': entries}, f)
+
+    def load(self, path):
+        """
+            load the cache saved by save(), ignored if it is saved for another index
+        """
+        if not os.path.exists(path):
+            return
+        with profiling.stage('load query cache'), open(path, 'r') as f:
+            cache = json.load(f)
+        if cache['signature'] != self.signature:
+            return
+        for words, k, results in cache['entries']:
+            self.put(cache_key(words, k), [tuple(result) for result in results])
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return f'Query cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), {len(self)} of {self.size} entries'
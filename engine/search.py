@@ -0,0 +1,352 @@
+"""
+Python API of the search engine, used by the CLI:
+
+    from engine import LargeCorpus, Index, Searcher
+    index = Index(LargeCorpus('path/to/corpus')).open()
+    searcher = Searcher(index)
+    searcher.search('query words', 15)  # [(doc_id, score)] of the top 15 documents
+
+With the positions of the words indexed (Index.open(positions=True)) a query
+may quote phrases, searcher.search('"information retrieval" system'), and
+Searcher(index, proximity=True) ranks with the proximity of the query words.
+Searcher(index, conjunctive=True) only ranks the documents with every word.
+With the postings split into tiers (Index.open(tiers=0.1)) the top k is found
+from the first tiers, Searcher(index, pruned=True) only ranks from them.
+"""
+import os
+import math
+import time
+from . import index_format
+from . import query_cache
+from . import indexing
+from . import profiling
+from . import positions as positional
+from . import tiers as tiered
+from .bm25 import BM25
+from .postings_cache import PostingsCache
+from .tokenizer import Tokenizer, read_stopwords
+
+
+class Index:
+    """
+        the BM25 index of a collection, stored in collection.index and memory mapped, words
+        and postings are only read when a query use them
+    """
+
+    def __init__(self, collection, tokenizer=None, postings_cache=None):
+        self.collection = collection
+        # the tokenizer also keeps the stems of the words
+        if tokenizer is None:
+            tokenizer = Tokenizer(read_stopwords(collection.stopwords), collection.stem_cache)
+        self.tokenizer = tokenizer
+        # index_format.BinaryIndex, None until open()
+        self.binary = None
+        # positions.PositionalIndex, None if the positions of the words are not indexed
+        self.positions = None
+        # tiers.TierIndex, None if the postings are not split into tiers
+        self.tiers = None
+        # {'budget': bytes, 'policy': 'lru' or 'tinylfu'} of the cache of the decoded postings (see
+        # postings_cache), None to decode them for every query
+        self.postings_cache = postings_cache
+        # the postings read by BM25, the ones of `binary` or their cache
+        self.postings = None
+
+    def open(self, jobs=1, impact_bits=None, memory=None, positions=None, tiers=None):
+        """
+            load the index, it is built if it does not exist and updated if any document changed
+            parameters:
+                jobs: number of processes used for indexing
+                impact_bits: 64, 16 or 8 to store the impact scores in the index, 0 to remove them,
+                             None to keep the index as it is
+                memory: the memory budget of the postings while indexing in bytes, None for no limit
+                positions: True to index the positions of the words (phrase queries and proximity),
+                           False to remove them, None to keep the index as it is
+                tiers: the fraction of the postings of every word in the first tier to split them into
+                       tiers (see tiers), True for the fraction they are split with (tiers.FRACTION if they
+                       are not), 0 to remove the tiers, None to keep the index as it is
+            return: self
+        """
+        collection = self.collection
+        # detect if the index file is existed
+        if os.path.exists(collection.index):
+            print(collection.loading)
+        elif collection.json_cache is not None and os.path.exists(collection.json_cache):
+            # the JSON cache written by the older version, convert it to the binary index
+            print(collection.converting)
+            with profiling.stage('convert JSON cache'):
+                index_format.convert(collection.json_cache, collection.index)
+        else:
+            print(collection.building)
+            # process the document
+            self.build(jobs, impact_bits=impact_bits or 0, memory=memory, positions=bool(positions))
+        self.load()
+        # only the documents added, changed or deleted since the index was built are processed again
+        if self.binary.files is None:
+            # the index converted from cache.json does not record the documents, it is kept as it is
+            # when there are no documents to index again
+            if not indexing.list_documents(self.collection, False):
+                print('BM25 index does not record the documents and there are no documents, it is used as it is')
+            else:
+                print('BM25 index does not record the documents, please wait for indexing')
+                self.build(jobs, impact_bits=impact_bits or 0, memory=memory, positions=bool(positions))
+        else:
+            with profiling.stage('check documents'):
+                changes = self.changes()
+            if impact_bits is None:
+                impact_bits = self.binary.impact_bits
+            if positions is None:
+                # the positions of an older version of the index are indexed again
+                positions = os.path.exists(collection.positions)
+            if changes:
+                print(f'{changes} documents changed since BM25 index was built, please wait for updating')
+            elif impact_bits != self.binary.impact_bits:
+                print(f'Rebuilding BM25 index with {impact_bits or "no"} bits impact scores, please wait')
+            elif positions and self.positions is None:
+                print('Indexing the positions of the words, please wait')
+            if changes or impact_bits != self.binary.impact_bits or positions and self.positions is None:
+                self.build(jobs, self.binary, impact_bits, memory, positions)
+            elif not positions and self.positions is not None:
+                self.positions = None
+                os.remove(collection.positions)
+                print('Removed the positions of the words')
+        if tiers is None and os.path.exists(collection.tiers) or tiers is True:
+            # the fraction of the tiers, the tiers of an older version of the index are split again
+            tiers = tiered.fraction(collection.tiers) if os.path.exists(collection.tiers) else tiered.FRACTION
+        if tiers and (self.tiers is None or self.tiers.fraction != tiers):
+            print(f'Splitting the postings into tiers of the highest {tiers:.0%} and the rest, please wait')
+            self.split(tiers)
+        elif not tiers and os.path.exists(collection.tiers):
+            self.tiers = None
+            os.remove(collection.tiers)
+            print('Removed the tiers of the postings')
+        return self
+
+    def load(self):
+        """
+            map the index as it is, without checking the documents, it must exist
+            return: self
+        """
+        with profiling.stage('map index'):
+            self.binary = index_format.BinaryIndex(self.collection.index)
+            self.postings = self.binary.postings
+            if self.postings_cache is not None:
+                self.postings = PostingsCache(self.binary.postings, **self.postings_cache)
+            self.positions = None
+            if os.path.exists(self.collection.positions):
+                positions = positional.PositionalIndex(self.collection.positions, self.binary)
+                # the positions of an older version of the index are not used
+                if positions.signature == self.signature():
+                    self.positions = positions
+            self.tiers = None
+            if os.path.exists(self.collection.tiers):
+                tiers = tiered.TierIndex(self.collection.tiers, self.binary)
+                if tiers.signature == self.signature():
+                    self.tiers = tiers
+        return self
+
+    def build(self, jobs=1, old=None, impact_bits=0, memory=None, positions=False):
+        """
+            build the index (or update the `old` index) and load it, with the positions of the words
+            if `positions`
+        """
+        # the documents of the old index are only copied with their positions
+        old_positions = self.positions if positions else None
+        with profiling.stage('build index'):
+            indexing.build_index(self.collection, self.tokenizer, jobs, old, impact_bits, memory, positions, old_positions)
+        self.load()
+
+    def split(self, fraction):
+        """
+            split the postings of every word into the first tier of the highest `fraction` of the scores
+            and the tail, and load them
+        """
+        start = time.perf_counter()
+        with profiling.stage('split tiers'):
+            written = tiered.write(self.collection.tiers, BM25(self.binary.avg_doc_len, self.binary.N, None,
+                                                               self.binary.frequency, self.binary.doc_len),
+                                   self.binary.items(), self.signature(), fraction)
+        print(f'Wrote {written / (1 << 20):.1f} MB of tiers in {time.perf_counter() - start:.2f}s')
+        self.load()
+
+    def changes(self):
+        """
+            the number of documents added, changed or deleted since the index was built
+        """
+        files = [file for _, _, file in indexing.list_documents(self.collection, False)]
+        return index_format.count_changes(self.binary.files, files)
+
+    def signature(self):
+        """
+            identify the version of the index file, see query_cache.index_signature
+        """
+        return query_cache.index_signature(self.collection.index)
+
+    @property
+    def N(self):
+        return self.binary.N
+
+    def bm25(self, k=BM25.k, b=BM25.b):
+        """
+            the BM25 ranking of this index with parameters `k` and `b`
+        """
+        binary = self.binary
+        # the upper bound is only valid for the k and b it computed with
+        max_score = binary.max_score if binary.has_max_score(k, b) else None
+        impacts = binary.impacts if binary.has_max_score(k, b) else None
+        # the tiers are split by the scores of their k and b, computed from the tf as MaxScore does without
+        # the impact scores
+        tiers = self.tiers
+        if tiers is not None and ((tiers.k, tiers.b) != (k, b) or impacts is not None):
+            tiers = None
+        return BM25(binary.avg_doc_len, binary.N, self.postings, binary.frequency, binary.doc_len, k, b,
+                    max_score=max_score, impacts=impacts, tokenizer=self.tokenizer, positions=self.positions,
+                    tiers=tiers)
+
+
+class Searcher:
+    """
+        rank the documents of an opened Index, the results are kept in an LRU cache of
+        `cache_size` queries (0 to disable it), with `proximity` the documents where the query
+        words are close get a higher score (the positions of the words must be indexed), with
+        `conjunctive` only the documents with every query word are ranked, with `pruned` only the
+        documents in the first tiers of the postings (the postings must be split into tiers)
+    """
+
+    def __init__(self, index, cache_size=1000, k=BM25.k, b=BM25.b, proximity=False, conjunctive=False, pruned=False):
+        self.index = index
+        self.bm25 = index.bm25(k, b)
+        self.bm25.proximity = proximity
+        self.bm25.conjunctive = conjunctive
+        self.bm25.pruned = pruned
+        if cache_size:
+            # the cache only keep the results of this version of the index and this ranking
+            self.bm25.cache = query_cache.QueryCache(cache_size, query_cache.ranking_signature(
+                index.signature(), proximity=proximity, conjunctive=conjunctive, pruned=pruned))
+        self._batch = None
+
+    @property
+    def cache(self):
+        return self.bm25.cache
+
+    @cache.setter
+    def cache(self, cache):
+        self.bm25.cache = cache
+
+    @property
+    def N(self):
+        return self.index.N
+
+    @property
+    def cached(self):
+        # True if the last search() was answered from the cache
+        return self.bm25.cached
+
+    @property
+    def scored(self):
+        # the number of documents scored by the last search()
+        return self.bm25.scored
+
+    def search(self, query, k=15):
+        """
+            return: list of (doc_id, score) of the `k` highest score documents
+        """
+        return self.bm25.search(query, k)
+
+    def batch(self):
+        """
+            return: batch_search.BatchBM25 of the index, None if NumPy is not installed or the
+                    queries are ranked with the proximity of the words, conjunctive or pruned
+        """
+        if self.bm25.proximity and self.index.positions is not None or self.bm25.conjunctive \
+                or self.bm25.pruned and self.bm25.tiers is not None:
+            return None
+        if self._batch is None:
+            try:
+                from . import batch_search
+            except ImportError:
+                return None
+            self._batch = batch_search.BatchBM25(self.bm25)
+        return self._batch
+
+    def search_many(self, queries, k=15, jobs=1):
+        """
+            score all the queries together with NumPy, or one by one if NumPy is not installed,
+            with `jobs` > 1 the queries are split among `jobs` processes
+            return: list of the search() results of every query
+        """
+        if jobs > 1 and len(queries) > 1:
+            return self._search_parallel(queries, k, jobs)
+        batch = self.batch()
+        # the phrases are only matched one by one
+        if batch is not None and (self.index.positions is None or not any('"' in query for query in queries)):
+            return batch.search(queries, k)
+        return [self.search(query, k) for query in queries]
+
+    def _search_parallel(self, queries, k, jobs):
+        cache = self.cache
+        if cache is None:
+            todo = list(range(len(queries)))
+            results = [None] * len(queries)
+        else:
+            # the cached queries are answered here, the first query of every other key by the workers
+            keys = [query_cache.cache_key(self.bm25.terms(query), k) for query in queries]
+            results = [None] * len(queries)
+            first = dict()
+            for i, key in enumerate(keys):
+                if key not in first:
+                    first[key] = i
+                    results[i] = cache.get(key)
+            todo = [i for i in first.values() if results[i] is None]
+        # contiguous chunks, so a worker still scores many queries together
+        size = max(1, math.ceil(len(todo) / (jobs * 4)))
+        chunks = [([queries[i] for i in todo[start:start + size]], k) for start in range(0, len(todo), size)]
+        bm25 = self.bm25
+        profile = profiling.active
+        # imported here, a single query does not start the interpreter slower for it
+        from multiprocessing import Pool
+        # every worker maps the index file instead of receiving a copy of it
+        with Pool(jobs, _init_worker, (self.index.collection, bm25.k, bm25.b, profile is not None, bm25.proximity,
+                                       bm25.conjunctive, bm25.pruned, self.index.postings_cache)) as pool:
+            done = []
+            # imap returns the chunks in order
+            for chunk, report in pool.imap(_search_chunk, chunks):
+                done += chunk
+                if report is not None:
+                    profile.merge(report)
+        for i, scores in zip(todo, done):
+            results[i] = scores
+            if cache is not None:
+                cache.put(keys[i], scores)
+        if cache is not None:
+            # a query repeated in the list is a cache hit
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = cache.get(key) or results[first[key]]
+        return results
+
+
+# the Searcher of a worker process of search_many(), and True if the chunks are profiled
+_searcher = None
+_profile = False
+
+
+def _init_worker(collection, k, b, profile=False, proximity=False, conjunctive=False, pruned=False,
+                 postings_cache=None):
+    global _searcher, _profile
+    # the index is already built and updated by the main process
+    _searcher = Searcher(Index(collection, postings_cache=postings_cache).load(), 0, k, b, proximity, conjunctive,
+                         pruned)
+    _profile = profile
+
+
+def _search_chunk(chunk):
+    """
+        return: the search_many() results of the queries, and the profiling.Profile report of
+                scoring them (None if not profiled)
+    """
+    queries, k = chunk
+    if not _profile:
+        return _searcher.search_many(queries, k), None
+    with profiling.recording() as recorded:
+        results = _searcher.search_many(queries, k)
+    return results, recorded.report()
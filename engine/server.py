@@ -0,0 +1,342 @@
+"""
+Query server of the search engine, the index is loaded once and the queries are
+answered over HTTP (python3 -m engine --corpus <name> -m server):
+
+    GET  /search?q=<query>&k=<k>    top k results (default 15) as JSON
+    POST /search                    the same with the body {"q": <query>, "k": <k>}
+    GET  /stats                     latency histogram, percentiles and QPS
+
+The connections are served by asyncio, the scoring runs in a pool of worker
+processes, every worker memory maps the same index file so the index is only
+once in memory. The results of the recent queries are kept in the query cache
+of the server process and answered without a worker.
+"""
+import sys
+import json
+import time
+import bisect
+import itertools
+import signal
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from . import query_cache
+from .search import Index, Searcher
+
+# the largest k a client may ask for
+MAX_K = 1000
+# the largest request body accepted
+MAX_BODY = 1 << 20
+# the most header lines, and bytes of the request line and the headers, accepted
+MAX_HEADERS = 100
+MAX_HEAD = 1 << 16
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           414: 'URI Too Long', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}
+
+# the Searcher of a worker process
+_searcher = None
+
+
+def _init_worker(collection, ranking, postings_cache=None):
+    global _searcher
+    # the index is already built and updated by the server process, the worker only maps it,
+    # the server process caches the results and every worker its own decoded postings
+    _searcher = Searcher(Index(collection, postings_cache=postings_cache).load(), cache_size=0, **ranking)
+
+
+def _search(query, k):
+    return _searcher.search(query, k), _searcher.scored
+
+
+class Stats:
+    """
+        latency histogram and throughput of the queries answered by the server
+    """
+    # upper bounds of the histogram buckets in ms, the last bucket has no bound
+    BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self, window=60):
+        self.started = time.monotonic()
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.queries = 0
+        self.cached = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # the number of queries of each second in the last `window` seconds
+        self.window = window
+        self._seconds = deque()
+
+    def add(self, ms, cached=False):
+        self.buckets[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.queries += 1
+        self.cached += cached
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        second = int(time.monotonic())
+        if self._seconds and self._seconds[-1][0] == second:
+            self._seconds[-1][1] += 1
+        else:
+            self._seconds.append([second, 1])
+        self._expire(second)
+
+    def _expire(self, second):
+        while self._seconds and self._seconds[0][0] <= second - self.window:
+            self._seconds.popleft()
+
+    def percentile(self, p):
+        """
+            the upper bound of the bucket the `p` percentile latency falls in, in ms
+        """
+        if not self.queries:
+            return None
+        rank = p / 100 * self.queries
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_ms
+
+    def qps(self):
+        """
+            return: queries per second since the start, and in the last `window` seconds
+        """
+        now = time.monotonic()
+        self._expire(int(now))
+        recent = sum(count for _, count in self._seconds)
+        return self.queries / max(now - self.started, 1e-9), recent / min(self.window, max(now - self.started, 1))
+
+    def report(self):
+        qps, recent = self.qps()
+        histogram = {f'<={bound}ms': count for bound, count in zip(self.BOUNDS, self.buckets)}
+        histogram[f'>{self.BOUNDS[-1]}ms'] = self.buckets[-1]
+        return {
+            'uptime_s': round(time.monotonic() - self.started, 3),
+            'queries': self.queries,
+            'cached': self.cached,
+            'errors': self.errors,
+            'qps': round(qps, 3),
+            f'qps_last_{self.window}s': round(recent, 3),
+            'latency_ms': {
+                'mean': round(self.total_ms / self.queries, 3) if self.queries else None,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': round(self.max_ms, 3),
+            },
+            'histogram': histogram,
+        }
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Server:
+    """
+        answer the queries of an opened Index over HTTP, with `workers` processes scoring the
+        queries (0 to score them in a thread of the server process), `ranking` are the proximity and
+        conjunctive options of Searcher
+    """
+
+    def __init__(self, index, workers=1, cache_size=1000, **ranking):
+        self.index = index
+        self.workers = workers
+        signature = query_cache.ranking_signature(index.signature(), **ranking)
+        self.cache = query_cache.QueryCache(cache_size, signature) if cache_size else None
+        # the words of the queries as the Searcher keys its cache (the phrases are words of the key), read in
+        # the event loop
+        bm25 = index.bm25()
+        bm25.conjunctive = ranking.get('conjunctive', False)
+        self._terms = bm25.terms
+        self.stats = Stats()
+        if workers:
+            self.pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                            initargs=(index.collection, ranking, index.postings_cache))
+            self._search = _search
+        else:
+            # a Searcher is not thread safe, one thread scores the queries one by one with its own Index (and
+            # tokenizer, the stems of the query words are cached), the event loop reads the words of the queries
+            # with the tokenizer of `index`
+            self.pool = ThreadPoolExecutor(1)
+            searcher = Searcher(Index(index.collection, postings_cache=index.postings_cache).load(), cache_size=0,
+                                **ranking)
+            self._search = lambda query, k: (searcher.search(query, k), searcher.scored)
+
+    async def search(self, query, k):
+        start = time.perf_counter()
+        key = query_cache.cache_key(self._terms(query), k)
+        results = self.cache.get(key) if self.cache is not None else None
+        cached = results is not None
+        scored = 0
+        if not cached:
+            results, scored = await asyncio.get_running_loop().run_in_executor(self.pool, self._search, query, k)
+            if self.cache is not None:
+                self.cache.put(key, results)
+        ms = (time.perf_counter() - start) * 1000
+        self.stats.add(ms, cached)
+        return {
+            'query': query,
+            'k': k,
+            'results': [{'rank': rank + 1, 'doc_id': doc_id, 'score': score} for rank, (doc_id, score) in enumerate(results)],
+            'cached': cached,
+            'scored': scored,
+            'ms': round(ms, 3),
+        }
+
+    async def handle(self, method, target, body):
+        """
+            return: the JSON response of a request
+        """
+        url = urlsplit(target)
+        if url.path == '/stats':
+            if method != 'GET':
+                raise HTTPError(405, 'use GET')
+            report = self.stats.report()
+            if self.cache is not None:
+                report['cache'] = {'size': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses}
+            report['workers'] = self.workers
+            report['documents'] = self.index.N
+            return report
+        if url.path != '/search':
+            raise HTTPError(404, f'{url.path} not found')
+        if method == 'GET':
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        elif method == 'POST':
+            try:
+                params = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, 'the body is not JSON')
+            if not isinstance(params, dict):
+                raise HTTPError(400, 'the body is not a JSON object')
+        else:
+            raise HTTPError(405, 'use GET or POST')
+        query = params.get('q')
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, 'missing query q')
+        k = params.get('k', 15)
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            raise HTTPError(400, 'k is not a number')
+        if not 1 <= k <= MAX_K:
+            raise HTTPError(400, f'k should be between 1 and {MAX_K}')
+        return await self.search(query, k)
+
+    @staticmethod
+    async def _read_headers(reader, size):
+        """
+            read the headers of a request after its request line of `size` bytes
+            return: {lower case name: value}, HTTPError 431 if they are longer than MAX_HEAD or MAX_HEADERS
+        """
+        headers = dict()
+        try:
+            for count in itertools.count():
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                size += len(header)
+                if size > MAX_HEAD or count >= MAX_HEADERS:
+                    raise HTTPError(431, 'the headers are too large')
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            # a line longer than the limit of the reader (64 KiB)
+            raise HTTPError(431, 'the headers are too large')
+        return headers
+
+    async def connection(self, reader, writer):
+        """
+            serve the requests of one connection, it is kept alive unless the client closes it
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than the limit of the reader (64 KiB)
+                    await self._respond(writer, 414, {'error': 'the request line is too long'}, False)
+                    break
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'bad request line'}, False)
+                    break
+                try:
+                    headers = await self._read_headers(reader, len(line))
+                except HTTPError as e:
+                    await self._respond(writer, e.status, {'error': str(e)}, False)
+                    break
+                # HTTP/1.1 connections are kept alive by default, HTTP/1.0 ones only if asked
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or connection != 'close' and version != 'HTTP/1.0'
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {'error': 'bad content-length'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': 'the body is too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, response = 200, await self.handle(method, target, body)
+                except HTTPError as e:
+                    status, response = e.status, {'error': str(e)}
+                except Exception as e:
+                    # the exception is only logged, it is not sent to the client
+                    self.stats.errors += 1
+                    print(f'Error answering {method} {target}: {e!r}', file=sys.stderr)
+                    status, response = 500, {'error': 'internal error'}
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, response, keep_alive):
+        body = json.dumps(response).encode()
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                     f'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.connection, host, port)
+        print(f'Serving {self.index.N} documents on http://{host}:{port}/search?q=... with '
+              f'{self.workers or "no"} worker process(es), press Ctrl+C to stop')
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: stopped.done() or stopped.set_result(None))
+            except NotImplementedError:
+                # not on Windows, Ctrl+C raises KeyboardInterrupt there
+                pass
+        async with server:
+            await stopped
+
+    def run(self, host='127.0.0.1', port=8080):
+        """
+            serve until Ctrl+C or SIGTERM, then print the statistics
+        """
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+        print(json.dumps(self.stats.report(), indent=2))
@@ -0,0 +1,377 @@
+"""
+Sharded index of a collection, searched by scatter-gather.
+
+The files of the collection are split into `count` contiguous ranges (shards),
+each with its own index (index-<number>-of-<count>.bin), so no process holds
+the index of the whole collection. A shard is served by a local process, or by
+
+    python3 -m engine.shards --corpus {small|large} --shard <number>/<count> --port <port>
+
+listening on a TCP port, a stand-in for a shard on another host. The requests
+are pickled, so the coordinator and the shard servers authenticate the
+connections with a secret key set in BM25_SHARD_KEY, there is no default key.
+
+For every query the coordinator (ShardedSearcher) asks each shard for the
+document frequencies of the query words, then sends the query with the global
+df to every shard, all the shards work at the same time. The shards score with
+the N, df and avg_doc_len of the whole collection, and the shards are ranges of
+the document order of the single index, so merging their top-k by (score, shard,
+rank) gives the same results as searching one index of the collection.
+"""
+import os
+import sys
+import getopt
+from multiprocessing import Process, Pipe, AuthenticationError
+from multiprocessing.connection import Listener, Client
+from . import query_cache
+from . import profiling
+from .bm25 import BM25
+from .collection import COLLECTIONS
+from .postings_cache import POLICIES
+from .search import Index
+
+# the environment variable of the key the coordinator and the shard servers authenticate with
+KEY_VARIABLE = 'BM25_SHARD_KEY'
+
+
+def shard_key():
+    """
+        return: the key of the connections to the shard servers (bytes), ValueError if it is not set
+    """
+    key = os.environ.get(KEY_VARIABLE)
+    if not key:
+        raise ValueError(f'set {KEY_VARIABLE} to the secret key shared by the coordinator and the shard servers')
+    return key.encode()
+
+
+class Shard:
+    """
+        the documents of the `number`-th (from 0) of `count` shards of a collection, used as a
+        collection by Index
+    """
+
+    def __init__(self, collection, number, count):
+        self.collection = collection
+        self.number = number
+        self.count = count
+        self.index = os.path.join(collection.root, f'index-{number + 1}-of-{count}.bin')
+        self.positions = os.path.join(collection.root, f'positions-{number + 1}-of-{count}.bin')
+        # the shards score with the statistics of the whole collection, the tiers split by the scores of
+        # a shard are not used
+        self.tiers = os.path.join(collection.root, f'tiers-{number + 1}-of-{count}.bin')
+        # the JSON cache written by the older version is the index of the whole collection
+        self.json_cache = None
+        prefix = f'Shard {number + 1} of {count}: '
+        self.loading = prefix + collection.loading
+        self.building = prefix + collection.building
+
+    def __getattr__(self, name):
+        # the other paths, messages and the document ids are the ones of the collection
+        if name.startswith('__') or name == 'collection':
+            raise AttributeError(name)
+        return getattr(self.collection, name)
+
+    def select(self, documents):
+        """
+            the files of this shard among the files of the collection, a contiguous range of them
+        """
+        if len(documents) < self.count:
+            raise ValueError(f'{len(documents)} files cannot be split into {self.count} shards')
+        return documents[self.number * len(documents) // self.count:(self.number + 1) * len(documents) // self.count]
+
+
+class ShardServer:
+    """
+        answer the requests of the coordinator on the opened Index of a shard
+    """
+    # the methods the coordinator may call
+    requests = ('stats', 'open', 'frequency', 'search')
+
+    def __init__(self, index, k=BM25.k, b=BM25.b):
+        self.index = index
+        self.k = k
+        self.b = b
+        self.bm25 = None
+
+    def stats(self):
+        binary = self.index.binary
+        shard = self.index.collection
+        return {'number': shard.number, 'count': shard.count, 'N': binary.N,
+                'length': sum(binary.doc_len.lengths), 'signature': self.index.signature()}
+
+    def open(self, N, avg_doc_len, proximity=False, conjunctive=False):
+        """
+            score with the N and avg_doc_len of the whole collection, the df is given with the queries
+        """
+        binary = self.index.binary
+        # the upper bound and impact scores stored in the index are computed with the statistics
+        # of the shard, BM25 computes them again
+        self.bm25 = BM25(avg_doc_len, N, self.index.postings, dict(), binary.doc_len, self.k, self.b,
+                         tokenizer=self.index.tokenizer, positions=self.index.positions)
+        self.bm25.proximity = proximity
+        self.bm25.conjunctive = conjunctive
+
+    def frequency(self, queries):
+        """
+            return: {word: df in the shard} of the words of every query
+        """
+        frequency = self.index.binary.frequency
+        return [{word: frequency.get(word, 0) for word in self.bm25.terms(query)} for query in queries]
+
+    def search(self, queries, frequency, k):
+        """
+            parameters: frequency, {word: df in the collection} of the words of the queries
+            return: list of (search results, number of documents scored) of every query
+        """
+        # the df of a word does not change, the upper bounds computed with it are kept. The words of no
+        # document are not kept, a long running shard server would keep every word it is asked
+        self.bm25.frequency.update((word, df) for word, df in frequency.items() if df)
+        return [(self.bm25.search(query, k), self.bm25.scored) for query in queries]
+
+    def serve(self, conn):
+        """
+            answer the requests (method, arguments) until the coordinator closes the connection (or
+            it is lost), the reply is (True, result) or (False, error message)
+        """
+        try:
+            while True:
+                method, args = conn.recv()
+                if method == 'close':
+                    break
+                if method not in self.requests:
+                    conn.send((False, f'unknown request {method}'))
+                    continue
+                try:
+                    reply = (True, getattr(self, method)(*args))
+                except Exception as e:
+                    reply = (False, repr(e))
+                conn.send(reply)
+        except (EOFError, OSError):
+            # the coordinator exited or crashed, the next one may connect
+            pass
+        finally:
+            conn.close()
+
+
+def _serve_local(conn, shard, k, b, postings_cache=None):
+    # the process of a local shard, the index is built by the coordinator
+    ShardServer(Index(shard, postings_cache=postings_cache).load(), k, b).serve(conn)
+
+
+class ShardedSearcher:
+    """
+        search the shards of a collection, the same interface as search.Searcher
+        parameters: connections, multiprocessing connections to the ShardServer of every shard,
+                    proximity and conjunctive as search.Searcher (not pruned)
+    """
+
+    def __init__(self, connections, cache_size=1000, processes=(), proximity=False, conjunctive=False, pruned=False):
+        if pruned:
+            raise ValueError('the postings of the shards are not split into tiers')
+        self.connections = connections
+        # the local processes serving the shards, joined by close()
+        self.processes = list(processes)
+        stats = self._scatter('stats')
+        # the results are merged in the order of the shards
+        order = sorted(range(len(stats)), key=lambda i: stats[i]['number'])
+        self.connections = [connections[i] for i in order]
+        stats = [stats[i] for i in order]
+        if [s['number'] for s in stats] != list(range(len(stats))) or any(s['count'] != len(stats) for s in stats):
+            raise ValueError('the shards are not all the shards of one collection')
+        self.N = sum(s['N'] for s in stats)
+        # the same as the avg_doc_len of the single index, the sum of the lengths is exact
+        self.avg_doc_len = sum(s['length'] for s in stats) / self.N
+        self._scatter('open', self.N, self.avg_doc_len, proximity, conjunctive)
+        self.cache = None
+        if cache_size:
+            # the results of this version of the shards and this ranking
+            signature = query_cache.ranking_signature([s['signature'] for s in stats], proximity=proximity,
+                                                      conjunctive=conjunctive)
+            self.cache = query_cache.QueryCache(cache_size, signature)
+        self.cached = False
+        self.scored = 0
+
+    def _scatter(self, method, *args):
+        """
+            send the request to every shard, then gather their replies
+        """
+        for conn in self.connections:
+            conn.send((method, args))
+        replies = [conn.recv() for conn in self.connections]
+        for ok, reply in replies:
+            if not ok:
+                raise RuntimeError(f'shard failed to answer {method}: {reply}')
+        return [reply for _, reply in replies]
+
+    @staticmethod
+    def _merge(results, k):
+        # the top-k of the shards, the shards are in document order and the equal scores of a
+        # shard are ranked in document order, so the ties are broken as in the single index
+        ranked = sorted((-score, shard, rank, doc_id, score)
+                        for shard, shard_results in enumerate(results)
+                        for rank, (doc_id, score) in enumerate(shard_results))
+        return [(doc_id, score) for _, _, _, doc_id, score in ranked[:k]]
+
+    def search(self, query, k=15):
+        """
+            return: list of (doc_id, score) of the `k` highest score documents
+        """
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k=15, jobs=1):
+        """
+            the queries are sent to the shards together, `jobs` is not used as the shards already
+            score in parallel
+            return: list of the search() results of every query
+        """
+        profiling.count('queries', len(queries))
+        with profiling.stage('gather df'):
+            frequencies = self._scatter('frequency', queries)
+        # the words of every query are the same in every shard
+        keys = [query_cache.cache_key(words, k) for words in frequencies[0]]
+        results = [None] * len(queries)
+        if self.cache is None:
+            todo = list(range(len(queries)))
+        else:
+            first = dict()  # the first query of each key
+            with profiling.stage('cache'):
+                for i, key in enumerate(keys):
+                    if key not in first:
+                        first[key] = i
+                        results[i] = self.cache.get(key)
+            todo = [i for i in first.values() if results[i] is None]
+            profiling.count('cache hits', len(first) - len(todo))
+        self.cached = not todo
+        self.scored = 0
+        if todo:
+            frequency = dict()
+            for shard in frequencies:
+                # the df of the words in this shard, a word may be in many queries
+                words = dict()
+                for i in todo:
+                    words.update(shard[i])
+                for word, df in words.items():
+                    frequency[word] = frequency.get(word, 0) + df
+            # every shard scores the queries with the df of the collection
+            with profiling.stage('scatter search'):
+                replies = self._scatter('search', [queries[i] for i in todo], frequency, k)
+            with profiling.stage('merge'):
+                for j, i in enumerate(todo):
+                    results[i] = self._merge([reply[j][0] for reply in replies], k)
+                    self.scored += sum(reply[j][1] for reply in replies)
+                    if self.cache is not None:
+                        self.cache.put(keys[i], results[i])
+            profiling.count('documents scored', self.scored)
+        if self.cache is not None:
+            # a query repeated in the list is a cache hit
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = self.cache.get(key) or results[first[key]]
+        return results
+
+    def batch(self):
+        # the shards score the queries
+        return None
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(('close', ()))
+            except (OSError, EOFError):
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+def open_shards(collection, count, jobs=1, impact_bits=None, cache_size=1000, k=BM25.k, b=BM25.b, memory=None,
+                positions=None, postings_cache=None, **ranking):
+    """
+        build or update the index of every shard, and serve each of them by a local process with its
+        own `postings_cache` (see search.Index), `ranking` are the proximity and conjunctive options
+        of search.Searcher
+        return: ShardedSearcher
+    """
+    connections = []
+    processes = []
+    for number in range(count):
+        shard = Shard(collection, number, count)
+        # one shard after another, they share the stem cache of the collection
+        Index(shard).open(jobs, impact_bits, memory, positions)
+        conn, child = Pipe()
+        process = Process(target=_serve_local, args=(child, shard, k, b, postings_cache), daemon=True)
+        process.start()
+        child.close()
+        connections.append(conn)
+        processes.append(process)
+    return ShardedSearcher(connections, cache_size, processes, **ranking)
+
+
+def connect_shards(addresses, cache_size=1000, key=None, **ranking):
+    """
+        connect to the shard servers started by `python3 -m engine.shards`
+        parameters: addresses, list of (host, port), key, the key of the shard servers (shard_key() if
+                    None), and `ranking` as open_shards
+        return: ShardedSearcher
+    """
+    key = key or shard_key()
+    return ShardedSearcher([Client(address, authkey=key) for address in addresses], cache_size, **ranking)
+
+
+USAGE = '''Usage: python3 -m engine.shards --corpus <name> --shard <number>/<count> --port <port> [--host <host>] [-j <jobs>] [-M <MB>]
+        [--positions <on|off>] [--postings-cache <MB>] [--cache-policy <lru|tinylfu>]
+    serve the shard <number> (from 1) of <count> shards of the collection in the current directory,
+    the coordinator connects with python3 -m engine --shards <host>:<port>,...
+    both authenticate with the secret key in the environment variable BM25_SHARD_KEY
+'''
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hj:M:", ["corpus=", "shard=", "host=", "port=", "positions=",
+                                                         "postings-cache=", "cache-policy="])
+        opts = dict(opts)
+        if '-h' in opts:
+            print(USAGE)
+            sys.exit()
+        collection = COLLECTIONS[opts['--corpus']]()
+        number, count = (int(n) for n in opts['--shard'].split('/'))
+        port = int(opts['--port'])
+        jobs = int(opts.get('-j', 1))
+        memory = int(opts['-M']) << 20 if '-M' in opts else None
+        positions = {'on': True, 'off': False}[opts['--positions']] if '--positions' in opts else None
+        postings_cache = None
+        if '--postings-cache' in opts:
+            postings_cache = {'budget': int(opts['--postings-cache']) << 20, 'policy': opts.get('--cache-policy', 'lru')}
+            if postings_cache['budget'] < 1 or postings_cache['policy'] not in POLICIES:
+                raise ValueError
+        if not 1 <= number <= count or jobs < 1 or memory is not None and memory < 1:
+            raise ValueError
+    except (getopt.GetoptError, KeyError, ValueError):
+        print(USAGE)
+        sys.exit(2)
+    try:
+        key = shard_key()
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    host = opts.get('--host', '127.0.0.1')
+    shard = Shard(collection, number - 1, count)
+    server = ShardServer(Index(shard, postings_cache=postings_cache).open(jobs, memory=memory, positions=positions))
+    with Listener((host, port), authkey=key) as listener:
+        print(f'Serving shard {number} of {count} ({server.index.N} documents) on {host}:{port}, press Ctrl+C to stop')
+        try:
+            # one coordinator at a time
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, AuthenticationError):
+                    # a client failed to authenticate
+                    continue
+                server.serve(conn)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
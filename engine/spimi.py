@@ -0,0 +1,160 @@
+"""
+Single-pass in-memory indexing (SPIMI) within a memory budget.
+
+The postings are added to a CompactIndex as usual, but once they take more than
+the budget they are sorted and flushed to a segment file on disk, and a new
+CompactIndex is started. When all the documents are added, items() merges the
+segments (k-way, by the utf-8 bytes of the words) and yields the postings of one
+word at a time, index_format.write_terms writes them to the index as they come.
+Only the postings of one segment, the document table and the df of the words
+are in memory, whatever the size of the collection.
+
+A segment is a sequence of records sorted by the word:
+    word length, df, postings size   uint32[3]
+    word                             utf-8
+    postings                         df pairs of (doc_no gap, tf), varint encoded
+"""
+import os
+import time
+import heapq
+import shutil
+import struct
+import itertools
+import tempfile
+from array import array
+from . import profiling
+from .compact_index import CompactIndex
+from .index_format import DocLengths, encode_varint, decode_postings
+
+RECORD = struct.Struct('<III')
+# the estimated bytes of a posting and of a word in CompactIndex, including finish()
+POSTING_BYTES = 20
+WORD_BYTES = 120
+
+
+def _write_segment(index, path):
+    """
+        write the postings of a finished CompactIndex sorted by word
+        return: number of bytes written
+    """
+    with open(path, 'wb') as f:
+        for word, postings in index.items():
+            encoded = word.encode('utf-8')
+            data = bytearray()
+            prev = 0
+            for doc_no, tf in postings:
+                encode_varint(doc_no - prev, data)
+                encode_varint(tf, data)
+                prev = doc_no
+            f.write(RECORD.pack(len(encoded), len(postings), len(data)))
+            f.write(encoded)
+            f.write(data)
+        return f.tell()
+
+
+def _read_segment(path):
+    """
+        return: iterator of (utf-8 word, postings) of a segment
+    """
+    with open(path, 'rb') as f:
+        while True:
+            record = f.read(RECORD.size)
+            if not record:
+                break
+            length, df, size = RECORD.unpack(record)
+            encoded = f.read(length)
+            yield encoded, decode_postings(f.read(size), 0, df)
+
+
+class SpimiIndex:
+    """
+        the same interface as CompactIndex, the postings are flushed to segment files in `directory`
+        when they take more than `memory_budget` bytes
+    """
+
+    def __init__(self, directory, memory_budget):
+        self.memory_budget = memory_budget
+        # the segments are removed by close()
+        self.directory = tempfile.mkdtemp(prefix='segments-', dir=directory)
+        self.segments = []
+        self.bytes_written = 0
+        self.merge_seconds = 0.0
+        self.frequency = dict()  # frequency[word] is the number of documents contain the word
+        self.doc_ids = []  # doc_ids[doc_no] is the document id
+        self.lengths = array('I')  # lengths[doc_no] is the document length
+        self.files = []  # files[doc_no] is (path, mtime in ns, size) of the document
+        self.doc_len = None
+        self._buffer = CompactIndex()
+        self._postings = 0
+
+    @property
+    def N(self):
+        return len(self.doc_ids)
+
+    @property
+    def avg_doc_len(self):
+        # 0 for an empty corpus, no document is scored
+        return sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+    def add_document(self, doc_id, length, file):
+        """
+            return: the doc_no of the document
+        """
+        self.doc_ids.append(doc_id)
+        self.lengths.append(length)
+        self.files.append(file)
+        return len(self.doc_ids) - 1
+
+    def add(self, word, doc_no, tf):
+        self._buffer.add(word, doc_no, tf)
+        self.frequency[word] = self.frequency.get(word, 0) + 1
+        self._postings += 1
+        if self._postings * POSTING_BYTES + len(self._buffer.words) * WORD_BYTES > self.memory_budget:
+            self.flush()
+
+    def flush(self):
+        """
+            write the postings in memory to a new segment
+        """
+        if not self._postings:
+            return
+        with profiling.stage('flush segment'):
+            self._buffer.finish()
+            path = os.path.join(self.directory, f'{len(self.segments)}.seg')
+            self.bytes_written += _write_segment(self._buffer, path)
+        self.segments.append(path)
+        self._buffer = CompactIndex()
+        self._postings = 0
+
+    def finish(self):
+        self.flush()
+        self.doc_len = DocLengths(self.doc_ids, self.lengths)
+
+    def items(self):
+        """
+            merge the segments
+            return: iterator of (word, postings) in the order of the utf-8 bytes of the words
+        """
+        start = time.perf_counter()
+        busy = 0.0
+        segments = [((encoded, i, postings) for encoded, postings in _read_segment(path))
+                    for i, path in enumerate(self.segments)]
+        # heapq.merge keeps the segment order of the same word
+        merged = heapq.merge(*segments, key=lambda record: record[0])
+        for encoded, records in itertools.groupby(merged, key=lambda record: record[0]):
+            lists = [postings for _, _, postings in records]
+            if len(lists) == 1:
+                postings = lists[0]
+            elif all(a[-1][0] < b[0][0] for a, b in zip(lists, lists[1:])):
+                postings = [posting for postings in lists for posting in postings]
+            else:
+                # the documents copied from the old index come after the new ones
+                postings = list(heapq.merge(*lists))
+            # the time the caller spends on the postings is not merging
+            pause = time.perf_counter()
+            yield encoded.decode('utf-8'), postings
+            busy += time.perf_counter() - pause
+        self.merge_seconds += time.perf_counter() - start - busy
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
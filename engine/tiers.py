@@ -0,0 +1,224 @@
+"""
+Tiered postings of the search engine, written next to the BM25 index when the
+postings are split into tiers (--tiers <fraction>).
+
+The postings of every word are split by their BM25 score (with the k and b of
+the index): the first tier has the highest `fraction` of them (at least
+MIN_FIRST), the tail has the rest and records the highest score in it. A query
+is scored from the first tiers, which are a small part of the postings, then
+the documents that may still get into the top-k are completed by looking up
+the words they miss in the tails, from the highest upper bound. The results
+are the same as the MaxScore search as long as no document outside the first
+tiers could beat the k-th score (the sum of the highest tail scores is below
+it), otherwise the query falls back to the whole postings. With --pruned the
+queries are only answered from the first tiers (static pruning), faster but
+the documents only in the tails are not ranked.
+
+Layout (little endian):
+    header
+    term offsets    uint64[num_terms + 1], where the tiers of each word start
+    tail max        float64[num_terms], the highest score in the tail of each word
+    per word:
+        first       varint count, then (doc_no gap, tf) varints in doc_no order
+        skips       varint blocks, then (first doc_no, offset of the block after the skips)
+                    varints of every block of SKIP tail postings
+        tail        per block: (doc_no gap, tf) varints, the gap of the first posting of a block is
+                    from its first doc_no in the skips (so 0), the others from the previous doc_no
+
+The file records the signature of the index it belongs to (it is ignored once
+the index is rebuilt without it), and the k and b of the scores.
+"""
+import os
+import sys
+import mmap
+import math
+import struct
+import bisect
+from array import array
+from .index_format import encode_varint, _native
+
+MAGIC = b'BM25TIER'
+# magic, num_terms, the signature of the BM25 index (mtime in ns, size), k, b, fraction
+HEADER = struct.Struct('<8sQqQddd')
+# the postings of a block of the tail
+SKIP = 64
+# the first tier of a word has at least this many postings, a word with fewer has no tail
+MIN_FIRST = 16
+# the fraction of the postings in the first tier by default
+FRACTION = 0.1
+
+
+def split(postings, scores, fraction):
+    """
+        return: the postings in the first tier and in the tail (both in doc_no order) and the highest
+                score in the tail (0 if there is no tail)
+    """
+    size = max(MIN_FIRST, math.ceil(fraction * len(postings)))
+    if size >= len(postings):
+        return postings, [], 0
+    # the highest scores, equal scores in document order
+    ranked = sorted(range(len(postings)), key=lambda j: (-scores[j], j))
+    first = set(ranked[:size])
+    tail = [j for j in range(len(postings)) if j not in first]
+    return ([postings[j] for j in sorted(first)], [postings[j] for j in tail],
+            max(scores[j] for j in tail))
+
+
+def encode(first, tail):
+    """
+        return: bytes of the tiers of one word
+    """
+    out = bytearray()
+    encode_varint(len(first), out)
+    prev = 0
+    for doc_no, tf in first:
+        encode_varint(doc_no - prev, out)
+        encode_varint(tf, out)
+        prev = doc_no
+    skips = bytearray()
+    blocks = bytearray()
+    encode_varint((len(tail) + SKIP - 1) // SKIP, skips)
+    for start in range(0, len(tail), SKIP):
+        base = tail[start][0]
+        encode_varint(base, skips)
+        encode_varint(len(blocks), skips)
+        for doc_no, tf in tail[start:start + SKIP]:
+            encode_varint(doc_no - base, blocks)
+            encode_varint(tf, blocks)
+            base = doc_no
+    return bytes(out + skips + blocks)
+
+
+def write(path, bm25, items, signature, fraction):
+    """
+        split the postings of every word of the BM25 index whose signature is `signature`
+        parameters:
+            bm25: BM25 of the index, the postings are split by its scores
+            items: iterable of (word, postings) in the term dictionary order
+        return: number of bytes written
+    """
+    # only imported to write the tiers, not to search them
+    import shutil
+    import tempfile
+    offsets = array('Q', [0])
+    tail_max = array('d')
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as data:
+        for word, postings in items:
+            first, tail, highest = split(postings, bm25.term_scores(word, postings), fraction)
+            encoded = encode(first, tail)
+            data.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            tail_max.append(highest)
+        num_terms = len(tail_max)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            tail_max.byteswap()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, num_terms, *signature, bm25.k, bm25.b, fraction))
+            f.write(offsets.tobytes())
+            f.write(tail_max.tobytes())
+            data.seek(0)
+            shutil.copyfileobj(data, f, 1 << 20)
+            written = f.tell()
+    os.replace(path + '.tmp', path)
+    return written
+
+
+def _varints(buf, pos, n):
+    # decode n varints from buf[pos], return: (list of them, the position after them)
+    values = []
+    for _ in range(n):
+        value = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values, pos
+
+
+class TermTiers:
+    """
+        the tiers of one word of document frequency `df`: first (list of (doc_no, tf)), tail_max and
+        the tf of a document in the tail by lookup()
+    """
+
+    def __init__(self, buf, pos, tail_max, df):
+        (count,), pos = _varints(buf, pos, 1)
+        pairs, pos = _varints(buf, pos, 2 * count)
+        self.first = []
+        doc_no = 0
+        for j in range(0, len(pairs), 2):
+            doc_no += pairs[j]
+            self.first.append((doc_no, pairs[j + 1]))
+        self.tail_max = tail_max
+        (blocks,), pos = _varints(buf, pos, 1)
+        skips, pos = _varints(buf, pos, 2 * blocks)
+        self._bases = skips[0::2]
+        self._offsets = skips[1::2]
+        self._buf = buf
+        self._start = pos
+        # the number of postings in the tail
+        self._size = df - count
+        # the decoded blocks, {block: {doc_no: tf}}
+        self._blocks = dict()
+
+    def lookup(self, doc_no):
+        """
+            return: the tf of the word in document `doc_no` if it is in the tail, else None
+        """
+        block = bisect.bisect_right(self._bases, doc_no) - 1
+        if block < 0:
+            return None
+        if block not in self._blocks:
+            pairs, _ = _varints(self._buf, self._start + self._offsets[block], 2 * min(SKIP, self._size - block * SKIP))
+            tfs = dict()
+            current = self._bases[block]
+            for j in range(0, len(pairs), 2):
+                current += pairs[j]
+                tfs[current] = pairs[j + 1]
+            self._blocks[block] = tfs
+        return self._blocks[block].get(doc_no)
+
+
+class TierIndex:
+    """
+        memory mapped tiers of the BM25 index `index` (index_format.BinaryIndex)
+    """
+
+    def __init__(self, path, index):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, mtime, size, self.k, self.b, self.fraction = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a tiered index')
+        # the signature of the BM25 index the tiers belong to, see query_cache.index_signature
+        self.signature = [mtime, size]
+        self._buf = memoryview(self._mm)
+        start = HEADER.size
+        self._offsets = _native(self._buf[start:start + 8 * (self.num_terms + 1)], 'Q')
+        start += 8 * (self.num_terms + 1)
+        self._tail_max = _native(self._buf[start:start + 8 * self.num_terms], 'd')
+        self._data = start + 8 * self.num_terms
+        self._index = index
+
+    def get(self, word):
+        """
+            return: TermTiers of `word`, None if it is not in the index
+        """
+        entry = self._index.lookup(word)
+        if entry is None:
+            return None
+        i = entry[5]
+        return TermTiers(self._buf, self._data + self._offsets[i], self._tail_max[i], entry[3])
+
+
+def fraction(path):
+    """
+        return: the fraction of the postings in the first tier of the tiers file `path`
+    """
+    with open(path, 'rb') as f:
+        return HEADER.unpack(f.read(HEADER.size))[-1]
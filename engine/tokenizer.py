@@ -0,0 +1,307 @@
+"""
+Tokenizer of the search engine, shared by indexing and query processing.
+
+The tokens of a document (read by document_reader) are counted before they
+are normalized, so the punctuation stripping, lower casing, stopword lookup and
+stemming are done once per distinct token of the document instead of once per
+token. The stems are kept in a cache shared by all the documents, it is saved
+to disk so the next indexing run starts warm. The words of the queries only
+read it, their other stems are kept in a small LRU cache, so a long running
+server does not keep every word it is asked.
+
+The terms are exactly the same as the ones of the original loop:
+    word = token.strip(string.punctuation)
+    if word.lower() not in stopwords: stem(word.lower())
+
+Micro-benchmark (tokens/second of the original loop and of the tokenizer):
+    python3 -m engine.tokenizer <stopwords file> <documents directory>
+"""
+import os
+import sys
+import json
+import time
+import string
+from array import array
+from collections import Counter, OrderedDict
+from . import profiling
+from .document_reader import open_document, read_tokens
+
+# the stems of the query words not in the stem cache kept by a Tokenizer
+QUERY_STEMS = 10000
+
+
+def read_stopwords(path):
+    stopwords = set()
+    with open(path, 'r') as f:
+        for line in f:
+            stopwords.add(line.strip())
+    return stopwords
+
+
+def stemmer_signature(stemmer):
+    """
+        identify the version of the stemmer, the saved stems are dropped when it changes
+    """
+    stat = os.stat(sys.modules[type(stemmer).__module__].__file__)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class Tokenizer:
+    """
+        turn documents and queries into terms (remove punctuation and stopwords, stem...)
+    """
+
+    # the Tokenizer of a worker process, sent once when the pool starts (init_worker)
+    worker = None
+
+    def __init__(self, stopwords, path=None):
+        self.stopwords = stopwords
+        # the file the stem cache is saved to, None if it is not saved
+        self.path = path
+        # stems[word] is the stem of the lower case `word`
+        self.stems = dict()
+        # the stems added since new_stems() was called, sent back by the worker processes
+        self._new = dict()
+        # terms[token] is the term of a token of a document, None if it is a stopword
+        self._terms = dict()
+        # the stems of the query words not in `stems`, the least recently used first
+        self._query_stems = OrderedDict()
+        self._stemmer = None
+        self._saved = 0
+
+    def __getstate__(self):
+        # sent to the worker processes without the stemmer and the tokens seen so far
+        state = self.__dict__.copy()
+        state['_stemmer'] = None
+        state['_terms'] = dict()
+        return state
+
+    @staticmethod
+    def init_worker(tokenizer):
+        Tokenizer.worker = tokenizer
+
+    @property
+    def stemmer(self):
+        if self._stemmer is None:
+            import files.porter as porter
+            self._stemmer = porter.PorterStemmer()
+        return self._stemmer
+
+    def stem(self, word):
+        """
+            parameter: word(str) in lower case
+        """
+        stem = self.stems.get(word)
+        if stem is None:
+            with profiling.stage('stem'):
+                stem = self.stemmer.stem(word)
+            self.stems[word] = stem
+            self._new[word] = stem
+            profiling.count('words stemmed')
+        else:
+            profiling.count('stem cache hits')
+        return stem
+
+    def query_stem(self, word):
+        """
+            stem() of a query word, the stems not in the stem cache are kept in an LRU cache of
+            QUERY_STEMS words instead of being added to it
+        """
+        stem = self.stems.get(word)
+        if stem is None:
+            stem = self._query_stems.get(word)
+        if stem is None:
+            with profiling.stage('stem'):
+                stem = self.stemmer.stem(word)
+            self._query_stems[word] = stem
+            if len(self._query_stems) > QUERY_STEMS:
+                self._query_stems.popitem(last=False)
+            profiling.count('words stemmed')
+        else:
+            if word in self._query_stems:
+                self._query_stems.move_to_end(word)
+            profiling.count('stem cache hits')
+        return stem
+
+    def count(self, tokens):
+        """
+            parameter: tokens(iterable of str) of a document split at whitespace
+            return: (number of words, {term: tf}) of the document, stopwords are not counted
+        """
+        cnt = 0
+        doc = dict()
+        terms = self._terms
+        normalized = 0
+        # the counter keeps the order the tokens first appear, so the terms are in the same order as
+        # counting them one by one
+        counts = Counter(tokens)
+        for token, tf in counts.items():
+            if token in terms:
+                term = terms[token]
+            else:
+                term = terms[token] = self._normalize(token)
+                normalized += 1
+            if term is not None:
+                cnt += tf
+                doc[term] = doc.get(term, 0) + tf
+        profile = profiling.active
+        if profile is not None:
+            profile.count('tokens', sum(counts.values()))
+            profile.count('tokens normalized', normalized)
+        return cnt, doc
+
+    def count_positions(self, tokens):
+        """
+            count() with the positions of the terms, the position of a term is the number of its token
+            among all the tokens of the document, stopwords included
+            return: (number of words, {term: tf}, {term: array of positions}) of the document
+        """
+        terms = self._terms
+        normalized = 0
+        positions = dict()
+        position = -1
+        for position, token in enumerate(tokens):
+            if token in terms:
+                term = terms[token]
+            else:
+                term = terms[token] = self._normalize(token)
+                normalized += 1
+            if term is not None:
+                if term in positions:
+                    positions[term].append(position)
+                else:
+                    positions[term] = array('I', (position,))
+        doc = {term: len(where) for term, where in positions.items()}
+        profile = profiling.active
+        if profile is not None:
+            profile.count('tokens', position + 1)
+            profile.count('tokens normalized', normalized)
+        return sum(doc.values()), doc, positions
+
+    def _normalize(self, token):
+        # the term of a token of a document, None if it is a stopword
+        word = token.strip(string.punctuation).lower()
+        return None if word in self.stopwords else self.stem(word)
+
+    def phrase_terms(self, phrase):
+        """
+            return: list of (offset, term) of the words of a quoted phrase, the words are normalized as the
+                    tokens of the documents and the offsets count the stopwords, as the positions do
+        """
+        terms = []
+        for offset, token in enumerate(phrase.split()):
+            if token in self._terms:
+                term = self._terms[token]
+            else:
+                word = token.strip(string.punctuation).lower()
+                term = None if word in self.stopwords else self.query_stem(word)
+            if term is not None:
+                terms.append((offset, term))
+        return terms
+
+    def query_terms(self, query, strip=False):
+        """
+            return: the set of terms of a query, the stopwords are kept as they are, with `strip` the
+                    punctuation around the words is removed as from the words of the documents
+        """
+        words = query.strip().split()
+        if strip:
+            words = [word for word in (word.strip(string.punctuation) for word in words) if word]
+        return {word if word in self.stopwords else self.query_stem(word.lower()) for word in words}
+
+    def new_stems(self):
+        """
+            return: the stems added since the last call
+        """
+        new, self._new = self._new, dict()
+        return new
+
+    def add_stems(self, stems):
+        self.stems.update(stems)
+
+    def load(self):
+        """
+            load the stems saved by save(), ignored if they are saved by another stemmer
+        """
+        self._saved = len(self.stems)
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with profiling.stage('load stems'), open(self.path, 'r') as f:
+            cache = json.load(f)
+        if cache['stemmer'] == stemmer_signature(self.stemmer):
+            cache['stems'].update(self.stems)
+            self.stems = cache['stems']
+            self._saved = len(self.stems)
+
+    def save(self):
+        """
+            save the stems if any stem is added since load()
+        """
+        if self.path is None or len(self.stems) == self._saved:
+            return
+        # the shard servers of a collection may save at the same time
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with profiling.stage('save stems'), open(tmp, 'w') as f:
+            json.dump({'stemmer': stemmer_signature(self.stemmer), 'stems': self.stems}, f)
+        os.replace(tmp, self.path)
+        self._saved = len(self.stems)
+
+
+def _count_by_token(stopwords, path, cache, p):
+    # the original loop of preprocess_doc, one token at a time
+    doc = dict()
+    cnt = 0
+    with open(path, 'r') as f:
+        for line in f.readlines():
+            for word in line.strip().split():
+                word = word.strip(string.punctuation)
+                if word.lower() not in stopwords:
+                    cnt += 1
+                    if word in cache:
+                        word = cache[word]
+                    else:
+                        tmp = word.lower()
+                        word = p.stem(word.strip().lower())
+                        cache[tmp] = word
+                    doc[word] = doc.get(word, 0) + 1
+    return cnt, doc
+
+
+def benchmark(stopwords_path, documents_path):
+    stopwords = read_stopwords(stopwords_path)
+    paths = [os.path.join(root, file) for root, _, files in os.walk(documents_path) for file in sorted(files)]
+    tokens = 0
+    for path in paths:
+        with open(path, 'r') as f:
+            tokens += len(f.read().split())
+
+    def run(name, count):
+        start = time.perf_counter()
+        docs = [count(path) for path in paths]
+        seconds = time.perf_counter() - start
+        print(f'{name:<24}{seconds:8.3f}s {tokens / seconds:12,.0f} tokens/s')
+        return docs
+
+    def streamed(tokenizer):
+        def count(path):
+            with open_document(path) as f:
+                return tokenizer.count(read_tokens(f))
+        return count
+
+    cache = dict()
+    p = Tokenizer(stopwords).stemmer
+    expected = run('token by token', lambda path: _count_by_token(stopwords, path, cache, p))
+    assert run('tokenizer, cold', streamed(Tokenizer(stopwords))) == expected
+    warm = Tokenizer(stopwords)
+    warm.add_stems(cache)
+    assert run('tokenizer, warm stems', streamed(warm)) == expected
+    print(f'{len(paths)} documents, {tokens} tokens, {len(cache)} distinct words')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python3 -m engine.tokenizer <stopwords file> <documents directory>')
+        sys.exit(2)
+    # files.porter is imported from the current directory, as the search programs do
+    sys.path.insert(0, os.getcwd())
+    benchmark(sys.argv[1], sys.argv[2])
@@ -0,0 +1,209 @@
+"""
+Sweep of the BM25 parameters k and b (and the idf) evaluated against the qrels,
+run in the directory of a collection:
+
+    python3 -m engine.tuning --corpus {small|large} [--k 0.5:2:0.1] [--b 0:1:0.05] [--idf bm25,lucene,idf]
+
+The postings of the words of all the queries in files/queries.txt are read from
+the index once, with the tf and document length of every posting and the df of
+every word. A grid point only computes the weight of every posting with its k,
+b and idf in one vectorized expression and adds them up per (query, document)
+with one np.bincount, then the top 15 of every query (as the automatic mode
+writes them) is evaluated in memory by engine.evaluation. The weights are
+computed with the same operations in the same order as BM25 (the same as
+batch_search), so k=1, b=0.75 with the bm25 idf gives exactly the results of
+the automatic mode.
+
+The idf variants:
+    bm25    log2((N - df + 0.5) / (df + 0.5)), the idf of the engine, negative scores count 0
+    lucene  log2(1 + (N - df + 0.5) / (df + 0.5)), never negative
+    idf     log2(N / df)
+
+It needs NumPy. The grid points are printed best first by --metric (MAP by
+default), with the setting of the engine marked.
+"""
+import os
+import sys
+import json
+import math
+import getopt
+import numpy as np
+from . import evaluation
+from .bm25 import BM25
+from .cli import read_queries
+from .collection import COLLECTIONS
+from .search import Index
+
+IDF = {
+    'bm25': lambda N, df: math.log2((N - df + 0.5) / (df + 0.5)),
+    'lucene': lambda N, df: math.log2(1 + (N - df + 0.5) / (df + 0.5)),
+    'idf': lambda N, df: math.log2(N / df),
+}
+# the number of results of a query written by the automatic mode
+DEPTH = 15
+
+
+class Sweep:
+    """
+        the postings of the words of the queries, scored with any k, b and idf
+        parameters:
+            index: an opened search.Index
+            queries: list of query(str)
+    """
+
+    def __init__(self, index, queries):
+        binary = index.binary
+        bm25 = index.bm25()
+        self.N = binary.N
+        self.avg_doc_len = binary.avg_doc_len
+        # read from the index once, every grid point looks up the doc ids of its rankings
+        self.doc_ids = list(binary.doc_len.doc_ids)
+        lengths = np.array(binary.doc_len.lengths, dtype=np.float64)
+        # the postings of every word of every query, in the order BM25.score adds them
+        slots, doc_nos, tfs, dfs = [], [], [], []
+        for i, query in enumerate(queries):
+            for word in bm25.terms(query):
+                postings = binary.postings.get(word) or ()
+                if not postings:
+                    continue
+                doc_nos.append(np.array([doc_no for doc_no, _ in postings], dtype=np.int64))
+                tfs.append(np.array([tf for _, tf in postings], dtype=np.float64))
+                slots.append(doc_nos[-1] + i * self.N)
+                dfs.append((binary.frequency[word], len(postings)))
+        self.queries = len(queries)
+        if not slots:
+            slots, doc_nos, tfs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        self.tf = np.concatenate(tfs)
+        self.length = lengths[np.concatenate(doc_nos)]
+        self.dfs = dfs
+        # the (query, document) pairs the postings add to, the scores of a grid point are added up in them
+        pairs, self.inverse = np.unique(np.concatenate(slots), return_inverse=True)
+        self.pair_query = pairs // self.N
+        self.pair_doc = pairs % self.N
+        self._idf = dict()
+
+    def idf(self, variant):
+        """
+            return: the idf of the word of every posting
+        """
+        if variant not in self._idf:
+            function = IDF[variant]
+            self._idf[variant] = np.repeat(np.array([function(self.N, df) for df, _ in self.dfs], dtype=np.float64),
+                                           [size for _, size in self.dfs])
+        return self._idf[variant]
+
+    def rankings(self, k=BM25.k, b=BM25.b, variant='bm25', depth=DEPTH):
+        """
+            return: list of the ranked doc_ids (positive scores only) of every query
+        """
+        tf = self.tf
+        # the same as BM25._term_score
+        weights = np.maximum((tf * (k + 1)) / (tf + k * (1 - b + b * self.length / self.avg_doc_len)) * self.idf(variant), 0)
+        scores = np.bincount(self.inverse, weights, minlength=len(self.pair_doc))
+        positive = np.flatnonzero(scores > 0)
+        # by query, then the higher score, equal scores in document order
+        order = positive[np.lexsort((self.pair_doc[positive], -scores[positive], self.pair_query[positive]))]
+        starts = np.searchsorted(self.pair_query[order], np.arange(self.queries + 1))
+        doc_nos = self.pair_doc[order].tolist()
+        return [[self.doc_ids[doc_no] for doc_no in doc_nos[starts[i]:min(starts[i + 1], starts[i] + depth)]]
+                for i in range(self.queries)]
+
+
+def grid(spec):
+    """
+        parameter: spec, 'start:stop:step' (stop included) or a list of values 'a,b,...'
+        return: list of float
+    """
+    if ':' in spec:
+        start, stop, step = (float(value) for value in spec.split(':'))
+        if step <= 0:
+            raise ValueError(spec)
+        return [round(start + i * step, 10) for i in range(int(math.floor((stop - start) / step + 1e-9)) + 1)]
+    return [float(value) for value in spec.split(',')]
+
+
+def sweep(collection, ks, bs, variants, metric='MAP'):
+    """
+        evaluate every (k, b, idf) against the qrels of `collection`
+        return: list of {'k', 'b', 'idf', 'means'}, the best `metric` first
+    """
+    ids, queries = read_queries(collection.queries)
+    qrels = evaluation.read_qrels(collection.qrels, collection.judged_nonrelevant)
+    scorer = Sweep(Index(collection).open(), queries)
+    points = []
+    for variant in variants:
+        for k in ks:
+            for b in bs:
+                rankings = scorer.rankings(k, b, variant)
+                # the same queries as results.txt, a query without any result is not in the file
+                per_query = {query_id: evaluation.evaluate_query(ranking, qrels.get(query_id))
+                             for query_id, ranking in zip(ids, rankings) if ranking}
+                points.append({'k': k, 'b': b, 'idf': variant, 'means': evaluation.means(per_query)})
+    # sorted is stable, the equal points keep the order of the grid
+    return sorted(points, key=lambda point: -point['means'].get(metric, 0))
+
+
+def report(points, metric='MAP'):
+    names = list(points[0]['means']) if points[0]['means'] else evaluation.METRICS
+    lines = [f'{"k":>6}{"b":>6}{"idf":>8}' + ''.join(f'{name:>13}' for name in names)]
+    for point in points:
+        # the setting of the engine
+        mark = '  <- engine' if (point['k'], point['b'], point['idf']) == (BM25.k, BM25.b, 'bm25') else ''
+        lines.append(f'{point["k"]:>6g}{point["b"]:>6g}{point["idf"]:>8}'
+                     + ''.join(f'{point["means"].get(name, 0):>13.4f}' for name in names) + mark)
+    best = points[0]
+    lines.append(f'Best {metric}: {best["means"].get(metric, 0):.4f} with k={best["k"]:g}, b={best["b"]:g}, idf={best["idf"]}')
+    return '\n'.join(lines)
+
+
+USAGE = '''Usage: python3 -m engine.tuning --corpus <name> [options], in the directory of a collection
+    --k <grid>       the values of k, start:stop:step or a,b,... (default 0.2:2:0.2)
+    --b <grid>       the values of b (default 0:1:0.05)
+    --idf <names>    the idf variants among bm25, lucene and idf (default bm25)
+    --metric <name>  the metric the settings are ranked by (default MAP)
+    -o <file>        also save the metrics of every setting as JSON
+'''
+
+
+def main():
+    ks = grid('0.2:2:0.2')
+    bs = grid('0:1:0.05')
+    variants = ['bm25']
+    metric = 'MAP'
+    output = None
+    collection = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:", ["corpus=", "k=", "b=", "idf=", "metric="])
+        for opt, arg in opts:
+            if opt == '-h':
+                print(USAGE)
+                sys.exit()
+            elif opt == '--corpus':
+                collection = COLLECTIONS[arg]()
+            elif opt == '--k':
+                ks = grid(arg)
+            elif opt == '--b':
+                bs = grid(arg)
+            elif opt == '--idf':
+                variants = arg.split(',')
+            elif opt == '--metric':
+                metric = arg
+            elif opt == '-o':
+                output = arg
+        if collection is None or not ks or not bs or any(variant not in IDF for variant in variants) \
+                or metric not in evaluation.METRICS + ['nDCG@10']:
+            raise ValueError
+    except (getopt.GetoptError, KeyError, ValueError):
+        print(USAGE)
+        sys.exit(2)
+    points = sweep(collection, ks, bs, variants, metric)
+    print(report(points, metric))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({'metric': metric, 'points': points}, f, indent=2)
+
+
+if __name__ == '__main__':
+    # files.porter is imported from the current directory, as the search programs do
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,64 @@
+"""
+The fixtures of the tests: a small synthetic collection generated by
+engine.benchmark, copied into a new directory for every test that builds an
+index. The stemmer of a collection is its files/porter.py, the one of the
+synthetic collection only strips a few suffixes.
+"""
+import sys
+import shutil
+import pytest
+from engine import benchmark
+from engine.collection import LargeCorpus
+
+STOPWORDS = ['the', 'of', 'and', 'a', 'to', 'in', 'is', 'for', 'on', 'that']
+STEMMER = '''
+class PorterStemmer:
+    # strips a few english suffixes, enough to tell stemmed words apart
+    def stem(self, word):
+        for suffix in ('ation', 'ness', 'ing', 'ed', 'ly', 'er', 's'):
+            if word.endswith(suffix) and len(word) > len(suffix) + 2:
+                return word[:-len(suffix)]
+        return word
+'''
+CONFIG = dict(benchmark.DEFAULTS, vocabulary=1500, doc_length=[20, 150], queries=15, lengths=[1, 2, 3, 5], seed=7)
+DOCUMENTS = 300
+
+
+@pytest.fixture(scope='session')
+def corpus(tmp_path_factory):
+    """
+        return: (the directory of the generated collection, list of its queries)
+    """
+    root = tmp_path_factory.mktemp('corpus')
+    stopwords = root / 'stopwords.txt'
+    stopwords.write_text('\n'.join(STOPWORDS) + '\n')
+    _, queries = benchmark.generate(str(root), dict(CONFIG, stopwords=str(stopwords)), DOCUMENTS)
+    (root / 'files' / 'porter.py').write_text(STEMMER)
+    # the stemmer is imported as files.porter, as the search programs do from the corpus directory
+    sys.path.insert(0, str(root))
+    # a few queries of frequent words, they have many documents of the same words
+    queries = [query for length in CONFIG['lengths'] for query in queries[length]]
+    queries += ['the', 'nothingsuch', 'the nothingsuch']
+    yield root, queries
+    sys.path.remove(str(root))
+
+
+@pytest.fixture
+def collection(corpus, tmp_path):
+    """
+        return: LargeCorpus of a copy of the generated collection in a new directory
+    """
+    root, _ = corpus
+    for name in ('documents', 'files'):
+        shutil.copytree(root / name, tmp_path / name)
+    return LargeCorpus(str(tmp_path))
+
+
+@pytest.fixture
+def queries(corpus):
+    return corpus[1]
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
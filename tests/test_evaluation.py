@@ -0,0 +1,99 @@
+"""
+The metrics of a hand-made run, the qrels of both corpora and the p-values
+of the paired tests.
+"""
+import math
+import itertools
+import pytest
+from engine import evaluation
+
+QRELS = '''1 0 a 1
+1 0 b 2
+1 0 x 0
+1 0 z -1
+2 0 c 1
+'''
+RUN = '''1 a 1 9.5
+1 x 2 8.0
+1 y 3 7.0
+1 b 4 6.5
+1 z 5 0.0
+2 d 1 3.0
+not a result
+'''
+
+
+@pytest.fixture
+def files(tmp_path):
+    qrels, run = tmp_path / 'qrels.txt', tmp_path / 'run.txt'
+    qrels.write_text(QRELS)
+    run.write_text(RUN)
+    return str(qrels), str(run)
+
+
+def test_read(files):
+    qrels, run = files
+    large = evaluation.read_qrels(qrels)
+    assert large['1'].relevant == {'a': 1, 'b': 2, 'z': 1}
+    assert large['1'].nonrelevant == {'x'}
+    small = evaluation.read_qrels(qrels, judged_nonrelevant=False)
+    assert small['1'].relevant == {'a': 1, 'b': 1, 'x': 1, 'z': 1}
+    assert small['1'].nonrelevant is None
+    # the documents of score 0 are not retrieved
+    assert evaluation.read_run(run) == {'1': ['a', 'x', 'y', 'b'], '2': ['d']}
+
+
+def test_metrics(files):
+    qrels, run = files
+    per_query = evaluation.evaluate_run(evaluation.read_run(run), evaluation.read_qrels(qrels), k=10)
+    metrics = per_query['1']
+    assert metrics['Precision'] == 2 / 4
+    assert metrics['Recall'] == 2 / 3
+    assert metrics['R-precision'] == 1 / 3
+    assert metrics['P@10'] == 2 / 10
+    assert metrics['MAP'] == pytest.approx((1 / 1 + 2 / 4) / 3)
+    # y is not judged, only x is counted before b
+    assert metrics['bpref'] == pytest.approx((1 + (1 - 1 / 3)) / 3)
+    ideal = 2 + 1 / math.log2(3) + 1 / math.log2(4)
+    assert metrics['nDCG@10'] == pytest.approx((1 + 2 / math.log2(5)) / ideal)
+    assert all(value == 0 for value in per_query['2'].values())
+    assert evaluation.means(per_query)['Precision'] == 1 / 4
+
+
+def test_t_test():
+    # one degree of freedom, the t distribution is Cauchy: p = 1 - 2 atan(t) / pi
+    assert evaluation.t_test([1, 3]) == pytest.approx(1 - 2 * math.atan(2) / math.pi)
+    # two degrees of freedom: p = 1 - t / sqrt(2 + t^2)
+    t = 2 / math.sqrt(1 / 3)
+    assert evaluation.t_test([1, 2, 3]) == pytest.approx(1 - t / math.sqrt(2 + t * t))
+    assert evaluation.t_test([0, 0, 0]) == 1.0
+    assert evaluation.t_test([1, 1, 1]) == 0.0
+    assert evaluation.t_test([1]) == 1.0
+
+
+def test_randomization_test():
+    assert evaluation.randomization_test([0.0] * 20) == 1.0
+    assert evaluation.randomization_test([]) == 1.0
+    differences = [0.3, -0.1, 0.25, 0.05, -0.2, 0.4, 0.1, 0.0, 0.15, -0.05, 0.2, 0.35]
+    # every flip of the signs, more than 8 differences use more than one table
+    total = abs(sum(differences))
+    exact = sum(abs(sum(d * sign for d, sign in zip(differences, signs))) >= total * (1 - 1e-9)
+                for signs in itertools.product((1, -1), repeat=len(differences))) / 2 ** len(differences)
+    p = evaluation.randomization_test(differences, trials=20000)
+    assert p == pytest.approx(exact, abs=0.01)
+    assert evaluation.randomization_test(differences, trials=20000) == p
+
+
+def test_compare_and_evaluate(files, tmp_path):
+    qrels, run = files
+    other = tmp_path / 'other.txt'
+    other.write_text('1 b 1 9.0\n1 a 2 8.0\n2 c 1 1.0\n')
+    judgments = evaluation.read_qrels(qrels)
+    evaluations = evaluation.evaluate(judgments, [run, str(other)], jobs=1, trials=100)
+    assert evaluations[0]['tests'] == dict()
+    tests = evaluations[1]['tests']
+    assert set(tests) == set(evaluation.METRICS) | {'nDCG@10'}
+    assert set(tests['MAP']) == {'t_test', 'randomization'}
+    assert set(tests['Precision']) == {'t_test'}
+    # the processes give the same evaluations
+    assert evaluation.evaluate(judgments, [run, str(other)], jobs=2, trials=100) == evaluations
@@ -0,0 +1,81 @@
+"""
+The index.bin built by processes, within a memory budget (SPIMI) or updated
+from an older index is byte for byte the one built in memory by one process.
+"""
+import os
+import json
+import shutil
+import pytest
+from engine import Index, Searcher
+from engine import index_format
+from conftest import read
+
+
+@pytest.fixture
+def expected(collection):
+    """
+        return: the bytes of the index built in memory by one process, it is removed
+    """
+    Index(collection).open()
+    index = read(collection.index)
+    os.remove(collection.index)
+    return index
+
+
+@pytest.mark.parametrize('jobs', [2, 3])
+def test_parallel(collection, expected, jobs):
+    Index(collection).open(jobs)
+    assert read(collection.index) == expected
+
+
+@pytest.mark.parametrize('memory', [1 << 14, 1 << 16])
+def test_spimi(collection, expected, memory):
+    Index(collection).open(memory=memory)
+    assert read(collection.index) == expected
+
+
+def test_incremental(collection, tmp_path):
+    names = sorted(os.listdir(collection.documents))
+    aside = tmp_path / 'aside'
+    aside.mkdir()
+    for name in names[100:130] + names[-10:]:
+        shutil.move(os.path.join(collection.documents, name), aside / name)
+    Index(collection).open()
+    # added back, one deleted and one changed
+    for name in os.listdir(aside):
+        shutil.move(aside / name, os.path.join(collection.documents, name))
+    os.remove(os.path.join(collection.documents, names[5]))
+    with open(os.path.join(collection.documents, names[50]), 'a') as f:
+        f.write('Zebra zebras crossing.\n')
+    index = Index(collection).open()
+    assert index.changes() == 0
+    updated = read(collection.index)
+    os.remove(collection.index)
+    Index(collection).open()
+    assert read(collection.index) == updated
+
+
+def test_written_size(collection):
+    index = Index(collection).open()
+    binary = index.binary
+    path = os.path.join(collection.root, 'copy.bin')
+    written = index_format.write(path, binary.avg_doc_len, binary.N, dict(binary.items()), dict(binary.frequency),
+                                 dict(zip(binary.doc_len.doc_ids, binary.doc_len.lengths)))
+    assert written == os.path.getsize(path)
+
+
+def test_converted_cache_without_documents(collection, queries):
+    index = Index(collection).open()
+    expected = [Searcher(index, cache_size=0).search(query, 15) for query in queries]
+    binary = index.binary
+    # the cache.json of the older version, without the documents next to it
+    with open(collection.json_cache, 'w') as f:
+        json.dump({'avg_doc_len': binary.avg_doc_len, 'N': binary.N, 'postings': dict(binary.items()),
+                   'frequency': dict(binary.frequency),
+                   'doc_len': dict(zip(binary.doc_len.doc_ids, binary.doc_len.lengths))}, f)
+    os.remove(collection.index)
+    shutil.rmtree(collection.documents)
+    for _ in range(2):
+        index = Index(collection).open()
+        assert index.binary.files is None
+        assert [Searcher(index, cache_size=0).search(query, 15) for query in queries] == expected
@@ -0,0 +1,81 @@
+"""
+The postings cache stays within its budget, evicts the least recently used
+word, and with tinylfu only admits a word read more often than the words it
+evicts. The results of the cached postings are the results of the index.
+"""
+import pytest
+from engine import Index, Searcher
+from engine.postings_cache import PostingsCache, FrequencySketch, postings_bytes, MAX_COUNT
+
+# the postings of every word have the same size
+POSTINGS = {word: [(doc_no, 1) for doc_no in range(10)] for word in 'abcdef'}
+SIZE = postings_bytes(POSTINGS['a'])
+
+
+def read(cache, words):
+    for word in words:
+        assert cache[word] == POSTINGS[word]
+
+
+def test_lru():
+    cache = PostingsCache(POSTINGS, 3 * SIZE)
+    read(cache, 'abca')
+    assert (cache.hits, cache.misses) == (1, 3)
+    # b is the least recently used
+    read(cache, 'd')
+    assert list(cache._entries) == ['c', 'a', 'd']
+    assert (cache.bytes, cache.evictions) == (3 * SIZE, 1)
+    read(cache, 'b')
+    assert list(cache._entries) == ['a', 'd', 'b']
+
+
+def test_tinylfu():
+    cache = PostingsCache(POSTINGS, 3 * SIZE, 'tinylfu')
+    read(cache, 'abc' * 3)
+    # a word read once does not evict the words read more often
+    read(cache, 'd')
+    assert list(cache._entries) == ['a', 'b', 'c']
+    assert cache.evictions == 0
+    # once read more often than a, it replaces it
+    read(cache, 'dddd')
+    assert list(cache._entries) == ['b', 'c', 'd']
+    assert cache.evictions == 1
+
+
+def test_budget():
+    cache = PostingsCache(POSTINGS, SIZE - 1)
+    # too large for the budget, read but not kept
+    read(cache, 'aa')
+    assert (cache.hits, cache.misses, cache.bytes) == (0, 2, 0)
+    with pytest.raises(KeyError):
+        cache['nothing']
+    with pytest.raises(ValueError):
+        PostingsCache(POSTINGS, SIZE, 'fifo')
+    assert len(cache) == len(POSTINGS) and dict(cache.items()) == POSTINGS
+
+
+def test_sketch_is_halved():
+    sketch = FrequencySketch(width=64, sample=40)
+    for _ in range(20):
+        sketch.add('a')
+    assert sketch.estimate('a') == MAX_COUNT
+    for _ in range(20):
+        sketch.add('b')
+    # the 40th read halves every counter
+    assert (sketch.estimate('a'), sketch.estimate('b')) == (MAX_COUNT // 2, MAX_COUNT // 2)
+    assert sketch.reads == 20
+
+
+@pytest.mark.parametrize('policy', ['lru', 'tinylfu'])
+def test_results_are_index(collection, queries, policy):
+    searcher = Searcher(Index(collection).open(), cache_size=0)
+    expected = [searcher.search(query, 15) for query in queries]
+    # less than the postings of the queries
+    budget = 1 << 16
+    index = Index(collection, postings_cache={'budget': budget, 'policy': policy}).open()
+    searcher = Searcher(index, cache_size=0)
+    for _ in range(2):
+        assert [searcher.search(query, 15) for query in queries] == expected
+    cache = index.postings
+    assert cache.hits and cache.evictions
+    assert cache.bytes <= budget
@@ -0,0 +1,161 @@
+"""
+The top k of every way of ranking is the top k of BM25.score(): MaxScore, the
+tiers, the NumPy batch and the impact scores, and the phrase and conjunctive
+queries only rank the documents that match them. The scores are the same
+whatever the string hashes of the process.
+"""
+import os
+import sys
+import json
+import subprocess
+import pytest
+from engine import Index, Searcher
+from engine import profiling
+from engine import positions as positional
+
+K = (1, 5, 15)
+
+
+def assert_top_k(searcher, queries):
+    for query in queries:
+        full = searcher.bm25.score(query)
+        for k in K:
+            assert searcher.search(query, k) == full[:k], (query, k)
+
+
+@pytest.mark.parametrize('impact_bits', [0, 64])
+def test_maxscore_is_score(collection, queries, impact_bits):
+    index = Index(collection).open(impact_bits=impact_bits)
+    assert_top_k(Searcher(index, cache_size=0), queries)
+
+
+@pytest.mark.parametrize('fraction', [0.1, 0.5])
+def test_tiers_are_score(collection, queries, fraction):
+    index = Index(collection).open(tiers=fraction)
+    searcher = Searcher(index, cache_size=0)
+    assert searcher.bm25.tiers is not None
+    with profiling.recording() as recorded:
+        assert_top_k(searcher, queries)
+    # some queries are answered from the tiers, not all by the MaxScore fallback
+    assert recorded.counters.get('tiers fallbacks', 0) < len(queries) * len(K)
+
+
+def test_pruned_ranks_first_tiers(collection, queries):
+    index = Index(collection).open(tiers=0.1)
+    searcher = Searcher(index, cache_size=0, pruned=True)
+    for query in queries:
+        results = searcher.search(query, 15)
+        scores = dict(Searcher(index, cache_size=0).bm25.score(query))
+        # the documents of the first tiers get their whole score, the others are not ranked
+        for doc_id, score in results:
+            assert score <= scores[doc_id] * (1 + 1e-9)
+
+
+def test_batch_is_search(collection, queries):
+    pytest.importorskip('numpy')
+    index = Index(collection).open()
+    searcher = Searcher(index, cache_size=0)
+    for k in K:
+        assert searcher.batch().search(queries, k) == [searcher.search(query, k) for query in queries]
+
+
+def test_cache_is_search(collection, queries):
+    index = Index(collection).open()
+    searcher = Searcher(index)
+    first = [searcher.search(query, 15) for query in queries]
+    assert [searcher.search(query, 15) for query in queries] == first
+    assert searcher.cached
+
+
+SEARCH = '''
+import sys, json
+from engine import Index, Searcher
+from engine.collection import LargeCorpus
+searcher = Searcher(Index(LargeCorpus(sys.argv[1])).open(positions=True), cache_size=0)
+print(json.dumps([searcher.search(query, 15) for query in json.loads(sys.argv[2])]))
+'''
+
+
+def test_scores_do_not_depend_on_hashes(collection, queries):
+    index = Index(collection).open(positions=True)
+    searcher = Searcher(index, cache_size=0)
+    queries = queries + [f'"{query}" {query}' for query in queries if len(query.split()) > 1]
+    expected = [[list(result) for result in searcher.search(query, 15)] for query in queries]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=os.pathsep.join([root] + sys.path))
+        output = subprocess.run([sys.executable, '-c', SEARCH, collection.root, json.dumps(queries)], env=env,
+                                check=True, capture_output=True, text=True).stdout
+        # the last line, the index prints what it loads
+        assert json.loads(output.splitlines()[-1]) == expected, seed
+
+
+def phrases(index, queries):
+    """
+        the phrases of two consecutive words of the queries, quoted
+    """
+    words = [query.split() for query in queries if len(query.split()) > 1]
+    return [f'"{a} {b}"' for query in words for a, b in zip(query, query[1:])]
+
+
+def test_phrases_only_rank_matches(collection, queries):
+    index = Index(collection).open(positions=True)
+    searcher = Searcher(index, cache_size=0)
+    bm25 = searcher.bm25
+    doc_ids = list(index.binary.doc_len.doc_ids)
+    found = 0
+    for query in phrases(index, queries):
+        bm25.terms(query)
+        if not bm25.phrases:
+            # a stopword and a word are only a word
+            continue
+        matched = {doc_ids[doc_no] for doc_no in positional.phrase_documents(index.positions, index.postings,
+                                                                            bm25.phrases[0])}
+        full = bm25.score(query)
+        assert {doc_id for doc_id, _ in full} == matched, query
+        for k in K:
+            assert searcher.search(query, k) == full[:k], (query, k)
+        found += 0 < len(matched) < 15
+    # some phrases have less than k documents, they are not padded
+    assert found
+
+
+def test_phrase_cache_keys(collection):
+    index = Index(collection).open(positions=True)
+    bm25 = Searcher(index, cache_size=0).bm25
+    # the same words, other phrases
+    assert bm25.terms('"alpha alpha" beta') != bm25.terms('"alpha beta alpha"')
+    assert bm25.terms('alpha "beta gamma"') == bm25.terms('"beta gamma" alpha')
+
+
+def test_conjunctive_only_ranks_every_word(collection, queries):
+    index = Index(collection).open()
+    searcher = Searcher(index, cache_size=0, conjunctive=True)
+    bm25 = searcher.bm25
+    stopwords = index.tokenizer.stopwords
+    doc_ids = list(index.binary.doc_len.doc_ids)
+    found = 0
+    for query in queries:
+        words = [word for word in bm25.terms(query) if word not in stopwords]
+        documents = [{doc_ids[doc_no] for doc_no, _ in index.postings.get(word, ())} for word in words]
+        matched = set.intersection(*documents) if documents else set()
+        full = bm25.score(query)
+        assert {doc_id for doc_id, _ in full} == matched, query
+        for k in K:
+            assert searcher.search(query, k) == full[:k], (query, k)
+        found += 0 < len(matched) < 15
+    assert found
+
+
+def test_conjunctive_strips_punctuation(collection, queries):
+    index = Index(collection).open()
+    searcher = Searcher(index, cache_size=0, conjunctive=True)
+    found = 0
+    for query in queries:
+        words = query.split()
+        # the punctuation of a sentence around the words, and a mark alone
+        punctuated = ' '.join([f'({words[0]}'] + words[1:-1] + [f'{words[-1]}?', '-'])
+        expected = searcher.search(query, 15)
+        assert searcher.search(punctuated, 15) == expected, punctuated
+        found += bool(expected) and len(words) > 1
+    assert found
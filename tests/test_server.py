@@ -0,0 +1,105 @@
+"""
+The query server answers as the Searcher, its cache tells the phrases apart,
+and it refuses the requests over its limits.
+"""
+import json
+import asyncio
+import pytest
+from engine import Index, Searcher
+from engine import server as serving
+from engine.server import Server
+
+
+@pytest.fixture
+def server(collection):
+    server = Server(Index(collection).open(), workers=0, cache_size=100)
+    yield server
+    server.pool.shutdown()
+
+
+def request(server, data):
+    """
+        send the bytes of one request to `server` on a free port
+        return: the status and the JSON response
+    """
+    async def send():
+        listening = await asyncio.start_server(server.connection, '127.0.0.1', 0)
+        async with listening:
+            reader, writer = await asyncio.open_connection(*listening.sockets[0].getsockname()[:2])
+            writer.write(data)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+
+    head, _, body = asyncio.run(send()).partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def get(target, headers=b''):
+    return b'GET ' + target.encode() + b' HTTP/1.1\r\nConnection: close\r\n' + headers + b'\r\n'
+
+
+def test_search(server, queries):
+    searcher = Searcher(server.index, cache_size=0)
+    status, response = request(server, get('/search?q=' + queries[0].replace(' ', '+') + '&k=5'))
+    assert status == 200
+    assert [(result['doc_id'], result['score']) for result in response['results']] == searcher.search(queries[0], 5)
+    body = json.dumps({'q': queries[0], 'k': 5}).encode()
+    status, response = request(server, b'POST /search HTTP/1.1\r\nConnection: close\r\nContent-Length: '
+                               + str(len(body)).encode() + b'\r\n\r\n' + body)
+    assert status == 200 and response['cached']
+    status, response = request(server, get('/stats'))
+    assert status == 200 and response['cache']['hits'] == 1
+
+
+@pytest.mark.parametrize('data, status', [
+    (get('/other'), 404),
+    (get('/search?q=a&k=0'), 400),
+    (b'PUT /search HTTP/1.1\r\nConnection: close\r\n\r\n', 405),
+    (b'GET\r\n\r\n', 400),
+    (get('/search?q=' + 'a' * 70000), 414),
+    (get('/search?q=a', b'X-Long: ' + b'a' * 70000 + b'\r\n'), 431),
+    (get('/search?q=a', b'X-Many: a\r\n' * serving.MAX_HEADERS), 431),
+    (get('/search?q=a', (b'X-Some: ' + b'a' * 1000 + b'\r\n') * 60), 200),
+    (get('/search?q=a', (b'X-Some: ' + b'a' * 1000 + b'\r\n') * 70), 431),
+    (get('/search?q=a', b'Content-Length: -1\r\n'), 400),
+    (get('/search?q=a', b'Content-Length: one\r\n'), 400),
+    (get('/search?q=a', f'Content-Length: {serving.MAX_BODY + 1}\r\n'.encode()), 413),
+])
+def test_limits(server, data, status):
+    assert request(server, data)[0] == status
+
+
+def test_internal_error(server, capsys):
+    def fail(query, k):
+        raise RuntimeError('the secret path /index.bin')
+
+    server._search = fail
+    status, response = request(server, get('/search?q=a'))
+    assert (status, response) == (500, {'error': 'internal error'})
+    assert 'secret' in capsys.readouterr().err
+    assert server.stats.errors == 1
+
+
+def test_phrase_cache_keys(collection, queries):
+    index = Index(collection).open(positions=True)
+    searcher = Searcher(index, cache_size=0)
+    server = Server(index, workers=0, cache_size=100)
+    words = list(dict.fromkeys(word for query in queries for word in query.split()
+                               if word not in index.tokenizer.stopwords))
+    # the same bag of words (even with the quotes), other phrases, with other results
+    first, second = next((f'"{a} {a}" {b}', f'"{a} {b} {a}"') for a in words for b in words
+                         if searcher.search(f'"{a} {a}" {b}', 15) != searcher.search(f'"{a} {b} {a}"', 15))
+
+    async def search(query):
+        return await server.search(query, 15)
+
+    try:
+        for query in (first, second, first):
+            response = asyncio.run(search(query))
+            assert [(result['doc_id'], result['score']) for result in response['results']] == searcher.search(query, 15)
+        assert response['cached']
+        assert len(server.cache) == 2
+    finally:
+        server.pool.shutdown()
@@ -0,0 +1,25 @@
+"""
+The shards searched by scatter-gather give the results of the single index.
+"""
+import pytest
+from engine import Index, Searcher
+from engine import shards as sharding
+
+
+@pytest.mark.parametrize('count', [2, 3])
+def test_shards_are_index(collection, queries, count):
+    expected = Searcher(Index(collection).open(), cache_size=0).search_many(queries, 15)
+    searcher = sharding.open_shards(collection, count, cache_size=0)
+    try:
+        assert searcher.search_many(queries, 15) == expected
+        assert [searcher.search(query, 5) for query in queries] == [results[:5] for results in expected]
+    finally:
+        searcher.close()
+
+
+def test_shard_key_is_required(monkeypatch):
+    monkeypatch.delenv(sharding.KEY_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        sharding.shard_key()
+    monkeypatch.setenv(sharding.KEY_VARIABLE, 'secret')
+    assert sharding.shard_key() == b'secret'
@@ -0,0 +1,67 @@
+"""
+The segments flushed by SpimiIndex within its budget merge into the postings
+of the CompactIndex of the same documents.
+"""
+import os
+import random
+from engine.compact_index import CompactIndex
+from engine.spimi import SpimiIndex
+
+# words out of the ascii order of their utf-8 bytes
+WORDS = ['zebra', 'apple', 'émile', 'apples', 'b', 'ünder', 'café', 'a'] + [f'w{i}' for i in range(200)]
+
+
+def add(index, documents):
+    for doc_id, words in documents:
+        doc_no = index.add_document(doc_id, sum(words.values()), None)
+        for word, tf in words.items():
+            index.add(word, doc_no, tf)
+    index.finish()
+
+
+def documents(count, seed=3):
+    generator = random.Random(seed)
+    return [(f'D{i}', {word: generator.randint(1, 5) for word in generator.sample(WORDS, generator.randint(1, 30))})
+            for i in range(count)]
+
+
+def test_segments_are_compact_index(tmp_path):
+    expected = CompactIndex()
+    add(expected, documents(300))
+    spimi = SpimiIndex(str(tmp_path), 1 << 13)
+    add(spimi, documents(300))
+    try:
+        # the budget is far less than the postings
+        assert len(spimi.segments) > 5
+        assert [(word, list(postings)) for word, postings in spimi.items()] == \
+               [(word, list(postings)) for word, postings in expected.items()]
+        assert spimi.frequency == dict(expected.frequency)
+        assert (spimi.N, spimi.avg_doc_len) == (expected.N, expected.avg_doc_len)
+        assert list(spimi.doc_len.doc_ids) == list(expected.doc_len.doc_ids)
+    finally:
+        spimi.close()
+    assert not os.path.exists(spimi.directory)
+
+
+def test_documents_out_of_order(tmp_path):
+    # the documents copied from the old index are added after the new ones, with lower doc_no
+    spimi = SpimiIndex(str(tmp_path), 1)
+    for doc_no, tf in ((4, 1), (5, 2), (1, 3), (2, 4), (6, 5)):
+        spimi.add('word', doc_no, tf)
+    spimi.finish()
+    try:
+        assert len(spimi.segments) == 5
+        assert [(word, list(postings)) for word, postings in spimi.items()] == \
+               [('word', [(1, 3), (2, 4), (4, 1), (5, 2), (6, 5)])]
+    finally:
+        spimi.close()
+
+
+def test_empty(tmp_path):
+    spimi = SpimiIndex(str(tmp_path), 1 << 20)
+    spimi.finish()
+    try:
+        assert (spimi.N, spimi.avg_doc_len, spimi.segments) == (0, 0, [])
+        assert list(spimi.items()) == []
+    finally:
+        spimi.close()
@@ -0,0 +1,53 @@
+"""
+The rankings of the sweep are the ones of the engine for any k and b, and the
+grid points are ranked by the metric.
+"""
+import pytest
+from engine import Index, Searcher
+
+np = pytest.importorskip('numpy')
+from engine import tuning
+from engine import evaluation
+
+
+def test_grid():
+    assert tuning.grid('0:1:0.25') == [0, 0.25, 0.5, 0.75, 1]
+    assert tuning.grid('0.2:2:0.2')[-1] == 2
+    assert tuning.grid('1,1.5') == [1, 1.5]
+    with pytest.raises(ValueError):
+        tuning.grid('0:1:0')
+
+
+@pytest.mark.parametrize('k, b', [(1, 0.75), (1.6, 0.3), (0.4, 1)])
+def test_rankings_are_search(collection, queries, k, b):
+    index = Index(collection).open()
+    searcher = Searcher(index, cache_size=0, k=k, b=b)
+    expected = [[doc_id for doc_id, score in searcher.search(query, tuning.DEPTH) if score > 0] for query in queries]
+    assert tuning.Sweep(index, queries).rankings(k, b) == expected
+
+
+def test_sweep_ranks_by_metric(collection, queries):
+    index = Index(collection).open()
+    # the top 3 of k=1.5, b=0.3 are the relevant documents
+    searcher = Searcher(index, cache_size=0, k=1.5, b=0.3)
+    with open(collection.queries, 'w') as f:
+        f.writelines(f'{100 + i} {query}\n' for i, query in enumerate(queries))
+    with open(collection.qrels, 'w') as f:
+        f.writelines(f'{100 + i} 0 {doc_id} 1\n' for i, query in enumerate(queries)
+                     for doc_id, score in searcher.search(query, 3) if score > 0)
+    points = tuning.sweep(collection, [1, 1.5], [0.3, 0.75], ['bm25', 'lucene'])
+    assert len(points) == 8
+    values = [point['means']['MAP'] for point in points]
+    assert values == sorted(values, reverse=True)
+    judged = next(point for point in points if (point['k'], point['b'], point['idf']) == (1.5, 0.3, 'bm25'))
+    assert judged['means']['MAP'] == values[0] == 1
+    # the setting of the engine is evaluated as its results
+    qrels = evaluation.read_qrels(collection.qrels, collection.judged_nonrelevant)
+    searcher = Searcher(index, cache_size=0)
+    rankings = {str(100 + i): [doc_id for doc_id, score in searcher.search(query, tuning.DEPTH) if score > 0]
+                for i, query in enumerate(queries)}
+    # a query without any result is not in results.txt
+    run = {query_id: ranking for query_id, ranking in rankings.items() if ranking}
+    expected = evaluation.means(evaluation.evaluate_run(run, qrels))
+    engine = next(point for point in points if (point['k'], point['b'], point['idf']) == (1, 0.75, 'bm25'))
+    assert engine['means'] == expected